@@ -8,9 +8,9 @@ FOCAL_LENGTH=2559.68
 PRINCIPAL_POINT_X=1536
 PRINCIPAL_POINT_Y=1152
 RANSAC_ITERATIONS=1000
-RANSAC_THRESHOLD=0.01
-HARRIS_k=0.04
-HARRIS_THRESHOLD=1e6 
+RANSAC_THRESHOLD=1.0
+HARRIS_k=0.03
+HARRIS_THRESHOLD=5000 
 
 
 
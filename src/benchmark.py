@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+import argparse
+import inspect
+import json
+import sys
+import time
+
+import numpy as np
+
+import bundle_adjustment as ba
+import camera_motion as cm
+import data_loader
+import evaluation as ev
+import feature_description as fp
+import feature_detection as fd
+import features as fs
+import feature_matching as fm
+import fundamental_matrix as fdm
+import triangulation as tg
+
+
+def time_call(func, *args, repeat=3, **kwargs):
+    """
+    Time a function call, keeping the best of `repeat` runs.
+
+    Returns:
+        best: Best wall-clock time in seconds.
+        result: Return value of the last call.
+    """
+    best = np.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_convolve(sizes=((120, 160), (240, 320), (480, 640)), seed=0):
+    """
+    Compare the vectorized convolution against the per-pixel reference loop
+    and check that both produce identical arrays.
+    """
+    rng = np.random.default_rng(seed)
+    kernels = {
+        'sobel': np.outer(fd.SOBEL_SMOOTH, fd.SOBEL_DERIVATIVE),
+        'finite-difference': np.array([[-1, 1]]),
+    }
+
+    print(f"{'size':>10} {'kernel':>18} {'loop [s]':>10} {'fast [s]':>10} {'speedup':>8} {'equal':>6}")
+    for (H, W) in sizes:
+        image = rng.integers(0, 256, size=(H, W), dtype=np.uint8)
+        for name, kernel in kernels.items():
+            t_loop, (ref_x, ref_y) = time_call(
+                lambda: (fd.convolve_loop(image, kernel), fd.convolve_loop(image, kernel.T)), repeat=1)
+            t_fast, (Ix, Iy) = time_call(fd.compute_image_gradients, image, kernel_=name)
+            equal = (Ix.dtype == ref_x.dtype and np.array_equal(Ix, ref_x) and np.array_equal(Iy, ref_y))
+            print(f"{H:>4}x{W:<5} {name:>18} {t_loop:>10.4f} {t_fast:>10.4f} {t_loop / t_fast:>8.1f} {str(equal):>6}")
+
+
+def benchmark_harris(size=(240, 320), window_sizes=(3, 5, 9, 15, 31), seed=0):
+    """
+    Compare the summed-area-table Harris response against the per-pixel loop
+    for growing window sizes.
+    """
+    rng = np.random.default_rng(seed)
+    H, W = size
+    image = rng.integers(0, 256, size=(H, W), dtype=np.uint8)
+    Ix, Iy = fd.compute_image_gradients(image)
+
+    print(f"{'window':>6} {'loop [s]':>10} {'box [s]':>10} {'gauss [s]':>10} {'speedup':>8} {'equal':>6}")
+    for window_size in window_sizes:
+        t_loop, ref = time_call(fd.compute_harris_response_loop, Ix, Iy, window_size, 0.04, repeat=1)
+        t_box, R = time_call(fd.compute_harris_response, Ix, Iy, window_size, 0.04)
+        t_gauss, _ = time_call(fd.compute_harris_response, Ix, Iy, window_size, 0.04, window='gaussian')
+        equal = np.array_equal(R, ref)
+        print(f"{window_size:>6} {t_loop:>10.4f} {t_box:>10.4f} {t_gauss:>10.4f} {t_loop / t_box:>8.1f} {str(equal):>6}")
+
+
+def random_descriptors(n_1, n_2, dim=81, n_shared=None, noise=0.1, seed=0):
+    """
+    Two sets of normalized float32 descriptors where the first n_shared rows
+    of the second set are noisy copies of rows of the first set.
+    """
+    rng = np.random.default_rng(seed)
+    if n_shared is None:
+        n_shared = min(n_1, n_2) // 2
+    desc_1 = rng.standard_normal((n_1, dim))
+    desc_2 = rng.standard_normal((n_2, dim))
+    desc_2[:n_shared] = desc_1[:n_shared] + noise * rng.standard_normal((n_shared, dim))
+    for desc in (desc_1, desc_2):
+        desc -= desc.mean(axis=1, keepdims=True)
+        desc /= desc.std(axis=1, keepdims=True)
+    return desc_1.astype(np.float32), desc_2.astype(np.float32)
+
+
+def random_binary_descriptors(n_1, n_2, n_bits=256, n_shared=None, flip=0.1, seed=0):
+    """
+    Two sets of packed binary descriptors where the first n_shared rows of
+    the second set are copies of rows of the first set with a fraction flip
+    of their bits flipped.
+    """
+    rng = np.random.default_rng(seed)
+    if n_shared is None:
+        n_shared = min(n_1, n_2) // 2
+    bits_1 = rng.random((n_1, n_bits)) < 0.5
+    bits_2 = rng.random((n_2, n_bits)) < 0.5
+    bits_2[:n_shared] = bits_1[:n_shared] ^ (rng.random((n_shared, n_bits)) < flip)
+    return np.packbits(bits_1, axis=1), np.packbits(bits_2, axis=1)
+
+
+def benchmark_matching(sizes=(500, 1000, 2000, 4000), seed=0):
+    """
+    Compare the matrix-form matchers against the per-descriptor loops and
+    check that both return the same matches.
+    """
+    print(f"{'N':>6} {'matcher':>14} {'loop [s]':>10} {'matrix [s]':>10} {'speedup':>8} {'equal':>6}")
+    for n in sizes:
+        desc_1, desc_2 = random_descriptors(n, n, seed=seed)
+        for name, loop, fast in (('ratio', fm.match_features_loop, fm.match_features),
+                                 ('bidirectional', fm.match_features_bidirectional_loop, fm.match_features_bidirectional)):
+            t_loop, ref = time_call(loop, desc_1, desc_2, repeat=1)
+            t_fast, matches = time_call(fast, desc_1, desc_2)
+            equal = matches == [(int(i), int(j)) for i, j in ref]
+            print(f"{n:>6} {name:>14} {t_loop:>10.4f} {t_fast:>10.4f} {t_loop / t_fast:>8.1f} {str(equal):>6}")
+
+
+def dataset_descriptors(image_dir, data_name, max_images=4, max_keypoints=5000):
+    """
+    Harris keypoint descriptors of the first max_images images of a dataset,
+    detected with the settings used by main.py.
+    """
+    gray, _ = data_loader.load_images(image_dir, data_name)
+    descriptors = []
+    for image in gray[:max_images]:
+        keypoints = fd.harris_corner_detector(image, window_size=5, k=0.03, threshold=5000, max_keypoints=max_keypoints)
+        descriptors.append(fp.extract_descriptors(image, keypoints, patch_size=9))
+    return descriptors
+
+
+def benchmark_ann(image_dir=None, data_name='colmap', configs=((2, 14, 0), (4, 12, 2), (4, 12, 4), (8, 12, 4)), seed=0):
+    """
+    Recall and speed of LSHIndex matching against brute force, for several
+    (n_tables, n_bits, n_probes) settings. Uses consecutive image pairs of a
+    dataset when image_dir is given, random descriptors otherwise.
+
+    Recall is the fraction of brute-force ratio-test matches that the index
+    also returns; precision the fraction of index matches brute force agrees with.
+    """
+    if image_dir is not None:
+        descriptors = dataset_descriptors(image_dir, data_name)
+        pairs = [(descriptors[i], descriptors[i+1]) for i in range(len(descriptors) - 1)]
+    else:
+        pairs = [random_descriptors(20000, 20000, n_shared=8000, seed=seed)]
+
+    print(f"{'pair':>4} {'tables':>6} {'bits':>4} {'probes':>6} {'build [s]':>9} {'query [s]':>9} {'brute [s]':>9} {'speedup':>8} {'recall':>7} {'precision':>9}")
+    for p, (desc_1, desc_2) in enumerate(pairs):
+        t_brute, ref = time_call(fm.match_features, desc_1, desc_2, repeat=1)
+        ref = set(ref)
+        for n_tables, n_bits, n_probes in configs:
+            t_build, index = time_call(fm.LSHIndex, desc_2, n_tables, n_bits, n_probes, seed=seed, repeat=1)
+            t_query, matches = time_call(fm.match_features, desc_1, desc_2, index=index, repeat=1)
+            found = len(ref & set(matches))
+            recall = found / max(len(ref), 1)
+            precision = found / max(len(matches), 1)
+            print(f"{p:>4} {n_tables:>6} {n_bits:>4} {n_probes:>6} {t_build:>9.3f} {t_query:>9.3f} {t_brute:>9.3f} "
+                  f"{t_brute / t_query:>8.1f} {recall:>7.3f} {precision:>9.3f}")
+
+
+def benchmark_ransac(outlier_ratios=(0.1, 0.3, 0.5), n_points=1000, trials=10, max_iterations=5000):
+    """
+    Hypotheses needed by RANSAC on synthetic 3072x2304 two-view scenes: the
+    raw 8-point algorithm with an algebraic threshold, the normalized 8-point
+    algorithm with Sampson distance with and without local optimization, and
+    the calibrated 5-point solver.
+
+    'found' is the hypothesis at which the returned model was found and
+    'stopped' the number drawn before adaptive termination, both averaged over
+    the trials. Recall and precision compare the inliers to the ground truth.
+    """
+    def ransac_E(matches, key1, key2, scene, **kwargs):
+        return fdm.ransac_E(matches, key1, key2, scene['K'], **kwargs)
+
+    def ransac_F(matches, key1, key2, scene, **kwargs):
+        return fdm.ransac_F(matches, key1, key2, **kwargs)
+
+    methods = {
+        'raw/algebraic': (ransac_F, dict(threshold=1e-2, error='algebraic', normalize=False, local_optimization=False)),
+        'norm/sampson': (ransac_F, dict(threshold=1.0, error='sampson', normalize=True, local_optimization=False)),
+        'norm/sampson/LO': (ransac_F, dict(threshold=1.0, error='sampson', normalize=True, local_optimization=True)),
+        '5point/LO': (ransac_E, dict(threshold=1.0, error='sampson', local_optimization=True)),
+    }
+
+    print(f"{'outliers':>8} {'method':>16} {'found':>8} {'stopped':>8} {'time [s]':>9} {'recall':>7} {'precision':>9}")
+    for outlier_ratio in outlier_ratios:
+        for name, (estimator, kwargs) in methods.items():
+            found, stopped, times, recalls, precisions = [], [], [], [], []
+            for trial in range(trials):
+                scene = ev.synthetic_two_view(n_points, outlier_ratio=outlier_ratio, seed=trial)
+                t, (_, inliers, info) = time_call(
+                    estimator, scene['matches'], scene['keypoints1'], scene['keypoints2'], scene,
+                    num_iterations=max_iterations, seed=trial, return_info=True, repeat=1, **kwargs)
+                estimated = np.zeros(n_points, dtype=bool)
+                estimated[[i for i, _ in inliers]] = True
+                found.append(info['best_iteration'])
+                stopped.append(info['iterations'])
+                times.append(t)
+                recalls.append((estimated & scene['inliers']).sum() / scene['inliers'].sum())
+                precisions.append((estimated & scene['inliers']).sum() / max(estimated.sum(), 1))
+            print(f"{outlier_ratio:>8.2f} {name:>16} {np.mean(found):>8.1f} {np.mean(stopped):>8.1f} {np.mean(times):>9.4f} "
+                  f"{np.mean(recalls):>7.3f} {np.mean(precisions):>9.3f}")
+
+def benchmark_triangulation(sizes=(1000, 5000, 20000), seed=0):
+    """
+    Compare batched DLT and midpoint triangulation against the per-point
+    SVD, and the single four-candidate call against four separate ones.
+    """
+    print(f"{'N':>6} {'loop [s]':>9} {'dlt [s]':>9} {'midpoint [s]':>12} {'4 calls [s]':>11} {'4-cand [s]':>10} {'max diff':>9}")
+    for n in sizes:
+        scene = ev.synthetic_two_view(n, outlier_ratio=0.0, seed=seed)
+        K, R, t = scene['K'], scene['R'], scene['t']
+        key1, key2, matches = scene['keypoints1'], scene['keypoints2'], scene['matches']
+        P1 = K @ np.hstack((np.eye(3), np.zeros((3, 1))))
+        Rs, ts = tg.pose_candidates(R, R.T, t)
+        P2_candidates = K @ np.concatenate((Rs, ts[:, :, None]), axis=2)
+
+        def loop(P2):
+            return np.array([tg.triangulate_point(P1, P2, [*key1[i], 1], [*key2[j], 1]) for i, j in matches])
+
+        t_loop, ref = time_call(loop, P2_candidates[0], repeat=1)
+        t_dlt, points = time_call(tg.triangulate_points, P1, P2_candidates[0], key1, key2, matches)
+        t_mid, _ = time_call(tg.triangulate_points, P1, P2_candidates[0], key1, key2, matches, method='midpoint')
+        t_four, _ = time_call(lambda: [tg.triangulate_points(P1, P2, key1, key2, matches) for P2 in P2_candidates])
+        t_cand, _ = time_call(tg.select_pose, P1, P2_candidates, key1, key2, matches)
+        print(f"{n:>6} {t_loop:>9.4f} {t_dlt:>9.4f} {t_mid:>12.4f} {t_four:>11.4f} {t_cand:>10.4f} {np.abs(points - ref).max():>9.1e}")
+
+
+def benchmark_features(image_dir=None, data_name='colmap', n_images=8, size=(768, 1024), worker_counts=(1, 2, 4), seed=0):
+    """
+    Time the feature stage: the old pair loop, which detects and describes
+    every interior image twice, against iter_features with growing pools.
+    """
+    if image_dir is not None:
+        images, _ = data_loader.load_images(image_dir, data_name)
+    else:
+        rng = np.random.default_rng(seed)
+        images = [fd.box_sum(rng.integers(0, 256, size=size), 5).astype(np.uint8) for _ in range(n_images)]
+    detector_kwargs = dict(window_size=5, k=0.03, threshold=5000, max_keypoints=5000)
+
+    def pair_loop():
+        for i in range(len(images) - 1):
+            fs.detect_and_describe(images[i], detector_kwargs)
+            fs.detect_and_describe(images[i+1], detector_kwargs)
+
+    t_pairs, _ = time_call(pair_loop, repeat=1)
+    print(f"{'stage':>22} {'time [s]':>9} {'speedup':>8}")
+    print(f"{'pair loop':>22} {t_pairs:>9.3f} {1.0:>8.1f}")
+    for executor in ('process', 'thread'):
+        for workers in worker_counts:
+            t, _ = time_call(lambda: list(fs.iter_features(images, detector_kwargs, workers=workers, executor=executor)), repeat=1)
+            print(f"{executor + ' x' + str(workers):>22} {t:>9.3f} {t_pairs / t:>8.1f}")
+
+
+def benchmark_pyramid(image_dir=None, data_name='colmap', size=(2304, 3072), settings=((0,), (1,), (2,), (0, 1, 2)), seed=0):
+    """
+    Feature stage time for detection on different pyramid octaves, on one
+    dataset image or a synthetic 3072x2304 image.
+    """
+    if image_dir is not None:
+        image, _ = data_loader.decode_image(data_loader.list_images(image_dir, data_name)[0])
+    else:
+        rng = np.random.default_rng(seed)
+        image = fd.box_sum(rng.integers(0, 256, size=size), 7).astype(np.uint8)
+    detector_kwargs = dict(window_size=5, k=0.03, threshold=5000, max_keypoints=5000)
+
+    print(f"{'octaves':>10} {'pyramid':>9} {'time [s]':>9} {'keypoints':>9}")
+    for octaves in settings:
+        for method in ('gaussian', 'box'):
+            t, (keypoints, _) = time_call(fs.detect_and_describe, image, detector_kwargs, 9, octaves, method, repeat=1)
+            print(f"{str(octaves):>10} {method:>9} {t:>9.3f} {len(keypoints):>9}")
+
+
+def benchmark_bundle_adjustment(sizes=((5, 500), (10, 1000), (20, 2000), (40, 4000)), max_dense=4000, seed=0):
+    """
+    Bundle adjustment on synthetic sequences with perturbed cameras and
+    points. Reports the time of the Schur-complement solver, one dense
+    normal equation solve over all (cameras + points) parameters for the
+    smaller scenes, and the reprojection RMS and pose errors before and after.
+    """
+    print(f"{'cams':>5} {'points':>6} {'obs':>6} {'BA [s]':>8} {'iters':>5} {'dense step [s]':>14} "
+          f"{'rms before':>10} {'rms after':>9} {'rot [deg]':>9} {'center':>8}")
+    for n_cameras, n_points in sizes:
+        scene = ev.synthetic_multi_view(n_cameras, n_points, seed=seed)
+        K, cameras, points, keypoints = scene['K'], scene['cameras'], scene['points'], scene['keypoints']
+        rng = np.random.default_rng(seed)
+
+        # the first two cameras fix the gauge, including the scale
+        rotations, translations = scene['rotations'].copy(), scene['translations'].copy()
+        rotations[2:] = cm.rotation_from_vector(0.01 * rng.standard_normal((n_cameras - 2, 3))) @ rotations[2:]
+        translations[2:] += 0.02 * rng.standard_normal((n_cameras - 2, 3))
+        points_3d = scene['points_3d'] + 0.05 * rng.standard_normal((n_points, 3))
+
+        t_ba, (R, t, _, info) = time_call(ba.bundle_adjust, K, rotations, translations, points_3d, cameras, points,
+                                          keypoints, fixed_cameras=(0, 1), return_info=True, repeat=1)
+
+        n_unknowns = 6 * (n_cameras - 2) + 3 * n_points
+        t_dense = '-'
+        if n_unknowns <= max_dense:
+            J = rng.standard_normal((2 * len(cameras), n_unknowns))
+            t_dense, _ = time_call(lambda: np.linalg.solve(J.T @ J + np.eye(n_unknowns), J.T @ np.ones(len(J))), repeat=1)
+            t_dense = f"{t_dense:.3f}"
+
+        rms_before = np.sqrt(2 * info['initial_cost'] / len(cameras))
+        rms_after = np.sqrt(2 * info['final_cost'] / len(cameras))
+        angle = np.rad2deg(np.linalg.norm(cm.vector_from_rotation(R @ np.transpose(scene['rotations'], (0, 2, 1))), axis=1)).max()
+        center = np.linalg.norm(cm.camera_center(R, t) - cm.camera_center(scene['rotations'], scene['translations']), axis=1).max()
+        print(f"{n_cameras:>5} {n_points:>6} {len(cameras):>6} {t_ba:>8.3f} {info['iterations']:>5} {t_dense:>14} "
+              f"{rms_before:>10.2f} {rms_after:>9.3f} {angle:>9.4f} {center:>8.4f}")
+
+
+def _two_view_pose(estimator, matches, key1, key2, K, seed=0):
+    """
+    Relative pose, inlier matches and triangulated points of a matched pair,
+    as estimated by main.py.
+    """
+    if estimator == '5point':
+        E, inliers = fdm.ransac_E(matches, key1, key2, K, seed=seed)
+    else:
+        F, inliers = fdm.ransac_F(matches, key1, key2, seed=seed)
+        E = fdm.compute_essential_matrix(F, K)
+    R1, R2, t = fdm.decompose_essential_matrix(E)
+    Rs, ts = tg.pose_candidates(R1, R2, t)
+    P1 = K @ np.hstack((np.eye(3), np.zeros((3, 1))))
+    index, points_3d, in_front = tg.select_pose(P1, K @ np.concatenate((Rs, ts[:, :, None]), axis=2), key1, key2, inliers)
+    if index is None:
+        return None
+    inliers = np.asarray(inliers, dtype=np.int64).reshape(-1, 2)
+    return Rs[index], ts[index], inliers[in_front], points_3d[in_front]
+
+
+def _pose_errors(K, R_true, t_true, pose, key1, key2):
+    if pose is None:
+        return np.nan, np.nan, np.nan
+    R, t, inliers, points_3d = pose
+    rms = max(ev.reprojection_rms(K, np.eye(3), np.zeros(3), points_3d, key1[inliers[:, 0]]),
+              ev.reprojection_rms(K, R, t, points_3d, key2[inliers[:, 1]]))
+    return ev.rotation_error(R, R_true), ev.translation_error(t, t_true), rms
+
+
+def benchmark_timings(image_sizes=((240, 320), (480, 640), (960, 1280)), descriptor_counts=(1000, 2000, 4000),
+                      match_counts=(500, 2000, 8000), point_counts=(1000, 10000, 100000), seed=0):
+    """
+    Time the main pipeline functions over a range of input sizes on
+    synthetic data: Harris on rendered images, matching on random float
+    and binary descriptors (guided by the epipolar geometry of a synthetic
+    two-view scene), RANSAC and triangulation on synthetic two-view scenes.
+
+    Returns:
+        metrics: Times in seconds keyed 'time/<function>/<size>'.
+    """
+    metrics = {}
+    for (H, W) in image_sizes:
+        image = ev.render_textured_views(1, (W, H), focal=0.8 * W, seed=seed)['images'][0]
+        metrics[f"time/harris_corner_detector/{H}x{W}"], _ = time_call(
+            fd.harris_corner_detector, image, window_size=5, k=0.03, threshold=5000, max_keypoints=5000)
+    for n in descriptor_counts:
+        desc_1, desc_2 = random_descriptors(n, n, seed=seed)
+        metrics[f"time/match_features/{n}"], _ = time_call(fm.match_features, desc_1, desc_2)
+        metrics[f"time/match_features_binary/{n}"], _ = time_call(fm.match_features, *random_binary_descriptors(n, n, seed=seed))
+        scene = ev.synthetic_two_view(n, outlier_ratio=0.0, seed=seed)
+        F = fdm.essential_to_fundamental(cm.skew(scene['t']) @ scene['R'], scene['K'])
+        metrics[f"time/match_features_guided/{n}"], _ = time_call(
+            fm.match_features_guided, desc_1, desc_2, scene['keypoints1'], scene['keypoints2'], F)
+    for n in match_counts:
+        scene = ev.synthetic_two_view(n, outlier_ratio=0.3, seed=seed)
+        metrics[f"time/ransac_F/{n}"], _ = time_call(
+            fdm.ransac_F, scene['matches'], scene['keypoints1'], scene['keypoints2'], seed=seed)
+    for n in point_counts:
+        scene = ev.synthetic_two_view(n, outlier_ratio=0.0, seed=seed)
+        P1 = scene['K'] @ np.hstack((np.eye(3), np.zeros((3, 1))))
+        P2 = scene['K'] @ np.hstack((scene['R'], scene['t'][:, None]))
+        metrics[f"time/triangulate_points/{n}"], _ = time_call(
+            tg.triangulate_points, P1, P2, scene['keypoints1'], scene['keypoints2'], scene['matches'])
+
+    print(f"{'function':>26} {'size':>10} {'time [s]':>9}")
+    for name, value in metrics.items():
+        _, function, size = name.split('/')
+        print(f"{function:>26} {size:>10} {value:>9.4f}")
+    return metrics
+
+
+def benchmark_accuracy(noise_levels=(0.5, 1.0), outlier_ratios=(0.3, 0.5), n_points=1000, trials=5, seed=0):
+    """
+    Pose accuracy against ground truth: rotation and translation direction
+    errors in degrees and the largest of the two reprojection RMS errors in
+    pixels of the triangulated inliers, averaged over trials.
+
+    On keypoint-level scenes with noise and outliers the estimators run on
+    the true matches; on rendered textured views the whole two-view pipeline
+    runs, from Harris keypoints to the triangulated points.
+
+    Returns:
+        metrics: Errors keyed 'error/<scene>/<estimator>/<rotation|translation|reprojection>'.
+    """
+    metrics = {}
+    estimators = ('8point', '5point')
+    for noise in noise_levels:
+        for outlier_ratio in outlier_ratios:
+            for estimator in estimators:
+                errors = []
+                for trial in range(trials):
+                    scene = ev.synthetic_two_view(n_points, outlier_ratio=outlier_ratio, noise=noise, seed=seed + trial)
+                    key1, key2 = scene['keypoints1'], scene['keypoints2']
+                    pose = _two_view_pose(estimator, scene['matches'], key1, key2, scene['K'], seed=trial)
+                    errors.append(_pose_errors(scene['K'], scene['R'], scene['t'], pose, key1, key2))
+                name = f"error/points-noise{noise}-outliers{outlier_ratio}/{estimator}"
+                for kind, value in zip(('rotation', 'translation', 'reprojection'), np.nanmean(errors, axis=0)):
+                    metrics[f"{name}/{kind}"] = float(value)
+
+    detector_kwargs = dict(window_size=5, k=0.03, threshold=5000, max_keypoints=2000)
+    for estimator in estimators:
+        errors = []
+        for trial in range(trials):
+            scene = ev.render_textured_views(2, (640, 480), focal=500, step=0.6, seed=seed + trial)
+            (key1, desc1), (key2, desc2) = [fs.detect_and_describe(image, detector_kwargs) for image in scene['images']]
+            matches = fm.match_features(desc1, desc2)
+            pose = _two_view_pose(estimator, matches, key1, key2, scene['K'], seed=trial)
+            errors.append(_pose_errors(scene['K'], scene['rotations'][1], scene['translations'][1], pose, key1, key2))
+        for kind, value in zip(('rotation', 'translation', 'reprojection'), np.nanmean(errors, axis=0)):
+            metrics[f"error/rendered/{estimator}/{kind}"] = float(value)
+
+    print(f"{'scene':>32} {'estimator':>9} {'rot [deg]':>9} {'t [deg]':>9} {'rms [px]':>9}")
+    for name in metrics:
+        _, scene_name, estimator, kind = name.split('/')
+        if kind == 'rotation':
+            prefix = f"error/{scene_name}/{estimator}/"
+            print(f"{scene_name:>32} {estimator:>9} {metrics[prefix + 'rotation']:>9.3f} "
+                  f"{metrics[prefix + 'translation']:>9.3f} {metrics[prefix + 'reprojection']:>9.3f}")
+    return metrics
+
+
+def compare_to_baseline(metrics, baseline, tolerance=0.25):
+    """
+    Print the metrics next to a stored baseline and flag regressions: times
+    or errors more than tolerance (relative) above the baseline.
+
+    Returns:
+        regressions: Names of the regressed metrics.
+    """
+    regressions = []
+    print(f"{'metric':>60} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name in sorted(set(metrics) & set(baseline)):
+        current, reference = metrics[name], baseline[name]
+        ratio = current / reference if reference else np.inf if current else 1.0
+        regressed = not (current <= reference * (1 + tolerance) + 1e-6)
+        if regressed:
+            regressions.append(name)
+        print(f"{name:>60} {reference:>10.4g} {current:>10.4g} {ratio:>7.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+BENCHMARKS = {
+    'convolve': benchmark_convolve,
+    'harris': benchmark_harris,
+    'matching': benchmark_matching,
+    'ann': benchmark_ann,
+    'features': benchmark_features,
+    'pyramid': benchmark_pyramid,
+    'ransac': benchmark_ransac,
+    'triangulation': benchmark_triangulation,
+    'bundle_adjustment': benchmark_bundle_adjustment,
+    'timings': benchmark_timings,
+    'accuracy': benchmark_accuracy,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the structure from motion pipeline")
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run, any of {sorted(BENCHMARKS)} (default: all)")
+    parser.add_argument('--image_dir', type=str, default=None, help='Run dataset-aware benchmarks on these images instead of synthetic data')
+    parser.add_argument('--data_name', type=str, default='colmap', help='Name of the dataset in image_dir')
+    parser.add_argument('--save_baseline', type=str, default=None, help='Store the metrics of this run as a JSON baseline')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare the metrics of this run to a stored JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Relative increase over the baseline reported as a regression')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    # benchmarks returning a dict of metrics can be stored and compared
+    metrics = {}
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}")
+        benchmark = BENCHMARKS[name]
+        if args.image_dir is not None and 'image_dir' in inspect.signature(benchmark).parameters:
+            result = benchmark(image_dir=args.image_dir, data_name=args.data_name)
+        else:
+            result = benchmark()
+        if isinstance(result, dict):
+            metrics.update({f"{name}/{key}": value for key, value in result.items()})
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(metrics, file, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print("== baseline")
+        regressions = compare_to_baseline(metrics, baseline, args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} metric(s) regressed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+import numpy as np
+
+import camera_motion as cm
+import profiling
+
+
+def _accumulate(index, values, size):
+    """
+    Sum the (M, ...) blocks of values into (size, ...) blocks by index.
+    """
+    block = int(np.prod(values.shape[1:]))
+    flat = (index[:, None] * block + np.arange(block)).ravel()
+    sums = np.bincount(flat, weights=values.reshape(-1), minlength=size * block)
+    return sums.reshape((size,) + values.shape[1:])
+
+
+def reprojection_residuals(K, rotations, translations, points_3d, cameras, points, keypoints):
+    """
+    Reprojection residuals of all observations.
+
+    Args:
+        K: Camera intrinsic matrix (3x3).
+        rotations, translations: (C, 3, 3) and (C, 3) camera poses, x ~ K (R X + t).
+        points_3d: (P, 3) points.
+        cameras, points: (M,) camera and point index of every observation.
+        keypoints: (M, 2) observed pixels.
+
+    Returns:
+        residuals: (M, 2) projected minus observed pixels.
+        cam: (M, 3) points in the camera frames.
+    """
+    cam = np.einsum('mij,mj->mi', rotations[cameras], points_3d[points]) + translations[cameras]
+    pixels = cam @ K.T
+    return pixels[:, :2] / pixels[:, 2:] - keypoints, cam
+
+
+def _jacobians(K, rotations, translations, cameras, cam):
+    """
+    Per-observation Jacobian blocks of the residual with respect to the
+    camera (rotation update dw with R <- exp([dw]x) R, then dt) and the point.
+    """
+    fx, fy = K[0, 0], K[1, 1]
+    z = cam[:, 2]
+    J_proj = np.zeros((len(cam), 2, 3))
+    J_proj[:, 0, 0] = fx / z
+    J_proj[:, 0, 2] = -fx * cam[:, 0] / z**2
+    J_proj[:, 1, 1] = fy / z
+    J_proj[:, 1, 2] = -fy * cam[:, 1] / z**2
+
+    RX = cam - translations[cameras]
+    J_camera = J_proj @ np.concatenate((-cm.skew(RX), np.broadcast_to(np.eye(3), (len(cam), 3, 3))), axis=2)
+    J_point = J_proj @ rotations[cameras]
+    return J_camera, J_point
+
+
+def _track_pairs(points, n_points):
+    """
+    All pairs (a, b) of different observations of the same point, each pair
+    once, as the off-diagonal blocks of the reduced camera system.
+    """
+    order = np.argsort(points, kind='stable')
+    counts = np.bincount(points, minlength=n_points)
+    starts = np.cumsum(counts) - counts
+
+    # the observation at rank r of its track pairs with ranks r+1 .. L-1
+    ranks = np.arange(len(order)) - starts[points[order]]
+    sizes = counts[points[order]] - ranks - 1
+    a = np.repeat(np.arange(len(order)), sizes)
+    offsets = np.arange(len(a)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    b = a + 1 + offsets
+    return order[a], order[b]
+
+
+@profiling.timed('bundle_adjustment')
+def bundle_adjust(K, rotations, translations, points_3d, cameras, points, keypoints, fixed_cameras=(0,),
+                  iterations=20, damping=1e-3, tolerance=1e-8, return_info=False):
+    """
+    Jointly refine camera poses and points by minimizing the squared
+    reprojection error with Levenberg-Marquardt.
+
+    The Jacobian is only stored as its non-zero blocks, one 2x6 camera block
+    and one 2x3 point block per observation. The 3x3 point blocks of the
+    normal equations are eliminated with the Schur complement, so each
+    iteration solves a 6Cx6C reduced camera system and back-substitutes the
+    points, and its cost grows with the observations and the cameras rather
+    than with (cameras + points)^2.
+
+    Args:
+        K: Camera intrinsic matrix (3x3).
+        rotations, translations: (C, 3, 3) and (C, 3) camera poses, x ~ K (R X + t).
+        points_3d: (P, 3) points.
+        cameras, points: (M,) camera and point index of every observation.
+        keypoints: (M, 2) observed pixels.
+        fixed_cameras: Indices of cameras kept constant, fixing the gauge.
+        iterations: Maximum number of Levenberg-Marquardt iterations.
+        damping: Initial damping, relative to the diagonal of the normal equations.
+        tolerance: Stop when the relative cost decrease falls below it.
+        return_info: Also return a dict with the initial and final cost and the iterations run.
+
+    Returns:
+        rotations, translations, points_3d: Refined copies.
+        info: Only if return_info is True.
+    """
+    rotations = np.array(rotations, dtype=float)
+    translations = np.array(translations, dtype=float)
+    points_3d = np.array(points_3d, dtype=float)
+    cameras = np.asarray(cameras, dtype=np.int64)
+    points = np.asarray(points, dtype=np.int64)
+    keypoints = np.asarray(keypoints, dtype=float)
+    n_points = len(points_3d)
+
+    # compact indices of the cameras being optimized, -1 for fixed ones
+    variable = np.ones(len(rotations), dtype=bool)
+    variable[list(fixed_cameras)] = False
+    camera_index = np.full(len(rotations), -1)
+    camera_index[variable] = np.arange(variable.sum())
+    n_cameras = int(variable.sum())
+
+    free = camera_index[cameras] >= 0
+    obs_cameras = camera_index[cameras[free]]
+    pair_a, pair_b = _track_pairs(points[free], n_points)
+    pair_a, pair_b = np.flatnonzero(free)[pair_a], np.flatnonzero(free)[pair_b]
+
+    residuals, cam = reprojection_residuals(K, rotations, translations, points_3d, cameras, points, keypoints)
+    cost = 0.5 * np.sum(residuals**2)
+    info = {'initial_cost': cost, 'iterations': 0}
+
+    for iteration in range(iterations):
+        J_camera, J_point = _jacobians(K, rotations, translations, cameras, cam)
+        J_camera[~free] = 0
+
+        # normal equation blocks
+        J_camera_t = J_camera.transpose(0, 2, 1)
+        U = _accumulate(obs_cameras, J_camera_t[free] @ J_camera[free], n_cameras)
+        V = _accumulate(points, J_point.transpose(0, 2, 1) @ J_point, n_points)
+        W = J_camera_t @ J_point
+        g_camera = _accumulate(obs_cameras, np.einsum('mki,mk->mi', J_camera[free], residuals[free]), n_cameras)
+        g_point = _accumulate(points, np.einsum('mki,mk->mi', J_point, residuals), n_points)
+
+        while True:
+            U_damped = U + damping * np.einsum('cii->ci', U)[:, :, None] * np.eye(6)
+            V_diagonal = np.maximum(np.einsum('pii->pi', V), 1e-12)
+            V_inv = np.linalg.inv(V + damping * V_diagonal[:, :, None] * np.eye(3))
+
+            # Schur complement on the point blocks, the diagonal blocks come
+            # from the observations themselves and the other blocks from
+            # pairs of observations of the same point
+            WV_inv = W @ V_inv[points]
+            diagonal = U_damped - _accumulate(obs_cameras, WV_inv[free] @ W[free].transpose(0, 2, 1), n_cameras)
+            pairs = _accumulate(camera_index[cameras[pair_a]] * n_cameras + camera_index[cameras[pair_b]],
+                                WV_inv[pair_a] @ W[pair_b].transpose(0, 2, 1), n_cameras * n_cameras)
+            pairs = np.einsum('abij->aibj', pairs.reshape(n_cameras, n_cameras, 6, 6)).reshape(6*n_cameras, 6*n_cameras)
+            S = _block_diagonal(diagonal) - pairs - pairs.T
+            rhs = -g_camera + _accumulate(obs_cameras, np.einsum('mij,mj->mi', WV_inv[free], g_point[points[free]]),
+                                          n_cameras)
+
+            try:
+                step_camera = np.linalg.solve(S, rhs.ravel()).reshape(n_cameras, 6)
+            except np.linalg.LinAlgError:
+                step_camera = np.linalg.lstsq(S, rhs.ravel(), rcond=None)[0].reshape(n_cameras, 6)
+
+            # back-substitute the points
+            coupling = np.zeros((len(points), 3))
+            coupling[free] = np.einsum('mji,mj->mi', W[free], step_camera[obs_cameras])
+            step_point = np.einsum('pij,pj->pi', V_inv, -g_point - _accumulate(points, coupling, n_points))
+
+            new_rotations, new_translations = rotations.copy(), translations.copy()
+            new_rotations[variable] = cm.rotation_from_vector(step_camera[:, :3]) @ rotations[variable]
+            new_translations[variable] += step_camera[:, 3:]
+            new_points = points_3d + step_point
+
+            new_residuals, new_cam = reprojection_residuals(K, new_rotations, new_translations, new_points,
+                                                            cameras, points, keypoints)
+            new_cost = 0.5 * np.sum(new_residuals**2)
+            if np.isfinite(new_cost) and new_cost < cost:
+                break
+            damping *= 10
+            if damping > 1e12:
+                break
+
+        info['iterations'] = iteration + 1
+        if not (np.isfinite(new_cost) and new_cost < cost):
+            break
+
+        decrease = (cost - new_cost) / cost
+        rotations, translations, points_3d = new_rotations, new_translations, new_points
+        residuals, cam, cost = new_residuals, new_cam, new_cost
+        damping = max(damping / 10, 1e-12)
+        if decrease < tolerance:
+            break
+
+    info['final_cost'] = cost
+    if return_info:
+        return rotations, translations, points_3d, info
+    return rotations, translations, points_3d
+
+
+def _block_diagonal(blocks):
+    """
+    Dense block-diagonal matrix of (n, b, b) blocks.
+    """
+    n, b, _ = blocks.shape
+    matrix = np.zeros((n, b, n, b))
+    matrix[np.arange(n), :, np.arange(n), :] = blocks
+    return matrix.reshape(n*b, n*b)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ArrayCache:
+    """
+    Persistent cache of named NumPy arrays, one .npz file per entry.
+
+    Entries are addressed by a kind (a subdirectory, e.g. 'features' or
+    'matches') and a key built with `key` from everything the cached result
+    depends on. When the cache grows beyond max_bytes the least recently
+    used entries are deleted.
+
+    The directory is scanned once when the cache is opened; after that the
+    size and use order of the entries are kept up to date in memory.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # path -> size of every entry, least recently used first
+        entries = []
+        for root, _, files in os.walk(cache_dir):
+            for name in files:
+                if name.endswith('.npz'):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, os.path.join(root, name), stat.st_size))
+        self._entries = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self._total = sum(self._entries.values())
+
+    @staticmethod
+    def key(*parts):
+        """
+        Hex digest of arrays (content, dtype and shape) and JSON-serializable values.
+        """
+        digest = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(f"{part.dtype.str}{part.shape}".encode())
+                digest.update(np.ascontiguousarray(part).data)
+            else:
+                digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+            digest.update(b'|')
+        return digest.hexdigest()
+
+    def _path(self, kind, key):
+        return os.path.join(self.cache_dir, kind, key + '.npz')
+
+    def load(self, kind, key):
+        """
+        Arrays stored under (kind, key) as a dict, or None on a miss.
+        """
+        path = self._path(kind, key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            return None
+
+        # mark as recently used, also for later runs
+        os.utime(path)
+        if path in self._entries:
+            self._entries.move_to_end(path)
+        return arrays
+
+    def store(self, kind, key, **arrays):
+        """
+        Store arrays under (kind, key), then evict old entries if needed.
+        """
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self._total -= self._entries.pop(path, 0)
+        self._entries[path] = os.path.getsize(path)
+        self._total += self._entries[path]
+        self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits in max_bytes.
+        """
+        while self._total > self.max_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,210 @@
+import numpy as np
+
+
+def skew(v):
+    """
+    Cross-product matrices [v]x of one (3,) or many (..., 3) vectors.
+    """
+    v = np.asarray(v, dtype=float)
+    S = np.zeros(v.shape[:-1] + (3, 3))
+    S[..., 0, 1], S[..., 0, 2] = -v[..., 2], v[..., 1]
+    S[..., 1, 0], S[..., 1, 2] = v[..., 2], -v[..., 0]
+    S[..., 2, 0], S[..., 2, 1] = -v[..., 1], v[..., 0]
+    return S
+
+
+def rotation_from_vector(rotvec):
+    """
+    Rotation matrices from rotation vectors (axis * angle), Rodrigues' formula.
+
+    Args:
+        rotvec: (3,) or (..., 3) rotation vectors.
+
+    Returns:
+        R: (3, 3) or (..., 3, 3) rotation matrices.
+    """
+    rotvec = np.asarray(rotvec, dtype=float)
+    angle = np.linalg.norm(rotvec, axis=-1)[..., None, None]
+    K = skew(rotvec)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Taylor expansions near zero keep small rotations accurate
+        a = np.where(angle < 1e-8, 1 - angle**2/6, np.sin(angle) / angle)
+        b = np.where(angle < 1e-8, 0.5 - angle**2/24, (1 - np.cos(angle)) / angle**2)
+    return np.eye(3) + a * K + b * K @ K
+
+
+def vector_from_rotation(R):
+    """
+    Rotation vectors (axis * angle) of rotation matrices, inverse of
+    `rotation_from_vector`.
+
+    Args:
+        R: (3, 3) or (..., 3, 3) rotation matrices.
+
+    Returns:
+        rotvec: (3,) or (..., 3) rotation vectors.
+    """
+    R = np.asarray(R, dtype=float)
+    cos = np.clip((np.trace(R, axis1=-2, axis2=-1) - 1) / 2, -1, 1)
+    angle = np.arccos(cos)
+    axis = np.stack((R[..., 2, 1] - R[..., 1, 2], R[..., 0, 2] - R[..., 2, 0], R[..., 1, 0] - R[..., 0, 1]), axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rotvec = axis * np.where(angle < 1e-8, 0.5, angle / (2*np.sin(angle)))[..., None]
+
+    # near pi the antisymmetric part vanishes, take the axis from R + I instead
+    near_pi = angle > np.pi - 1e-4
+    if np.any(near_pi):
+        B = (R[near_pi] + np.eye(3)) / 2
+        columns = np.argmax(np.diagonal(B, axis1=-2, axis2=-1), axis=-1)
+        v = B[np.arange(len(B)), :, columns]
+        v /= np.linalg.norm(v, axis=-1, keepdims=True)
+        rotvec[near_pi] = v * angle[near_pi][..., None]
+    return rotvec
+
+
+def camera_center(R, t):
+    """
+    Camera center -R^T t of the pose x_cam = R X + t.
+    """
+    return -np.einsum('...ji,...j->...i', R, t)
+
+
+def projection_matrix(K, R, t):
+    """
+    Projection matrix K [R | t].
+    """
+    return K @ np.hstack((R, np.asarray(t, dtype=float).reshape(3, 1)))
+
+
+def compose(R_rel, t_rel, R, t):
+    """
+    Pose of a camera given its pose relative to a reference camera
+    (x = R_rel x_reference + t_rel) and the reference pose (R, t).
+    """
+    return R_rel @ R, R_rel @ t + t_rel
+
+
+def relative_scale(points_reference, points, seed=0):
+    """
+    Scale that maps a reconstruction onto a reference one, from the same
+    physical points triangulated in both.
+
+    Distances between point pairs do not depend on the frame the points are
+    expressed in, so the scale is the median ratio of the distances between
+    randomly paired points, which is robust to badly triangulated points.
+
+    Args:
+        points_reference: (N, 3) points of the reference reconstruction.
+        points: (N, 3) the same points in the other reconstruction.
+
+    Returns:
+        scale: s such that s * points matches points_reference up to a rigid
+            motion, None with fewer than 2 points.
+    """
+    points_reference = np.asarray(points_reference, dtype=float)
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2:
+        return None
+
+    order = np.random.default_rng(seed).permutation(len(points))
+    other = np.roll(order, 1)
+    distances_reference = np.linalg.norm(points_reference[order] - points_reference[other], axis=1)
+    distances = np.linalg.norm(points[order] - points[other], axis=1)
+    valid = distances > 1e-12
+    if not np.any(valid):
+        return None
+    return float(np.median(distances_reference[valid] / distances[valid]))
+
+
+class PoseGraph:
+    """
+    Absolute poses (x_cam = R X + t) of the frames of a sequence, stored in
+    compact (capacity, 3, 3) rotation and (capacity, 3) translation arrays
+    indexed by frame, so the pose of any frame is an O(1) lookup.
+
+    Frames are placed either directly with `set_pose` or by chaining a
+    relative pose onto an already placed frame with `chain`; every chained
+    relative pose is kept as an edge (reference, frame, R_rel, t_rel).
+    """
+
+    def __init__(self, capacity=64):
+        self.rotations = np.tile(np.eye(3), (capacity, 1, 1))
+        self.translations = np.zeros((capacity, 3))
+        self.registered = np.zeros(capacity, dtype=bool)
+        self.edges = []
+
+    def __len__(self):
+        return int(self.registered.sum())
+
+    def _reserve(self, frame):
+        capacity = len(self.registered)
+        if frame < capacity:
+            return
+        grown = max(frame + 1, 2*capacity)
+        self.rotations = np.concatenate((self.rotations, np.tile(np.eye(3), (grown - capacity, 1, 1))))
+        self.translations = np.concatenate((self.translations, np.zeros((grown - capacity, 3))))
+        self.registered = np.concatenate((self.registered, np.zeros(grown - capacity, dtype=bool)))
+
+    def is_registered(self, frame):
+        return frame < len(self.registered) and bool(self.registered[frame])
+
+    def set_pose(self, frame, R, t):
+        self._reserve(frame)
+        self.rotations[frame] = R
+        self.translations[frame] = np.asarray(t, dtype=float).reshape(3)
+        self.registered[frame] = True
+
+    def pose(self, frame):
+        """
+        (R, t) of a registered frame.
+        """
+        if not self.is_registered(frame):
+            raise KeyError(f"frame {frame} has no pose")
+        return self.rotations[frame], self.translations[frame]
+
+    def chain(self, frame, reference, R_rel, t_rel, scale=1.0):
+        """
+        Place a frame from its pose relative to a registered reference frame
+        (x_frame = R_rel x_reference + scale * t_rel), where t_rel usually
+        has unit norm and scale brings it to the units of the graph.
+
+        Returns:
+            R, t: Absolute pose of the frame.
+        """
+        R_rel = np.asarray(R_rel, dtype=float)
+        t_rel = scale * np.asarray(t_rel, dtype=float).reshape(3)
+        R, t = compose(R_rel, t_rel, *self.pose(reference))
+        self.set_pose(frame, R, t)
+        self.edges.append((reference, frame, R_rel, t_rel))
+        return self.rotations[frame], self.translations[frame]
+
+    def relative_pose(self, frame, reference):
+        """
+        Pose of a frame relative to a reference frame, inverse of `chain`.
+        """
+        R, t = self.pose(frame)
+        R_reference, t_reference = self.pose(reference)
+        R_rel = R @ R_reference.T
+        return R_rel, t - R_rel @ t_reference
+
+    def frames(self):
+        """
+        Indices of the registered frames, in frame order.
+        """
+        return np.flatnonzero(self.registered)
+
+    def centers(self, frames=None):
+        """
+        (M, 3) camera centers of the given frames, all registered frames by default.
+        """
+        frames = self.frames() if frames is None else np.asarray(frames)
+        return camera_center(self.rotations[frames], self.translations[frames])
+
+    def to_world(self, frame, points, scale=1.0):
+        """
+        World coordinates of points given in the camera frame of a frame,
+        after scaling them by scale.
+        """
+        R, t = self.pose(frame)
+        return (scale * np.asarray(points, dtype=float) - t) @ R
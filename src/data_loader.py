@@ -1,8 +1,15 @@
-import os 
+import os
+import queue
+import threading
 from PIL import Image
 import numpy as np
 
-def load_images(image_dir, dataset='colmap'):
+import profiling
+
+def list_images(image_dir, dataset='colmap'):
+    """
+    Sorted image paths of a dataset directory.
+    """
     if dataset == 'malaga':
         image_files = [file for file in os.listdir(image_dir) if file.endswith('right.jpg')]
         image_files.sort(key=lambda x:float(x.split('_')[2]))
@@ -10,17 +17,90 @@ def load_images(image_dir, dataset='colmap'):
         image_files = [file for file in os.listdir(image_dir) if file.endswith('.JPG')]
         image_files.sort()
     else:
-        print('select a recognized dataset')
+        raise ValueError(f"{dataset} not a recognized dataset, select 'colmap' or 'malaga'")
 
-    images, gray_imgs  = [],[]
-    for files in image_files:
-        image_path = os.path.join(image_dir,files)
-        image = Image.open(image_path)
+    return [os.path.join(image_dir, files) for files in image_files]
+
+
+@profiling.timed('load')
+def decode_image(image_path):
+    """
+    Decode one image file once and derive both versions from it.
 
+    Returns:
+        gray_image: (H, W) uint8 grayscale image.
+        color_image: (H, W, 3) uint8 RGB image.
+    """
+    with Image.open(image_path) as image:
+        image.load()
         gray_image = np.array(image.convert('L'))
         color_image = np.array(image)
 
+    return gray_image, color_image
+
+
+def iter_images(image_dir, dataset='colmap', prefetch=2):
+    """
+    Decode the images of a dataset on demand, in order.
+
+    Only the frames the consumer still holds are kept in memory, so memory
+    stays constant as the sequence grows. With prefetch > 0 a background
+    thread decodes up to prefetch frames ahead of the consumer.
+
+    Yields:
+        (gray_image, color_image) for every image, see `decode_image`.
+    """
+    image_paths = list_images(image_dir, dataset)
+
+    if prefetch <= 0:
+        for image_path in image_paths:
+            yield decode_image(image_path)
+        return
+
+    frames = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # give up once the consumer is gone, instead of blocking on a full queue
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for image_path in image_paths:
+                if not put(decode_image(image_path)):
+                    return
+        except Exception as error:
+            put(error)
+            return
+        put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            frame = frames.get()
+            if frame is done:
+                break
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+    finally:
+        # the consumer stopped early or failed, let the producer exit
+        stop.set()
+        thread.join()
+
+
+def load_images(image_dir, dataset='colmap'):
+    images, gray_imgs  = [],[]
+    for gray_image, color_image in iter_images(image_dir, dataset, prefetch=0):
         images.append(color_image)
         gray_imgs.append(gray_image)
-        
-    return gray_imgs,images
\ No newline at end of file
+
+    return gray_imgs,images
@@ -0,0 +1,290 @@
+import numpy as np
+
+
+def rotation_matrix(axis, angle):
+    """
+    Rotation matrix from an axis and an angle (Rodrigues' formula).
+
+    Args:
+        axis: Rotation axis (3,), does not need to be normalized.
+        angle: Rotation angle in radians.
+
+    Returns:
+        R: 3x3 rotation matrix.
+    """
+    axis = np.asarray(axis, dtype=float)
+    axis = axis / np.linalg.norm(axis)
+    K = np.array([[0, -axis[2], axis[1]],
+                  [axis[2], 0, -axis[0]],
+                  [-axis[1], axis[0], 0]])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * K @ K
+
+
+def project(K, R, t, points_3d):
+    """
+    Project 3D points into a camera x = K (R X + t).
+
+    Returns:
+        pixels: (N, 2) image coordinates.
+        depth: (N,) depth of the points in the camera frame.
+    """
+    cam = points_3d @ R.T + t
+    pixels = cam @ K.T
+    return pixels[:, :2] / pixels[:, 2:], cam[:, 2]
+
+
+def synthetic_two_view(n_points=500, outlier_ratio=0.3, noise=0.5, image_size=(3072, 2304), focal=2559.68,
+                       baseline=0.5, rotation_deg=5.0, depth_range=(4.0, 12.0), seed=0):
+    """
+    Two calibrated views of a random point cloud, with known pose.
+
+    Points are sampled in front of the first camera so that they are visible
+    in both images. Keypoints get Gaussian pixel noise and a fraction of the
+    matches is replaced by uniformly random points in the second image.
+
+    Args:
+        n_points: Number of matches.
+        outlier_ratio: Fraction of matches that are outliers.
+        noise: Standard deviation of the keypoint noise in pixels.
+        image_size: (width, height) of the images.
+        focal: Focal length in pixels, the principal point is the image center.
+        baseline: Distance between the camera centers.
+        rotation_deg: Relative rotation angle between the cameras in degrees.
+        depth_range: Range of point depths in the first camera.
+        seed: Seed of the random generator.
+
+    Returns:
+        scene: dict with K, R, t (second camera pose, x2 = K(R X + t)),
+            points_3d, keypoints1, keypoints2, matches and the ground truth
+            inlier mask of the matches.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = image_size
+    K = np.array([[focal, 0, width / 2],
+                  [0, focal, height / 2],
+                  [0, 0, 1]])
+
+    R = rotation_matrix(rng.standard_normal(3), np.deg2rad(rotation_deg))
+    t = rng.standard_normal(3)
+    t *= baseline / np.linalg.norm(t)
+
+    # back-project random pixels of image 1, keep those visible in image 2
+    points_3d = np.empty((0, 3))
+    while len(points_3d) < n_points:
+        pixels = rng.uniform((0, 0), (width, height), size=(2*n_points, 2))
+        depth = rng.uniform(*depth_range, size=2*n_points)
+        rays = np.column_stack((pixels, np.ones(2*n_points))) @ np.linalg.inv(K).T
+        candidates = rays * depth[:, None]
+        x2, depth2 = project(K, R, t, candidates)
+        visible = (depth2 > 0) & np.all((x2 >= 0) & (x2 < (width, height)), axis=1)
+        points_3d = np.vstack((points_3d, candidates[visible]))
+    points_3d = points_3d[:n_points]
+
+    keypoints1, _ = project(K, np.eye(3), np.zeros(3), points_3d)
+    keypoints2, _ = project(K, R, t, points_3d)
+    keypoints1 = keypoints1 + noise * rng.standard_normal(keypoints1.shape)
+    keypoints2 = keypoints2 + noise * rng.standard_normal(keypoints2.shape)
+
+    inliers = np.ones(n_points, dtype=bool)
+    outliers = rng.choice(n_points, int(round(outlier_ratio * n_points)), replace=False)
+    inliers[outliers] = False
+    keypoints2[outliers] = rng.uniform((0, 0), (width, height), size=(len(outliers), 2))
+
+    return {
+        'K': K, 'R': R, 't': t,
+        'points_3d': points_3d,
+        'keypoints1': keypoints1,
+        'keypoints2': keypoints2,
+        'matches': [(i, i) for i in range(n_points)],
+        'inliers': inliers,
+    }
+
+
+def synthetic_multi_view(n_cameras=10, n_points=1000, noise=0.5, image_size=(3072, 2304), focal=2559.68, step=0.3,
+                         rotation_deg=2.0, depth_range=(4.0, 12.0), seed=0):
+    """
+    A sequence of calibrated cameras moving sideways along a random point
+    cloud, with every point observed by the cameras in which it is visible.
+
+    Args:
+        n_cameras: Number of cameras, the first one is at [I | 0].
+        n_points: Number of points.
+        noise: Standard deviation of the keypoint noise in pixels.
+        image_size: (width, height) of the images.
+        focal: Focal length in pixels, the principal point is the image center.
+        step: Distance between consecutive camera centers.
+        rotation_deg: Standard deviation of the rotation angle of each camera in degrees.
+        depth_range: Range of point depths in front of the trajectory.
+        seed: Seed of the random generator.
+
+    Returns:
+        scene: dict with K, rotations (C, 3, 3), translations (C, 3), points_3d,
+            and the observations as cameras, points (M,) indices and their
+            noisy keypoints (M, 2).
+    """
+    rng = np.random.default_rng(seed)
+    width, height = image_size
+    K = np.array([[focal, 0, width / 2],
+                  [0, focal, height / 2],
+                  [0, 0, 1]])
+
+    rotations = [np.eye(3)]
+    for _ in range(n_cameras - 1):
+        rotations.append(rotation_matrix(rng.standard_normal(3), np.deg2rad(rotation_deg * rng.standard_normal())))
+    rotations = np.array(rotations)
+    centers = np.column_stack((step * np.arange(n_cameras), np.zeros((n_cameras, 2))))
+    translations = -np.einsum('cij,cj->ci', rotations, centers)
+
+    # spread the points over the field of view of the whole trajectory
+    depth = rng.uniform(*depth_range, size=n_points)
+    x = rng.uniform(-width / 2, width / 2, size=n_points) * depth / focal + rng.uniform(0, centers[-1, 0], size=n_points)
+    y = rng.uniform(-height / 2, height / 2, size=n_points) * depth / focal
+    points_3d = np.column_stack((x, y, depth))
+
+    cameras, points, keypoints = [], [], []
+    for c in range(n_cameras):
+        pixels, depth = project(K, rotations[c], translations[c], points_3d)
+        visible = np.flatnonzero((depth > 0) & np.all((pixels >= 0) & (pixels < (width, height)), axis=1))
+        cameras.append(np.full(len(visible), c))
+        points.append(visible)
+        keypoints.append(pixels[visible] + noise * rng.standard_normal((len(visible), 2)))
+
+    return {
+        'K': K, 'rotations': rotations, 'translations': translations,
+        'points_3d': points_3d,
+        'cameras': np.concatenate(cameras),
+        'points': np.concatenate(points),
+        'keypoints': np.concatenate(keypoints),
+    }
+
+
+def rotation_error(R_estimated, R_true):
+    """
+    Angle in degrees of the rotation between two rotation matrices.
+    """
+    cos = (np.trace(R_estimated.T @ R_true) - 1) / 2
+    return float(np.rad2deg(np.arccos(np.clip(cos, -1, 1))))
+
+
+def translation_error(t_estimated, t_true):
+    """
+    Angle in degrees between two translation directions, as the scale of a
+    two-view reconstruction is unknown.
+    """
+    cos = t_estimated @ t_true / (np.linalg.norm(t_estimated) * np.linalg.norm(t_true))
+    return float(np.rad2deg(np.arccos(np.clip(cos, -1, 1))))
+
+
+def reprojection_rms(K, R, t, points_3d, keypoints):
+    """
+    Root mean square reprojection error in pixels of points observed at keypoints.
+    """
+    pixels, _ = project(K, R, t, points_3d)
+    return float(np.sqrt(np.mean(np.sum((pixels - keypoints)**2, axis=1))))
+
+
+def rectangle_texture(size=1024, n_rectangles=None, max_side=32, noise_amplitude=150.0, noise_period=4, seed=0):
+    """
+    Grayscale texture of random overlapping rectangles, rich in corners.
+
+    Returns:
+        texture: (size, size) float image in [0, 255].
+    """
+    rng = np.random.default_rng(seed)
+    if n_rectangles is None:
+        n_rectangles = size**2 // 128
+    texture = np.full((size, size), 128.0)
+    corners = rng.integers(0, size, size=(n_rectangles, 2))
+    sides = rng.integers(4, max_side, size=(n_rectangles, 2))
+    for (x, y), (w, h), value in zip(corners, sides, rng.uniform(0, 255, n_rectangles)):
+        texture[y:y + h, x:x + w] = value
+
+    # smooth noise makes patches distinctive for the descriptors
+    coarse = rng.uniform(-1, 1, size=(size // noise_period, size // noise_period))
+    v, u = np.mgrid[0:size, 0:size] / noise_period
+    noise = _sample_bilinear(coarse, u, v)
+    return np.clip(texture + noise_amplitude * noise, 0, 255)
+
+
+def _sample_bilinear(texture, u, v):
+    # the texture repeats in both directions
+    height, width = texture.shape
+    u0, v0 = np.floor(u).astype(int), np.floor(v).astype(int)
+    du, dv = u - u0, v - v0
+    u0, v0 = u0 % width, v0 % height
+    u1, v1 = (u0 + 1) % width, (v0 + 1) % height
+    return ((1 - dv) * ((1 - du) * texture[v0, u0] + du * texture[v0, u1])
+            + dv * ((1 - du) * texture[v1, u0] + du * texture[v1, u1]))
+
+
+def render_textured_views(n_cameras=2, image_size=(320, 240), focal=300.0, step=0.3, rotation_deg=2.0,
+                          depths=(4.0, 6.0, 9.0), plane_width=3.0, texture_scale=None, seed=0):
+    """
+    Render grayscale images of a scene of fronto-parallel textured planes
+    seen by a sequence of cameras with known poses, by ray casting every
+    pixel onto the nearest plane.
+
+    Args:
+        n_cameras: Number of views, the first one is at [I | 0].
+        image_size: (width, height) of the images.
+        focal: Focal length in pixels, the principal point is the image center.
+        step: Distance between consecutive camera centers along x.
+        rotation_deg: Standard deviation of the rotation angle of each camera in degrees.
+        depths: Depths of the planes; the farthest one fills the background,
+            the others are squares of side plane_width at random positions.
+        plane_width: Side length of the foreground planes.
+        texture_scale: Texture pixels per scene unit, by default about one
+            texture pixel per image pixel at the mean depth.
+        seed: Seed of the random generator.
+
+    Returns:
+        scene: dict with K, rotations (C, 3, 3), translations (C, 3) and the
+            uint8 images (C, H, W).
+    """
+    rng = np.random.default_rng(seed)
+    width, height = image_size
+    K = np.array([[focal, 0, width / 2],
+                  [0, focal, height / 2],
+                  [0, 0, 1]])
+
+    rotations = [np.eye(3)]
+    for _ in range(n_cameras - 1):
+        rotations.append(rotation_matrix(rng.standard_normal(3), np.deg2rad(rotation_deg * rng.standard_normal())))
+    rotations = np.array(rotations)
+    centers = np.column_stack((step * np.arange(n_cameras), np.zeros((n_cameras, 2))))
+    translations = -np.einsum('cij,cj->ci', rotations, centers)
+
+    if texture_scale is None:
+        texture_scale = focal / np.mean(depths)
+
+    # planes as (depth, x0, y0, side, texture), nearest first
+    planes = []
+    for k, depth in enumerate(sorted(depths)):
+        texture = rectangle_texture(seed=seed + k + 1)
+        if k == len(depths) - 1:
+            side = 4 * depth * max(width, height) / focal + 2 * step * n_cameras
+            x0, y0 = -side / 2, -side / 2
+        else:
+            side = plane_width
+            x0, y0 = rng.uniform(-side, step * (n_cameras - 1)), rng.uniform(-side, 0)
+        planes.append((depth, x0, y0, side, texture))
+
+    u, v = np.meshgrid(np.arange(width), np.arange(height))
+    rays = np.stack((u, v, np.ones_like(u)), axis=-1).reshape(-1, 3) @ np.linalg.inv(K).T
+
+    images = []
+    for R, center in zip(rotations, centers):
+        directions = rays @ R
+        image = np.zeros(len(rays))
+        nearest = np.full(len(rays), np.inf)
+        for depth, x0, y0, side, texture in planes:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                s = (depth - center[2]) / directions[:, 2]
+            X = center[0] + s * directions[:, 0]
+            Y = center[1] + s * directions[:, 1]
+            hit = (s > 0) & (s < nearest) & (X >= x0) & (X < x0 + side) & (Y >= y0) & (Y < y0 + side)
+            image[hit] = _sample_bilinear(texture, (X[hit] - x0) * texture_scale, (Y[hit] - y0) * texture_scale)
+            nearest[hit] = s[hit]
+        images.append(np.clip(np.rint(image), 0, 255).astype(np.uint8).reshape(height, width))
+
+    return {'K': K, 'rotations': rotations, 'translations': translations, 'images': np.array(images)}
@@ -1,14 +1,101 @@
+import functools
+
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import feature_detection as fd
+import profiling
+
 
+@profiling.timed('descriptors')
 def extract_descriptors(image, keypoints, patch_size=9):
-    descriptors = []
+    """
+    Normalized intensity patches centered on the keypoints.
+
+    All patches are gathered with one fancy index into a sliding-window view
+    of the zero-padded image, so keypoints near the border get zeros outside
+    the image.
+
+    Args:
+        image: Grayscale image (H x W).
+        keypoints: (N, 2) array or list of (x, y) keypoints.
+        patch_size: Side length of the square patch.
+
+    Returns:
+        descriptors: C-contiguous (N, patch_size**2) float32 array, each row
+            with zero mean and unit standard deviation.
+    """
+    keypoints = np.rint(np.asarray(keypoints)).astype(np.intp).reshape(-1, 2)
     offset = patch_size//2
     padded_img = np.pad(image,((offset,offset),(offset,offset)), mode='constant',constant_values=0)
-    for (y,x) in keypoints:
-        patch = padded_img[y:y+patch_size, x:x+patch_size]
-        descriptor = patch.flatten()
 
-        descriptor = (descriptor - np.mean(descriptor))/(np.std(descriptor) + 1e-10)
-        descriptors.append(descriptor)
-    
+    # windows[y, x] is the patch whose top-left corner is padded_img[y, x],
+    # i.e. the patch centered on image pixel (x, y)
+    windows = sliding_window_view(padded_img, (patch_size, patch_size))
+    patches = windows[keypoints[:, 1], keypoints[:, 0]]
+
+    descriptors = np.empty((len(keypoints), patch_size*patch_size), dtype=np.float32)
+    descriptors[...] = patches.reshape(descriptors.shape)
+
+    descriptors -= descriptors.mean(axis=1, keepdims=True)
+    descriptors /= descriptors.std(axis=1, keepdims=True) + 1e-10
+
     return descriptors
+
+
+@functools.lru_cache(maxsize=None)
+def brief_pattern(patch_size=31, n_bits=256, seed=0):
+    """
+    Fixed random point pairs of a BRIEF descriptor, drawn from an isotropic
+    Gaussian with a standard deviation of patch_size / 5 around the patch
+    center (Calonder et al.) and clipped to the patch.
+
+    Returns:
+        pattern: (n_bits, 4) integer (dx1, dy1, dx2, dy2) offsets.
+    """
+    rng = np.random.default_rng(seed)
+    offset = patch_size//2
+    pattern = np.rint(rng.normal(0, patch_size / 5, size=(n_bits, 4))).astype(np.intp)
+    pattern = np.clip(pattern, -offset, offset)
+    pattern.setflags(write=False)
+    return pattern
+
+
+@profiling.timed('descriptors')
+def extract_binary_descriptors(image, keypoints, patch_size=31, n_bits=256, sigma=2.0, seed=0):
+    """
+    BRIEF binary descriptors: the outcomes of n_bits intensity comparisons
+    between point pairs of the smoothed patch around each keypoint, packed
+    8 per byte.
+
+    The image is smoothed once with an approximate Gaussian, so each bit
+    compares two local averages instead of two noisy pixels. Points outside
+    the image read as zero, like in `extract_descriptors`. With 256 bits a
+    descriptor takes 32 bytes instead of 4 * patch_size**2 for patches.
+
+    Args:
+        image: Grayscale image (H x W).
+        keypoints: (N, 2) array or list of (x, y) keypoints.
+        patch_size: Side length of the square patch the pairs are drawn in.
+        n_bits: Number of comparisons, a multiple of 8.
+        sigma: Standard deviation of the smoothing in pixels.
+        seed: Seed of the sampling pattern; descriptors are only comparable
+            with the same patch_size, n_bits and seed.
+
+    Returns:
+        descriptors: C-contiguous (N, n_bits // 8) uint8 array.
+    """
+    keypoints = np.rint(np.asarray(keypoints)).astype(np.intp).reshape(-1, 2)
+    offset = patch_size//2
+    smoothed = fd.gaussian_window_sum(image, 5, sigma=sigma)
+    padded_img = np.pad(smoothed, offset, mode='constant', constant_values=0)
+
+    pattern = brief_pattern(patch_size, n_bits, seed)
+    x = keypoints[:, 0, None] + offset
+    y = keypoints[:, 1, None] + offset
+    bits = padded_img[y + pattern[:, 1], x + pattern[:, 0]] < padded_img[y + pattern[:, 3], x + pattern[:, 2]]
+
+    return np.ascontiguousarray(np.packbits(bits, axis=1))
+
+
+DESCRIPTORS = {'patch': extract_descriptors, 'brief': extract_binary_descriptors}
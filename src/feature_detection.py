@@ -1,6 +1,15 @@
 import numpy as np
 
-def convolve(image, kernel):
+import profiling
+
+SOBEL_SMOOTH = np.array([1, 2, 1])
+SOBEL_DERIVATIVE = np.array([-1, 0, 1])
+
+
+def convolve_loop(image, kernel):
+    '''
+    Reference per-pixel implementation of `convolve`, kept for benchmarking.
+    '''
     image_H,image_W = image.shape
     kernel_H,kernel_W = kernel.shape
    
@@ -19,25 +28,216 @@ def convolve(image, kernel):
     return output
 
 
+def _pairwise_sum(terms):
+    '''
+    Add whole-array terms in the same order np.sum uses for a small contiguous
+    array, so float results match the per-pixel loop bit-for-bit.
+    '''
+    n = len(terms)
+    if n < 8:
+        total = terms[0]
+        for term in terms[1:]:
+            total = total + term
+        return total
+    if n <= 128:
+        r = list(terms[:8])
+        for i in range(8, n - n % 8, 8):
+            for j in range(8):
+                r[j] = r[j] + terms[i + j]
+        total = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]))
+        for term in terms[n - n % 8:]:
+            total = total + term
+        return total
+    half = n // 2
+    half -= half % 8
+    return _pairwise_sum(terms[:half]) + _pairwise_sum(terms[half:])
+
+
+def convolve(image, kernel):
+    '''
+    Zero-padded 2D correlation computed with one whole-array shifted multiply
+    per kernel tap. The output has the dtype of `image`, exactly like
+    `convolve_loop`.
+    '''
+    image_H,image_W = image.shape
+    kernel_H,kernel_W = kernel.shape
+
+    pad_H = kernel_H//2
+    pad_W = kernel_W//2
+
+    padded_image = np.pad(image, ((pad_H, pad_H),(pad_W,pad_W)),mode='constant',constant_values=0)
+
+    # accumulate in the dtype the loop's `region*kernel` products would have
+    acc_dtype = np.result_type(image, kernel)
+    terms = []
+    for a in range(kernel_H):
+        for b in range(kernel_W):
+            shifted = padded_image[a:a+image_H, b:b+image_W]
+            terms.append(shifted.astype(acc_dtype, copy=False) * kernel[a, b])
+
+    return _pairwise_sum(terms).astype(image.dtype, copy=False)
+
+
+def convolve_separable(image, kernel_col, kernel_row):
+    '''
+    Zero-padded correlation with the rank-1 kernel outer(kernel_col, kernel_row),
+    applied as a column pass followed by a row pass.
+
+    Integer images give the same result as `convolve` on the full kernel; for
+    float images the different summation order may change the last bits.
+    '''
+    image_H,image_W = image.shape
+    kernel_col = np.asarray(kernel_col)
+    kernel_row = np.asarray(kernel_row)
+
+    pad_H = len(kernel_col)//2
+    pad_W = len(kernel_row)//2
+
+    acc_dtype = np.result_type(image, kernel_col, kernel_row)
+    padded_image = np.pad(image.astype(acc_dtype, copy=False), ((pad_H, pad_H),(pad_W,pad_W)),mode='constant',constant_values=0)
+
+    # column pass keeps the padded width so the row pass sees the zero border
+    columns = np.zeros((image_H, padded_image.shape[1]), dtype=acc_dtype)
+    for a, weight in enumerate(kernel_col):
+        if weight != 0:
+            columns += weight * padded_image[a:a+image_H]
+
+    output = np.zeros((image_H, image_W), dtype=acc_dtype)
+    for b, weight in enumerate(kernel_row):
+        if weight != 0:
+            output += weight * columns[:, b:b+image_W]
+
+    return output.astype(image.dtype, copy=False)
+
+
+@profiling.timed('gradients')
 def compute_image_gradients(image, kernel_='sobel'):
     if kernel_ =='sobel':
-        G_x = np.array([[-1, 0, 1],
-                            [-2, 0, 2],
-                            [-1, 0, 1]])
+        G_x = np.outer(SOBEL_SMOOTH, SOBEL_DERIVATIVE)
     elif kernel_ == 'finite-difference':
         G_x = np.array([[-1,1]])
 
     else:
-        print("{kernel_} not a recognized kernel")
+        raise ValueError(f"{kernel_} not a recognized kernel")
 
     G_y = G_x.transpose()
-    
-    Ix = convolve(image, G_x)
-    Iy = convolve(image, G_y)
+
+    if kernel_ == 'sobel' and np.issubdtype(image.dtype, np.integer):
+        # integer arithmetic is exact, so the separable passes match convolve
+        Ix = convolve_separable(image, SOBEL_SMOOTH, SOBEL_DERIVATIVE)
+        Iy = convolve_separable(image, SOBEL_DERIVATIVE, SOBEL_SMOOTH)
+    else:
+        Ix = convolve(image, G_x)
+        Iy = convolve(image, G_y)
 
     return Ix, Iy
 
-def compute_harris_response(Ix, Iy, window_size,k):
+def _sum_dtype(array):
+    # floats are summed in float64, integers follow np.sum's promotion rules
+    if np.issubdtype(array.dtype, np.floating):
+        return np.float64
+    return np.zeros(1, dtype=array.dtype).sum().dtype
+
+
+def box_sum(image, window_size):
+    '''
+    Sum of `image` over a (window_size x window_size) window centered on every
+    pixel, with zeros outside the image. Computed from a summed-area table, so
+    the cost does not depend on window_size. Even sizes are rounded up to the
+    next odd size, like the window used by `compute_harris_response`.
+    '''
+    height, width = image.shape
+    offset = int(window_size / 2)
+    size = 2*offset + 1
+
+    padded = np.pad(image.astype(_sum_dtype(image), copy=False), offset, mode='constant', constant_values=0)
+
+    sat = np.zeros((height + 2*offset + 1, width + 2*offset + 1), dtype=padded.dtype)
+    np.cumsum(padded, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+
+    return sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] + sat[:-size, :-size]
+
+
+def gaussian_box_sizes(sigma, passes=3):
+    '''
+    Odd box widths whose repeated application approximates a Gaussian with
+    standard deviation sigma (Kovesi, "Fast almost-Gaussian filtering").
+    '''
+    ideal = np.sqrt(12*sigma**2/passes + 1)
+    lower = int(np.floor(ideal))
+    if lower % 2 == 0:
+        lower -= 1
+    lower = max(lower, 1)
+    upper = lower + 2
+    m = round((12*sigma**2 - passes*lower**2 - 4*passes*lower - 3*passes) / (-4*lower - 4))
+    return [lower if i < m else upper for i in range(passes)]
+
+
+def gaussian_window_sum(image, window_size, sigma=None, passes=3):
+    '''
+    Gaussian-weighted window sum, approximated by `passes` box filters so the
+    cost does not depend on sigma. The weights are scaled to add up to the
+    pixel count of the box window, which keeps Harris thresholds comparable
+    between the two window types.
+    '''
+    if sigma is None:
+        # same rule as OpenCV's getGaussianKernel
+        sigma = 0.3*((window_size - 1)*0.5 - 1) + 0.8
+    offset = int(window_size / 2)
+
+    output = image.astype(np.float64)
+    for size in gaussian_box_sizes(sigma, passes):
+        output = box_sum(output, size) / size**2
+
+    return output * (2*offset + 1)**2
+
+
+@profiling.timed('harris')
+def compute_harris_response(Ix, Iy, window_size,k, window='box', sigma=None):
+    '''
+    Harris corner response R = det(M) - k*trace(M)^2 for every pixel.
+
+    The structure tensor sums are computed for the whole image at once, either
+    with a plain box window (window='box', identical to the per-pixel loop for
+    integer images and equal to rounding for float ones, whose sums are taken
+    in a different order) or a Gaussian-weighted window (window='gaussian'). Pixels closer than
+    window_size//2 to the border are left at zero.
+    '''
+    #products of derivatives
+    Ixx = Ix**2
+    Iyy = Iy**2
+    Ixy = Ix*Iy
+
+    if window == 'box':
+        Sxx = box_sum(Ixx, window_size)
+        Sxy = box_sum(Ixy, window_size)
+        Syy = box_sum(Iyy, window_size)
+    elif window == 'gaussian':
+        Sxx = gaussian_window_sum(Ixx, window_size, sigma)
+        Sxy = gaussian_window_sum(Ixy, window_size, sigma)
+        Syy = gaussian_window_sum(Iyy, window_size, sigma)
+    else:
+        raise ValueError(f"{window} not a recognized window")
+
+    height, width = Ix.shape
+    offset = int(window_size / 2)
+
+    R = np.zeros_like(Ix, dtype=float)
+
+    # Harris response, skipping the border like the sliding window did
+    inner = (slice(offset, height - offset), slice(offset, width - offset))
+    det = (Sxx[inner] * Syy[inner]) - (Sxy[inner]**2)
+    trace = Sxx[inner] + Syy[inner]
+    R[inner] = det - k * (trace**2)
+
+    return R
+
+
+def compute_harris_response_loop(Ix, Iy, window_size,k):
+    '''
+    Reference per-pixel implementation of `compute_harris_response`, kept for benchmarking.
+    '''
     #products of derivatives
     Ixx = Ix**2
     Iyy = Iy**2
@@ -72,7 +272,7 @@ def is_local_maxima(R, pixel, window_size=3):
     Check whether pixel at (x, y) is at a local maximum
     '''
     half_size = window_size // 2
-    y, x = pixel  # Unpack pixel tuple
+    x, y = pixel  # Unpack pixel tuple
 
     # Ensure the window doesn't go out of bounds
     if y - half_size < 0 or y + half_size >= R.shape[0] or x - half_size < 0 or x + half_size >= R.shape[1]:
@@ -82,26 +282,235 @@ def is_local_maxima(R, pixel, window_size=3):
 
     return R[y, x] == np.max(local_window) 
 
-def extract_keypoints(R, threshold):
-    keypoints = np.argwhere(R>threshold)
 
-    keypoints_list = []
-    for y, x in keypoints:
-        if is_local_maxima(R,(x,y)):
-            keypoints_list.append((x,y))
-    
-    return keypoints_list
+def maximum_filter(R, window_size=3):
+    '''
+    Maximum of R over a (window_size x window_size) window centered on every
+    pixel, computed as a row pass and a column pass of shifted maxima.
+    Values outside the image count as -inf.
+    '''
+    height, width = R.shape
+    half_size = window_size // 2
+
+    padded = np.pad(R.astype(float, copy=False), half_size, mode='constant', constant_values=-np.inf)
+
+    rows = padded[:, :width].copy()
+    for b in range(1, 2*half_size + 1):
+        np.maximum(rows, padded[:, b:b+width], out=rows)
+
+    output = rows[:height].copy()
+    for a in range(1, 2*half_size + 1):
+        np.maximum(output, rows[a:a+height], out=output)
+
+    return output
+
+
+def local_maxima_mask(R, window_size=3):
+    '''
+    Boolean mask of the pixels for which `is_local_maxima` holds, for the
+    whole image at once.
+    '''
+    height, width = R.shape
+    half_size = window_size // 2
+
+    mask = R == maximum_filter(R, window_size)
+
+    # windows that would leave the image are never maxima
+    mask[:half_size] = False
+    mask[height - half_size:] = False
+    mask[:, :half_size] = False
+    mask[:, width - half_size:] = False
+
+    return mask
+
+
+def adaptive_non_maximal_suppression(keypoints, responses, num_keypoints, c_robust=0.9, chunk_size=1024,
+                                     max_elements=1 << 22):
+    '''
+    Adaptive non-maximal suppression (Brown, Szeliski and Winder, 2005).
+
+    Every keypoint gets a suppression radius: the distance to the nearest
+    keypoint that is still stronger after scaling by c_robust. Keeping the
+    largest radii gives strong keypoints that are spread over the image.
+
+    Squared distances come from the expansion |a|^2 + |b|^2 - 2ab, exact for
+    integer pixel coordinates, so each chunk costs one matrix product and
+    holds a single (rows, stronger keypoints) array. The rows of a chunk are
+    reduced so that this array stays below max_elements entries.
+
+    Args:
+        keypoints: (N, 2) array of (x, y) keypoints.
+        responses: (N,) corner responses of the keypoints.
+        num_keypoints: Number of keypoints to keep.
+        c_robust: A neighbour suppresses a keypoint if c_robust*R_neighbour > R.
+        chunk_size: Maximum number of keypoints whose radii are computed at once.
+        max_elements: Memory budget of a chunk, in distances.
+
+    Returns:
+        indices: Indices of the kept keypoints, largest radius first.
+    '''
+    order = np.argsort(-responses, kind='stable')
+    points = keypoints[order].astype(float)
+    strength = responses[order]
+    squared = np.einsum('ij,ij->i', points, points)
 
+    # with responses sorted, the keypoints that suppress keypoint i form a prefix
+    n_stronger = np.searchsorted(-c_robust*strength, -strength, side='left')
 
-def harris_corner_detector(image, window_size=3, k=0.04, threshold=1e6):
+    radii = np.full(len(points), np.inf)
+    start = 0
+    while start < len(points):
+        # n_stronger grows with the index, so the last row of a chunk bounds its width
+        rows = min(chunk_size, len(points) - start)
+        rows = int(np.clip(max_elements // max(n_stronger[start + rows - 1], 1), 1, rows))
+        stop = start + rows
+        limit = n_stronger[stop - 1]
+        if limit > 0:
+            dist2 = points[start:stop] @ points[:limit].T
+            dist2 *= -2
+            dist2 += squared[:limit]
+            dist2 += squared[start:stop, None]
+            dist2[np.arange(limit)[None, :] >= n_stronger[start:stop, None]] = np.inf
+            radii[start:stop] = np.sqrt(np.maximum(dist2.min(axis=1), 0))
+        start = stop
+
+    keep = np.argsort(-radii, kind='stable')[:num_keypoints]
+    return order[keep]
+
+
+@profiling.timed('nms')
+def extract_keypoints(R, threshold, window_size=3, max_keypoints=None, anms=False, anms_candidates=10):
+    '''
+    Keypoints are the pixels above threshold that are the maximum of their
+    (window_size x window_size) neighbourhood.
+
+    Args:
+        R: Harris response.
+        threshold: Minimum response of a keypoint.
+        window_size: Size of the non-maximum suppression window.
+        max_keypoints: If set, keep at most this many keypoints.
+        anms: Select the max_keypoints keypoints with adaptive non-maximal
+            suppression instead of the strongest responses, so they are spread
+            over the image.
+        anms_candidates: ANMS only considers the strongest
+            anms_candidates*max_keypoints local maxima.
+
+    Returns:
+        keypoints: (N, 2) integer array of (x, y) keypoints in row-major order.
+    '''
+    mask = local_maxima_mask(R, window_size) & (R > threshold)
+    flat = np.flatnonzero(mask)
+
+    if max_keypoints is not None and len(flat) > max_keypoints:
+        responses = R.ravel()[flat]
+        if anms:
+            num_candidates = min(len(flat), anms_candidates*max_keypoints)
+            strongest = np.argpartition(-responses, num_candidates - 1)[:num_candidates]
+            points = np.column_stack(np.unravel_index(flat[strongest], R.shape))[:, ::-1]
+            selected = strongest[adaptive_non_maximal_suppression(points, responses[strongest], max_keypoints)]
+        else:
+            selected = np.argpartition(-responses, max_keypoints - 1)[:max_keypoints]
+        flat = np.sort(flat[selected])
+
+    y, x = np.unravel_index(flat, R.shape)
+    return np.column_stack((x, y))
+
+
+def harris_corner_detector(image, window_size=3, k=0.04, threshold=1e6, window='box', max_keypoints=None, anms=False):
     Ix,Iy = compute_image_gradients(image)
-    R = compute_harris_response(Ix,Iy, window_size,k)
+    R = compute_harris_response(Ix,Iy, window_size,k, window=window)
 
-    keypoints = extract_keypoints(R, threshold)
+    keypoints = extract_keypoints(R, threshold, max_keypoints=max_keypoints, anms=anms)
 
     return keypoints
 
 
+PYRAMID_KERNEL = np.array([1, 4, 6, 4, 1]) / 16
+
+
+def pyramid_down(image, method='gaussian'):
+    '''
+    Halve the resolution of an image.
+
+    'gaussian' blurs with the separable [1, 4, 6, 4, 1]/16 kernel (edges
+    replicated) and keeps every other pixel, 'box' averages 2x2 blocks.
+    Integer images are rounded back to their dtype.
+    '''
+    data = image.astype(float)
+    if method == 'gaussian':
+        height, width = data.shape
+        offset = len(PYRAMID_KERNEL)//2
+        padded = np.pad(data, offset, mode='edge')
+        # only the kept (even) rows and columns are filtered
+        columns = sum(weight * padded[a:a+height:2] for a, weight in enumerate(PYRAMID_KERNEL))
+        down = sum(weight * columns[:, b:b+width:2] for b, weight in enumerate(PYRAMID_KERNEL))
+    elif method == 'box':
+        height, width = (data.shape[0]//2)*2, (data.shape[1]//2)*2
+        data = data[:height, :width]
+        down = (data[0::2, 0::2] + data[1::2, 0::2] + data[0::2, 1::2] + data[1::2, 1::2]) / 4
+    else:
+        raise ValueError(f"{method} not a recognized pyramid")
+
+    if np.issubdtype(image.dtype, np.integer):
+        info = np.iinfo(image.dtype)
+        down = np.clip(np.rint(down), info.min, info.max)
+    return down.astype(image.dtype)
+
+
+@profiling.timed('pyramid')
+def build_pyramid(image, levels, method='gaussian'):
+    '''
+    Image pyramid [image, image/2, image/4, ...] with `levels` octaves below
+    the full resolution image.
+    '''
+    pyramid = [image]
+    for _ in range(levels):
+        pyramid.append(pyramid_down(pyramid[-1], method))
+    return pyramid
+
+
+def to_full_resolution(keypoints, octave, method='gaussian'):
+    '''
+    Map (x, y) keypoints detected on a pyramid octave back to the pixel grid
+    of the full resolution image.
+    '''
+    scale = 2**octave
+    # gaussian levels keep the even pixels, box levels sit at the block centers
+    shift = 0 if method == 'gaussian' else (scale - 1) / 2
+    return np.rint(np.asarray(keypoints) * scale + shift).astype(int).reshape(-1, 2)
 
 
+def octave_budgets(max_keypoints, octaves):
+    '''
+    Split a keypoint budget over octaves proportionally to their pixel count.
+    '''
+    if max_keypoints is None:
+        return [None] * len(octaves)
+    weights = np.array([4.0**-octave for octave in octaves])
+    return [max(1, int(round(max_keypoints * w))) for w in weights / weights.sum()]
+
+
+def harris_multiscale(image, octaves=(0,), pyramid_method='gaussian', max_keypoints=None, pyramid=None, **detector_kwargs):
+    '''
+    Harris corners detected on several octaves of an image pyramid.
+
+    Args:
+        image: Grayscale image (H x W).
+        octaves: Pyramid octaves to detect on, 0 is the full resolution.
+        pyramid_method: 'gaussian' or 'box', see `pyramid_down`.
+        max_keypoints: Total keypoint budget, split over the octaves by area.
+        pyramid: Prebuilt pyramid of the image, built here if None.
+        detector_kwargs: Other arguments of `harris_corner_detector`.
+
+    Returns:
+        List of (octave, keypoints) with (x, y) keypoints in the coordinates of
+        that octave; use `to_full_resolution` to map them back.
+    '''
+    if pyramid is None:
+        pyramid = build_pyramid(image, max(octaves), pyramid_method)
 
+    detections = []
+    for octave, budget in zip(octaves, octave_budgets(max_keypoints, octaves)):
+        keypoints = harris_corner_detector(pyramid[octave], max_keypoints=budget, **detector_kwargs)
+        detections.append((octave, keypoints))
+    return detections
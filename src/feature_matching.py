@@ -1,6 +1,11 @@
 import numpy as np
 
-def match_features(desc_1,desc_2, ratio_threshold=0.8):
+import profiling
+
+def match_features_loop(desc_1,desc_2, ratio_threshold=0.8):
+    '''
+    Reference per-descriptor implementation of `match_features`, kept for benchmarking.
+    '''
     mathces = []
 
     for i, desc1 in enumerate(desc_1):
@@ -18,20 +23,23 @@ def match_features(desc_1,desc_2, ratio_threshold=0.8):
         # Apply lowe's ratio to filter ambigous matches
         if best_distance<ratio_threshold * second_best_distance:
             mathces.append((i, best_idx))
-    
+
     return mathces
 
-def match_features_bidirectional(descriptors1, descriptors2, ratio_threshold=0.75):
+def match_features_bidirectional_loop(descriptors1, descriptors2, ratio_threshold=0.75):
+    '''
+    Reference per-descriptor implementation of `match_features_bidirectional`, kept for benchmarking.
+    '''
     matches = []
-    
+
     for i, desc1 in enumerate(descriptors1):
         distances = np.linalg.norm(descriptors2 - desc1, axis=1)
         best_idx = np.argmin(distances)
         best_distance = distances[best_idx]
-        
+
         distances[best_idx] = np.inf
         second_best_distance = np.min(distances)
-        
+
         if best_distance < ratio_threshold * second_best_distance:
             # Check if the match is reciprocal
             desc2 = descriptors2[best_idx]
@@ -39,5 +47,451 @@ def match_features_bidirectional(descriptors1, descriptors2, ratio_threshold=0.7
             back_best_idx = np.argmin(distances_back)
             if back_best_idx == i:
                 matches.append((i, best_idx))
-    
+
+    return matches
+
+
+# number of set bits of every byte value
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def hamming_distance(desc_1, desc_2):
+    '''
+    Hamming distances between packed binary descriptors, row by row (or
+    broadcast), with XOR and a popcount lookup table.
+    '''
+    return POPCOUNT[np.bitwise_xor(desc_1, desc_2)].sum(axis=-1, dtype=np.int64)
+
+
+def _popcount_words(packed):
+    # (words, N) transposed packed descriptors and their popcount: 64-bit words
+    # with the popcount instruction where NumPy has it, else the byte table
+    packed = np.ascontiguousarray(packed)
+    if hasattr(np, 'bitwise_count') and packed.shape[1] % 8 == 0:
+        return np.ascontiguousarray(packed.view(np.uint64).T), np.bitwise_count
+    return np.ascontiguousarray(packed.T), POPCOUNT.__getitem__
+
+
+def _hamming_nearest_neighbours(desc_1, desc_2, chunk_size=128, reverse=False):
+    # nearest_neighbours of packed binary descriptors, see there
+    N, M = len(desc_1), len(desc_2)
+    words_1, popcount = _popcount_words(desc_1)
+    words_2, _ = _popcount_words(desc_2)
+
+    best_idx = np.empty(N, dtype=np.intp)
+    best_distance = np.empty(N, dtype=np.int64)
+    second_distance = np.full(N, np.inf) if M == 1 else np.empty(N, dtype=np.int64)
+    if reverse:
+        back_idx = np.zeros(M, dtype=np.intp)
+        back_dist = np.full(M, np.iinfo(np.uint16).max, dtype=np.uint16)
+
+    for start in range(0, N, chunk_size):
+        stop = min(start + chunk_size, N)
+
+        # XOR and popcount one word of every pair at a time
+        dist = np.zeros((stop - start, M), dtype=np.uint16)
+        for word_1, word_2 in zip(words_1[:, start:stop], words_2):
+            dist += popcount(word_1[:, None] ^ word_2)
+
+        rows = np.arange(stop - start)
+        best = np.argmin(dist, axis=1)
+        best_idx[start:stop] = best
+        best_distance[start:stop] = dist[rows, best]
+
+        if reverse:
+            # keep the first index on ties, like argmin over the whole column
+            column_best = np.argmin(dist, axis=0)
+            column_dist = dist[column_best, np.arange(M)]
+            better = column_dist < back_dist
+            back_dist[better] = column_dist[better]
+            back_idx[better] = column_best[better] + start
+
+        if M > 1:
+            dist[rows, best] = np.iinfo(np.uint16).max
+            second_distance[start:stop] = dist.min(axis=1)
+
+    if reverse:
+        return best_idx, best_distance, second_distance, back_idx
+    return best_idx, best_distance, second_distance
+
+
+def nearest_neighbours(desc_1, desc_2, chunk_size=1024, reverse=False):
+    '''
+    Best and second-best neighbour in desc_2 of every descriptor in desc_1.
+
+    Squared distances come from the expansion |a|^2 + |b|^2 - 2ab, so each
+    chunk of chunk_size queries costs one matrix product and at most
+    chunk_size x len(desc_2) distances are held in memory. The two candidate
+    distances are then recomputed directly so the ratio test sees the same
+    values as the per-descriptor loop.
+
+    Binary uint8 descriptors (see `extract_binary_descriptors`) are compared
+    by Hamming distance, with XOR and popcount on their packed bytes taken as
+    64-bit words, a chunk of 128 queries at a time; both distances come
+    straight from the integer distances.
+
+    Args:
+        desc_1: (N, D) query descriptors.
+        desc_2: (M, D) reference descriptors, M >= 1.
+        chunk_size: Number of queries processed per matrix product.
+        reverse: Also return the nearest desc_1 index of every desc_2 row.
+
+    Returns:
+        best_idx: (N,) index of the nearest neighbour in desc_2.
+        best_distance: (N,) distance to it.
+        second_distance: (N,) distance to the second nearest (inf if M == 1).
+        back_idx: (M,) nearest neighbour in desc_1, only if reverse is True.
+    '''
+    desc_1 = np.asarray(desc_1)
+    desc_2 = np.asarray(desc_2)
+    N, M = len(desc_1), len(desc_2)
+
+    if desc_1.dtype == np.uint8:
+        return _hamming_nearest_neighbours(desc_1, desc_2, min(chunk_size, 128), reverse)
+
+    sq_2 = np.einsum('ij,ij->i', desc_2, desc_2)
+
+    best_idx = np.empty(N, dtype=np.intp)
+    second_idx = np.empty(N, dtype=np.intp)
+    if reverse:
+        back_idx = np.zeros(M, dtype=np.intp)
+        back_dist = np.full(M, np.inf, dtype=sq_2.dtype)
+
+    for start in range(0, N, chunk_size):
+        stop = min(start + chunk_size, N)
+        chunk = desc_1[start:stop]
+
+        dist2 = chunk @ desc_2.T
+        dist2 *= -2
+        dist2 += sq_2[None, :]
+        dist2 += np.einsum('ij,ij->i', chunk, chunk)[:, None]
+
+        best = np.argmin(dist2, axis=1)
+        best_idx[start:stop] = best
+        if M > 1:
+            candidates = np.argpartition(dist2, 1, axis=1)[:, :2]
+            second_idx[start:stop] = np.where(candidates[:, 0] == best, candidates[:, 1], candidates[:, 0])
+
+        if reverse:
+            # keep the first index on ties, like argmin over the whole column
+            column_best = np.argmin(dist2, axis=0)
+            column_dist = dist2[column_best, np.arange(M)]
+            better = column_dist < back_dist
+            back_dist[better] = column_dist[better]
+            back_idx[better] = column_best[better] + start
+
+    best_distance = np.linalg.norm(desc_1 - desc_2[best_idx], axis=1)
+    if M > 1:
+        second_distance = np.linalg.norm(desc_1 - desc_2[second_idx], axis=1)
+    else:
+        second_distance = np.full(N, np.inf)
+
+    if reverse:
+        return best_idx, best_distance, second_distance, back_idx
+    return best_idx, best_distance, second_distance
+
+
+@profiling.timed('matching')
+def match_features(desc_1,desc_2, ratio_threshold=0.8, chunk_size=1024, index=None):
+    '''
+    Match descriptors with Lowe's ratio test.
+
+    If an `LSHIndex` built on desc_2 is given, neighbours are searched
+    approximately through it instead of by brute force. Binary uint8
+    descriptors are matched by Hamming distance, see `nearest_neighbours`.
+
+    Returns:
+        matches: List of (i, j) pairs, desc_1[i] matched to desc_2[j].
+    '''
+    if len(desc_1) == 0 or len(desc_2) == 0:
+        return []
+
+    if index is not None:
+        best_idx, best_distance, second_distance = index.query(desc_1)
+    else:
+        best_idx, best_distance, second_distance = nearest_neighbours(desc_1, desc_2, chunk_size)
+
+    # Apply lowe's ratio to filter ambigous matches
+    keep = np.flatnonzero(best_distance < ratio_threshold * second_distance)
+
+    return list(zip(keep.tolist(), best_idx[keep].tolist()))
+
+@profiling.timed('matching')
+def match_features_bidirectional(descriptors1, descriptors2, ratio_threshold=0.75, chunk_size=1024, index1=None, index2=None):
+    '''
+    Match descriptors with Lowe's ratio test, keeping only mutual nearest neighbours.
+
+    If `LSHIndex` objects built on descriptors1 and descriptors2 are given,
+    both directions are searched approximately through them.
+
+    Returns:
+        matches: List of (i, j) pairs, descriptors1[i] matched to descriptors2[j].
+    '''
+    if len(descriptors1) == 0 or len(descriptors2) == 0:
+        return []
+
+    if index1 is not None and index2 is not None:
+        best_idx, best_distance, second_distance = index2.query(descriptors1)
+        keep = np.flatnonzero(best_distance < ratio_threshold * second_distance)
+        # only the ratio-test survivors need a reverse query
+        back_best, back_distance, _ = index1.query(np.asarray(descriptors2)[best_idx[keep]])
+        keep = keep[(back_best == keep) & np.isfinite(back_distance)]
+        return list(zip(keep.tolist(), best_idx[keep].tolist()))
+
+    best_idx, best_distance, second_distance, back_idx = nearest_neighbours(
+        descriptors1, descriptors2, chunk_size, reverse=True)
+
+    # Check if the match passes the ratio test and is reciprocal
+    keep = best_distance < ratio_threshold * second_distance
+    keep &= back_idx[best_idx] == np.arange(len(descriptors1))
+    keep = np.flatnonzero(keep)
+
+    return list(zip(keep.tolist(), best_idx[keep].tolist()))
+
+
+def _strip_index(points, axis, cell_size):
+    '''
+    Points sorted by strips of cell_size pixels along axis, then by their
+    other coordinate, as float keys strip * span + across.
+    '''
+    strips = np.floor(points[:, axis] / cell_size)
+    span = np.ceil(points[:, 1 - axis].max()) + 1
+    keys = strips * span + points[:, 1 - axis]
+    order = np.argsort(keys, kind='stable')
+    return keys[order], order, span, int(strips.max()) + 1
+
+
+def _epipolar_band(lines, index, cell_size, radius):
+    '''
+    Candidate points within a strip-wise bound of radius from normalized
+    lines a*along + b*across + c = 0 with |b| >= |a|, using a `_strip_index`
+    built along the same axis. Degenerate lines with a = b = 0, the lines of
+    keypoints at the epipole, constrain nothing and get no candidates.
+
+    Returns:
+        line_ids, point_ids: (K,) candidate pairs, grouped by line.
+    '''
+    keys, order, span, n_strips = index
+    a, b, c = lines.T
+    # normalized lines have |b| >= 1/sqrt(2) unless they are degenerate
+    defined = np.abs(b) > 0.5
+    b = np.where(defined, b, 1.0)
+    # across coordinates of each line at both ends of every strip, widened by
+    # the across offset of a point at distance radius from the line
+    edges = np.arange(n_strips + 1) * cell_size
+    ends = -(a[:, None] * edges + c[:, None]) / b[:, None]
+    offset = (radius / np.abs(b))[:, None]
+    lo = np.minimum(ends[:, :-1], ends[:, 1:]) - offset
+    hi = np.maximum(ends[:, :-1], ends[:, 1:]) + offset
+
+    # only search the strips where the band crosses the image
+    line_ids, strips = np.nonzero((hi >= 0) & (lo <= span - 1) & defined[:, None])
+    lo = np.maximum(lo[line_ids, strips], 0) + strips * span
+    hi = np.minimum(hi[line_ids, strips], span - 1) + strips * span
+    starts = np.searchsorted(keys, lo, side='left')
+    stops = np.searchsorted(keys, hi, side='right')
+    lengths = stops - starts
+
+    line_ids = np.repeat(line_ids, lengths)
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return line_ids, order[positions]
+
+
+@profiling.timed('guided_matching')
+def match_features_guided(desc_1, desc_2, keypoints1, keypoints2, F, ratio_threshold=0.8, threshold=2.0,
+                          cell_size=None, chunk_size=1024):
+    '''
+    Match descriptors along the epipolar lines of a fundamental matrix.
+
+    The keypoints of the second image are bucketed into strips of cell_size
+    pixels, sorted inside each strip, both by rows and by columns. Each
+    descriptor of the first image is only compared with the keypoints lying
+    within threshold pixels of its epipolar line, found with one range
+    search per strip crossed by the line, and the ratio test is applied
+    among those candidates. Far fewer distances are computed than by brute
+    force, and matches rejected as ambiguous over the whole image can be
+    recovered. Keypoints with fewer than two candidates, or at the epipole
+    where the epipolar line is undefined, are not matched.
+
+    Args:
+        desc_1, desc_2: (N, D) and (M, D) descriptors, binary uint8 ones
+            are compared by Hamming distance.
+        keypoints1, keypoints2: (N, 2) and (M, 2) (x, y) keypoints.
+        F: Fundamental matrix with x2^T F x1 = 0.
+        ratio_threshold: Lowe's ratio among the candidates.
+        threshold: Maximum distance in pixels of a candidate to the epipolar line.
+        cell_size: Width of the strips in pixels, by default three times the
+            mean spacing of the second-image keypoints, which balances the
+            range searches per line against the candidates they return.
+        chunk_size: Number of first-image descriptors processed at once.
+
+    Returns:
+        matches: List of (i, j) pairs, desc_1[i] matched to desc_2[j].
+    '''
+    if len(desc_1) == 0 or len(desc_2) == 0:
+        return []
+    desc_1, desc_2 = np.asarray(desc_1), np.asarray(desc_2)
+    keypoints1 = np.asarray(keypoints1, dtype=np.float64)
+    keypoints2 = np.asarray(keypoints2, dtype=np.float64)
+
+    # epipolar lines in a frame where the keypoints of the second image are
+    # non-negative, normalized so that |l . x| is a distance in pixels
+    origin = keypoints2.min(axis=0)
+    points2 = keypoints2 - origin
+    if cell_size is None:
+        cell_size = max(3 * np.sqrt(np.prod(points2.max(axis=0) + 1) / len(points2)), 1.0)
+    lines = np.column_stack((keypoints1, np.ones(len(keypoints1)))) @ F.T
+    lines[:, 2] += lines[:, :2] @ origin
+    norms = np.linalg.norm(lines[:, :2], axis=1, keepdims=True)
+    lines /= np.where(norms > 0, norms, 1.0)
+
+    # lines closer to horizontal are searched in columns, the others in rows
+    horizontal = np.abs(lines[:, 1]) >= np.abs(lines[:, 0])
+    groups = ((np.flatnonzero(horizontal), [0, 1, 2], _strip_index(points2, 0, cell_size)),
+              (np.flatnonzero(~horizontal), [1, 0, 2], _strip_index(points2, 1, cell_size)))
+
+    matches = []
+    for queries, axes, index in groups:
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start:start + chunk_size]
+            line_ids, candidate_ids = _epipolar_band(lines[chunk][:, axes], index, cell_size, threshold)
+            near = np.abs(np.sum(lines[chunk[line_ids], :2] * points2[candidate_ids], axis=1)
+                          + lines[chunk[line_ids], 2]) < threshold
+            line_ids, candidate_ids = line_ids[near], candidate_ids[near]
+            if len(line_ids) == 0:
+                continue
+
+            # best and second best candidate of every line, the candidates are grouped by line
+            if desc_1.dtype == np.uint8:
+                distances = hamming_distance(desc_1[chunk[line_ids]], desc_2[candidate_ids]).astype(np.float64)
+            else:
+                differences = np.take(desc_1, chunk[line_ids], axis=0)
+                differences -= np.take(desc_2, candidate_ids, axis=0)
+                distances = np.sqrt(np.einsum('ij,ij->i', differences, differences))
+            first = np.flatnonzero(np.r_[True, line_ids[1:] != line_ids[:-1]])
+            counts = np.diff(np.r_[first, len(line_ids)])
+            group = np.repeat(np.arange(len(first)), counts)
+            best_distance = np.minimum.reduceat(distances, first)
+            best = np.flatnonzero(distances == best_distance[group])
+            best = best[np.r_[True, group[best][1:] != group[best][:-1]]]
+            distances[best] = np.inf
+            second_distance = np.minimum.reduceat(distances, first)
+
+            keep = (counts > 1) & (best_distance < ratio_threshold * second_distance)
+            matches.extend(zip(chunk[line_ids[best[keep]]].tolist(), candidate_ids[best[keep]].tolist()))
+
+    matches.sort()
     return matches
+
+
+class LSHIndex:
+    '''
+    Approximate nearest-neighbour index over a fixed set of descriptors.
+
+    Descriptors are projected onto their leading principal components and
+    hashed by the signs of n_bits randomly rotated projections, once per
+    table. A query is compared exactly only against the descriptors sharing
+    one of its buckets, in any table, or one of the n_probes buckets reached
+    by flipping its least confident bits. More tables and probes raise recall,
+    more bits make buckets smaller and queries faster.
+
+    Build the index once per image and query it with the descriptors of every
+    image it is matched against.
+    '''
+
+    @profiling.timed('lsh_index')
+    def __init__(self, descriptors, n_tables=4, n_bits=12, n_probes=2, seed=0):
+        if np.asarray(descriptors).dtype == np.uint8:
+            raise ValueError("LSHIndex needs float descriptors, match binary descriptors by brute force")
+        self.descriptors = np.ascontiguousarray(descriptors)
+        self.n_probes = min(n_probes, n_bits)
+
+        data = self.descriptors.astype(np.float64)
+        self.mean = data.mean(axis=0)
+        centered = data - self.mean
+
+        # leading principal components, from the (D x D) covariance
+        _, eigvecs = np.linalg.eigh(centered.T @ centered)
+        n_components = min(data.shape[1], 2*n_bits)
+        components = eigvecs[:, ::-1][:, :n_components]
+
+        rng = np.random.default_rng(seed)
+        self.projections = []
+        self.orders = []
+        self.sorted_codes = []
+        for _ in range(n_tables):
+            rotation, _ = np.linalg.qr(rng.standard_normal((n_components, n_components)))
+            projection = components @ rotation[:, :n_bits]
+            codes = self._codes(centered @ projection)
+            order = np.argsort(codes, kind='stable')
+            self.projections.append(projection)
+            self.orders.append(order)
+            self.sorted_codes.append(codes[order])
+
+    def __len__(self):
+        return len(self.descriptors)
+
+    @staticmethod
+    def _codes(projected):
+        bits = (projected > 0).astype(np.int64)
+        return bits @ (np.int64(1) << np.arange(projected.shape[1], dtype=np.int64))
+
+    def _candidates(self, queries):
+        '''
+        (query, descriptor) index pairs that share at least one probed bucket,
+        without duplicates and sorted by query.
+        '''
+        centered = queries.astype(np.float64) - self.mean
+        query_ids, candidate_ids = [], []
+        for projection, order, sorted_codes in zip(self.projections, self.orders, self.sorted_codes):
+            projected = centered @ projection
+            codes = self._codes(projected)
+
+            # multi-probe: also visit the buckets across the least confident hyperplanes
+            flips = np.argsort(np.abs(projected), axis=1)[:, :self.n_probes]
+            probes = np.column_stack((codes, codes[:, None] ^ (np.int64(1) << flips)))
+
+            lo = np.searchsorted(sorted_codes, probes, side='left').ravel()
+            hi = np.searchsorted(sorted_codes, probes, side='right').ravel()
+            lengths = hi - lo
+
+            # concatenate the ranges order[lo:hi] of all probes without a loop
+            starts = np.cumsum(lengths) - lengths
+            positions = np.arange(lengths.sum()) + np.repeat(lo - starts, lengths)
+            query_ids.append(np.repeat(np.repeat(np.arange(len(queries)), probes.shape[1]), lengths))
+            candidate_ids.append(order[positions])
+
+        keys = np.unique(np.concatenate(query_ids)*len(self) + np.concatenate(candidate_ids))
+        return keys // len(self), keys % len(self)
+
+    def query(self, queries, chunk_size=256):
+        '''
+        Approximate best and second-best neighbour of every query, with the
+        same outputs as `nearest_neighbours`. Queries with fewer than two
+        candidates get an infinite best (and second) distance.
+        '''
+        queries = np.asarray(queries)
+        N = len(queries)
+        best_idx = np.zeros(N, dtype=np.intp)
+        best_distance = np.full(N, np.inf)
+        second_distance = np.full(N, np.inf)
+
+        for start in range(0, N, chunk_size):
+            chunk = queries[start:start + chunk_size]
+            query_ids, candidate_ids = self._candidates(chunk)
+            distances = np.linalg.norm(chunk[query_ids] - self.descriptors[candidate_ids], axis=1)
+
+            # per query: nearest first, lowest index first on ties
+            order = np.lexsort((candidate_ids, distances, query_ids))
+            query_ids, candidate_ids, distances = query_ids[order], candidate_ids[order], distances[order]
+            first = np.flatnonzero(np.r_[True, query_ids[1:] != query_ids[:-1]])
+            has_second = (first + 1 < len(query_ids))
+            has_second[has_second] = query_ids[first[has_second] + 1] == query_ids[first[has_second]]
+            first = first[has_second]
+
+            rows = start + query_ids[first]
+            best_idx[rows] = candidate_ids[first]
+            best_distance[rows] = distances[first]
+            second_distance[rows] = distances[first + 1]
+
+        return best_idx, best_distance, second_distance
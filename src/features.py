@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import feature_detection as fd
+import feature_description as fp
+import profiling
+
+
+def detect_and_describe(image, detector_kwargs=None, patch_size=9, octaves=(0,), pyramid_method='gaussian', descriptor='patch'):
+    """
+    Harris keypoints and descriptors of one grayscale image.
+
+    The image pyramid is built once. Keypoints are detected on each of the
+    given octaves and described on the same octave, then mapped back to the
+    full resolution image; several octaves give multi-scale Harris.
+
+    Args:
+        image: Grayscale image (H x W).
+        detector_kwargs: Keyword arguments of `harris_corner_detector`.
+        patch_size: Side length of the descriptor patch.
+        octaves: Pyramid octaves to detect on, 0 is the full resolution.
+        pyramid_method: 'gaussian' or 'box', see `feature_detection.pyramid_down`.
+        descriptor: 'patch' for normalized intensity patches or 'brief' for
+            binary descriptors, see `feature_description.DESCRIPTORS`.
+
+    Returns:
+        keypoints: (N, 2) array of (x, y) keypoints at full resolution.
+        descriptors: (N, patch_size**2) float32 patch descriptors or
+            (N, 32) uint8 binary descriptors.
+    """
+    if descriptor not in fp.DESCRIPTORS:
+        raise ValueError(f"{descriptor} not a recognized descriptor")
+    describe = fp.DESCRIPTORS[descriptor]
+    detector_kwargs = dict(detector_kwargs or {})
+    if tuple(octaves) == (0,):
+        keypoints = fd.harris_corner_detector(image, **detector_kwargs)
+        descriptors = describe(image, keypoints, patch_size=patch_size)
+        return keypoints, descriptors
+
+    pyramid = fd.build_pyramid(image, max(octaves), pyramid_method)
+    all_keypoints, all_descriptors = [], []
+    for octave, keypoints in fd.harris_multiscale(image, octaves, pyramid_method, pyramid=pyramid, **detector_kwargs):
+        all_descriptors.append(describe(pyramid[octave], keypoints, patch_size=patch_size))
+        all_keypoints.append(fd.to_full_resolution(keypoints, octave, pyramid_method))
+
+    return np.concatenate(all_keypoints), np.concatenate(all_descriptors)
+
+
+def iter_features(images, detector_kwargs=None, patch_size=9, workers=None, executor='thread', cache=None,
+                  octaves=(0,), pyramid_method='gaussian', descriptor='patch'):
+    """
+    Compute keypoints and descriptors exactly once per image, spread over a
+    pool of workers, and yield them in image order. With an `ArrayCache`,
+    images whose content and parameters were seen before are read from it
+    instead.
+
+    At most 2*workers images are in flight, so images can be a lazy iterable
+    and are only pulled as results are consumed.
+
+    Args:
+        images: Iterable of grayscale images.
+        detector_kwargs: Keyword arguments of `harris_corner_detector`.
+        patch_size: Side length of the descriptor patch.
+        workers: Number of workers, os.cpu_count() if None. With 1 worker
+            everything runs in the calling process.
+        executor: 'thread' for a thread pool (the NumPy kernels release the
+            GIL, and the images are not copied), 'process' for a process pool,
+            which pickles every image to its worker.
+        cache: Optional `ArrayCache` for the results.
+        octaves, pyramid_method, descriptor: See `detect_and_describe`.
+
+    Yields:
+        (keypoints, descriptors) of every image, see `detect_and_describe`.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        pool = None
+    elif executor == 'process':
+        # forking while another thread (e.g. the image prefetcher) holds a lock
+        # can deadlock the workers, so start them from a clean process
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    elif executor == 'thread':
+        pool = ThreadPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f"{executor} not a recognized executor")
+
+    max_pending = 2*workers if pool is not None else 1
+
+    # worker processes profile their own calls and send the stats back
+    profiled = profiling.enabled() and executor == 'process' and pool is not None
+
+    def finish(key, result):
+        if isinstance(result, Future):
+            result = result.result()
+            if profiled:
+                result, stats = result
+                profiling.merge(stats)
+        keypoints, descriptors = result
+        if key is not None:
+            cache.store('features', key, keypoints=keypoints, descriptors=descriptors)
+        return keypoints, descriptors
+
+    try:
+        pending = deque()
+        for image in images:
+            key = None
+            cached = None
+            if cache is not None:
+                key = cache.key(image, detector_kwargs, patch_size, list(octaves), pyramid_method, descriptor)
+                cached = cache.load('features', key)
+
+            if cached is not None:
+                pending.append((None, (cached['keypoints'], cached['descriptors'])))
+            elif pool is None:
+                pending.append((key, detect_and_describe(image, detector_kwargs, patch_size, octaves, pyramid_method, descriptor)))
+            elif profiled:
+                pending.append((key, pool.submit(profiling.profiled_call, detect_and_describe, image, detector_kwargs, patch_size, octaves, pyramid_method, descriptor)))
+            else:
+                pending.append((key, pool.submit(detect_and_describe, image, detector_kwargs, patch_size, octaves, pyramid_method, descriptor)))
+
+            if len(pending) >= max_pending:
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
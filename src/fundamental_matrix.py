@@ -1,79 +1,281 @@
 import numpy as np 
-import random
 
-def estimate_fundamental_matrix(matches, key1, key2):
+import profiling
+
+def homogeneous_matches(matches, key1, key2):
+    """
+    Gather the matched keypoints as homogeneous coordinate arrays.
+
+    Args:
+        matches: List or (N, 2) array of matched keypoint indices.
+        keypoints1, keypoints2: Keypoints (x, y) of both images.
+
+    Returns:
+        x1, x2: (N, 3) float arrays of matched points in image 1 and 2.
+    """
+    matches = np.asarray(matches, dtype=np.intp).reshape(-1, 2)
+    key1 = np.asarray(key1, dtype=float).reshape(-1, 2)
+    key2 = np.asarray(key2, dtype=float).reshape(-1, 2)
+
+    ones = np.ones((len(matches), 1))
+    x1 = np.hstack((key1[matches[:, 0]], ones))
+    x2 = np.hstack((key2[matches[:, 1]], ones))
+    return x1, x2
+
+
+def normalize_points(x):
+    """
+    Hartley normalization: translate the points to their centroid and scale
+    them to an average distance of sqrt(2) from it.
+
+    Args:
+        x: (..., n, 3) homogeneous points.
+
+    Returns:
+        x_norm: (..., n, 3) normalized points.
+        T: (..., 3, 3) transforms with x_norm = x @ T.T
     """
-    Estimate the fundamental matrix using the 8-point algorithm.
+    centroid = x[..., :2].mean(axis=-2)
+    mean_distance = np.linalg.norm(x[..., :2] - centroid[..., None, :], axis=-1).mean(axis=-1)
+    scale = np.sqrt(2) / np.maximum(mean_distance, 1e-12)
+
+    T = np.zeros(x.shape[:-2] + (3, 3))
+    T[..., 0, 0] = scale
+    T[..., 1, 1] = scale
+    T[..., :2, 2] = -scale[..., None] * centroid
+    T[..., 2, 2] = 1
+    return x @ np.swapaxes(T, -1, -2), T
+
+
+def eight_point(x1, x2, normalize=True):
+    """
+    Batched 8-point algorithm.
+
+    Args:
+        x1, x2: (..., n, 3) homogeneous points with n >= 8.
+        normalize: Apply Hartley normalization before solving, which keeps the
+            linear system well conditioned for pixel coordinates.
+
+    Returns:
+        F: (..., 3, 3) fundamental matrices of rank 2 and unit Frobenius norm.
+    """
+    if normalize:
+        x1, T1 = normalize_points(x1)
+        x2, T2 = normalize_points(x2)
+
+    # each row is the flattened outer product x2 x1^T, so A @ F.ravel() = x2^T F x1
+    A = (x2[..., :, :, None] * x1[..., :, None, :]).reshape(x1.shape[:-1] + (9,))
+
+    # SVD on A, the full V is only needed when A has fewer rows than unknowns
+    _, _, Vt = np.linalg.svd(A, full_matrices=A.shape[-2] < 9)
+    F = Vt[..., -1, :].reshape(x1.shape[:-2] + (3, 3))
+
+    #Enforce rank=2 constraint by setting smallest singular value to zero
+    U, S, Vt = np.linalg.svd(F)
+    S[..., 2] = 0
+    F = (U * S[..., None, :]) @ Vt
+
+    if normalize:
+        F = np.swapaxes(T2, -1, -2) @ F @ T1
+    return F / np.linalg.norm(F, axis=(-2, -1), keepdims=True)
+
+
+def estimate_fundamental_matrix(matches, key1, key2, normalize=True):
+    """
+    Estimate the fundamental matrix using the (normalized) 8-point algorithm.
     
     Args:
         matches: List of matched keypoint indices.
         keypoints1, keypoints2: Lists of keypoints from both images.
+        normalize: Use Hartley normalization.
     
     Returns:
         F: Estimated 3x3 fundamental matrix.
     """
-    A = []
-    for (i,j) in matches:
-        x1, y1 = key1[i]
-        x2, y2 = key2[j]
-        A.append([x2*x1,x2*y1,x2,y2*x1,y2*y1,y2,x1,y1,1])
-    
-    A = np.array(A)
+    x1, x2 = homogeneous_matches(matches, key1, key2)
+    return eight_point(x1, x2, normalize)
 
-    # SVD on A
-    U, S, Vt = np.linalg.svd(A)
-    F = Vt[-1].reshape(3,3)
 
-    #Enforce rank=2 constraint by setting smallest singular value to zero
-    U, S, Vt = np.linalg.svd(F)
-    S[2]=0
-    F = U @ np.diag(S) @ Vt
+def epipolar_error(F, x1, x2, kind='sampson'):
+    """
+    Epipolar error of every match under every model.
+
+    Args:
+        F: (3, 3) or (B, 3, 3) fundamental matrices.
+        x1, x2: (N, 3) homogeneous points.
+        kind: 'sampson' (first-order geometric distance, in pixels),
+            'symmetric' (distance to both epipolar lines, in pixels) or
+            'algebraic' (|x2^T F x1|, depends on the scale of F).
+
+    Returns:
+        error: (N,) or (B, N) errors.
+    """
+    Fx1 = x1 @ np.swapaxes(F, -1, -2)
+    Ftx2 = x2 @ F
+    residual = np.sum(Fx1 * x2, axis=-1)
+
+    if kind == 'algebraic':
+        return np.abs(residual)
+    line2 = Fx1[..., 0]**2 + Fx1[..., 1]**2
+    line1 = Ftx2[..., 0]**2 + Ftx2[..., 1]**2
+    if kind == 'sampson':
+        return np.abs(residual) / np.sqrt(line1 + line2 + 1e-300)
+    if kind == 'symmetric':
+        return np.abs(residual) * np.sqrt(1/(line1 + 1e-300) + 1/(line2 + 1e-300))
+    raise ValueError(f"{kind} not a recognized epipolar error")
+
+
+def algebraic_error(F, x1, x2):
+    """
+    Epipolar constraint error |x2^T F x1| of every match under every model.
 
-    return F
+    Args:
+        F: (3, 3) or (B, 3, 3) fundamental matrices.
+        x1, x2: (N, 3) homogeneous points.
+
+    Returns:
+        error: (N,) or (B, N) errors.
+    """
+    return epipolar_error(F, x1, x2, kind='algebraic')
 
-def ransac_F(matches,key1,key2,num_iterations=1e3,threshold=1e-2):
+
+def ransac_iterations_needed(inlier_ratio, sample_size, confidence):
+    """
+    Number of iterations after which a sample free of outliers has been drawn
+    with the given confidence.
     """
-    Estimate the fundamental matrix using RANSAC to filter outliers.
+    if inlier_ratio <= 0:
+        return np.inf
+    p_good = inlier_ratio**sample_size
+    if p_good >= 1:
+        return 0
+    return np.log(1 - confidence) / np.log1p(-p_good)
+
+
+@profiling.timed('ransac')
+def ransac_F(matches,key1,key2,num_iterations=1e3,threshold=1.0, confidence=0.99, batch_size=64, error='sampson',
+             normalize=True, local_optimization=True, lo_iterations=3, seed=None, return_info=False):
+    """
+    Estimate the fundamental matrix using LO-RANSAC to filter outliers.
+
+    Hypotheses come from the Hartley-normalized 8-point algorithm, are drawn
+    and solved in batches, and each batch is scored against all matches at
+    once. Whenever a better model is found it is refitted on all of its
+    inliers while that increases the inlier count (local optimization).
+    Sampling stops as soon as the best inlier ratio so far guarantees an
+    outlier-free sample with the given confidence, or after num_iterations
+    hypotheses.
     
     Args:
         matches: List of matched keypoint indices.
         keypoints1, keypoints2: Lists of keypoints from both images.
-        num_iterations: Number of RANSAC iterations.
-        threshold: Epipolar constraint threshold to consider a match as an inlier.
+        num_iterations: Maximum number of RANSAC iterations.
+        threshold: Epipolar error threshold to consider a match as an inlier
+            (in pixels for the 'sampson' and 'symmetric' errors).
+        confidence: Probability of having drawn at least one outlier-free sample.
+        batch_size: Number of hypotheses estimated and scored together.
+        error: Epipolar error used for scoring, see `epipolar_error`.
+        normalize: Use Hartley normalization in the 8-point algorithm.
+        local_optimization: Refit improved models on their inliers.
+        lo_iterations: Maximum number of refits per improved model.
+        seed: Seed of the random sampler.
+        return_info: Also return a dict with the number of iterations run and
+            the iteration at which the returned model was found.
     
     Returns:
         best_F: The best estimated fundamental matrix.
         inliers: List of inlier matches.
+        info: Only if return_info is True.
     """
+    matches_arr = np.asarray(matches, dtype=np.intp).reshape(-1, 2)
+    x1, x2 = homogeneous_matches(matches_arr, key1, key2)
+
+    def solve(x1_samples, x2_samples):
+        return eight_point(x1_samples, x2_samples, normalize)[:, None], None
+
+    def refit(x1_inliers, x2_inliers):
+        return eight_point(x1_inliers, x2_inliers, normalize)
+
+    best_F, best_mask, info = lo_ransac(x1, x2, 8, solve, refit, num_iterations, threshold, confidence, batch_size,
+                                        error, local_optimization, lo_iterations, seed)
+
+    best_inliers = [tuple(match) for match in matches_arr[best_mask].tolist()]
+
+    if return_info:
+        return best_F, best_inliers, info
+    return best_F, best_inliers
+
+
+def lo_ransac(x1, x2, sample_size, solve, refit, num_iterations, threshold, confidence=0.99, batch_size=64,
+              error='sampson', local_optimization=True, lo_iterations=3, seed=None):
+    """
+    Batched LO-RANSAC loop shared by the fundamental and essential matrix estimators.
+
+    Args:
+        x1, x2: (N, 3) homogeneous pixel coordinates of the matches.
+        sample_size: Number of matches per minimal sample.
+        solve: Maps (B, sample_size, 3) sample arrays to (B, m, 3, 3)
+            fundamental matrices and a (B, m) validity mask (None if all valid).
+        refit: Maps (n, 3) inlier arrays to a single fundamental matrix.
+        Other arguments: see `ransac_F`.
+
+    Returns:
+        best_F: Fundamental matrix with the most inliers.
+        best_mask: (N,) boolean inlier mask.
+        info: dict with the number of iterations run, the iteration at which
+            the returned model was found and its inlier count.
+    """
+    n_matches = len(x1)
+    if n_matches < sample_size:
+        raise ValueError(f"RANSAC needs at least {sample_size} matches, got {n_matches}")
+    rng = np.random.default_rng(seed)
+
     best_F = None
-    best_inliers = []
+    best_mask = np.zeros(n_matches, dtype=bool)
     max_inliers = 0
+    max_iterations = int(num_iterations)
+    iterations_needed = max_iterations
+    iterations = 0
+    best_iteration = 0
 
-    for _ in range(int(num_iterations)):
-        # Randomly choose 8 matches
-        sample_matches = random.sample(matches,8)
+    while iterations < min(max_iterations, iterations_needed):
+        batch = int(min(batch_size, max_iterations - iterations))
 
-        # Estimate F 
-        F = estimate_fundamental_matrix(sample_matches, key1, key2)
-        inliers = []
-        for (i,j) in matches:
-            x1,y1 = key1[i]
-            x2,y2 = key2[j]
-            x1_h = np.array([x1,y1,1])
-            x2_h = np.array([x2,y2,1])
+        # Randomly choose sample_size distinct matches per hypothesis
+        samples = np.argpartition(rng.random((batch, n_matches)), sample_size - 1, axis=1)[:, :sample_size]
 
-            # Epipolar constraint error: x2.T * F * x1 should be close to 0
-            error = np.abs(x2_h.T @ F @ x1_h)
-            if error< threshold:
-                inliers.append((i,j))
+        # Estimate the models of the whole batch and score every match under each one
+        F, valid = solve(x1[samples], x2[samples])
+        models_per_sample = F.shape[1]
+        F = F.reshape(-1, 3, 3)
+        inlier_masks = epipolar_error(F, x1, x2, error) < threshold
+        counts = inlier_masks.sum(axis=1)
+        if valid is not None:
+            counts[~valid.ravel()] = -1
 
         # update best if more inliers are found
-        if len(inliers)>max_inliers:
-            max_inliers =len(inliers)
-            best_inliers = inliers
-            best_F = F
+        best = np.argmax(counts)
+        if counts[best] > max_inliers:
+            best_F, best_mask = F[best], inlier_masks[best]
+            best_iteration = iterations + best // models_per_sample + 1
 
-    return best_F, best_inliers
+            if local_optimization:
+                for _ in range(lo_iterations):
+                    if best_mask.sum() < max(sample_size, 8):
+                        break
+                    refit_F = refit(x1[best_mask], x2[best_mask])
+                    refit_mask = epipolar_error(refit_F, x1, x2, error) < threshold
+                    if refit_mask.sum() <= best_mask.sum():
+                        break
+                    best_F, best_mask = refit_F, refit_mask
+
+            max_inliers = best_mask.sum()
+            iterations_needed = ransac_iterations_needed(max_inliers / n_matches, sample_size, confidence)
+
+        iterations += batch
+
+    info = {'iterations': iterations, 'best_iteration': int(best_iteration), 'inliers': int(max_inliers)}
+    return best_F, best_mask, info
 
 
 def compute_essential_matrix(F, K):
@@ -126,9 +328,164 @@ def decompose_essential_matrix(E):
     return R1, R2, t
 
 
+# Monomials of degree <= 3 in the null-space coefficients (x, y, z) of the
+# 5-point algorithm, as exponent triples. The ten cubic monomials come first;
+# the last ten form the basis of the quotient ring used for the action matrix.
+_MONOMIALS = [(3, 0, 0), (2, 1, 0), (1, 2, 0), (0, 3, 0), (2, 0, 1), (1, 1, 1), (0, 2, 1), (1, 0, 2), (0, 1, 2), (0, 0, 3),
+              (2, 0, 0), (1, 1, 0), (0, 2, 0), (1, 0, 1), (0, 1, 1), (0, 0, 2), (1, 0, 0), (0, 1, 0), (0, 0, 1), (0, 0, 0)]
+
+
+def _monomial_product_table():
+    # row 20*i + j has a one in column k if monomial i times monomial j is monomial k
+    index = {m: k for k, m in enumerate(_MONOMIALS)}
+    table = np.zeros((20, 20, 20))
+    for i, a in enumerate(_MONOMIALS):
+        for j, b in enumerate(_MONOMIALS):
+            product = (a[0] + b[0], a[1] + b[1], a[2] + b[2])
+            if product in index:
+                table[i, j, index[product]] = 1
+    return table.reshape(400, 20)
+
+
+_MONOMIAL_PRODUCTS = _monomial_product_table()
+
+
+def _poly_mul(a, b):
+    outer = a[..., :, None] * b[..., None, :]
+    return outer.reshape(outer.shape[:-2] + (400,)) @ _MONOMIAL_PRODUCTS
+
+
+def _poly_matmul(A, B):
+    outer = np.einsum('...ikm,...kjn->...ijmn', A, B)
+    return outer.reshape(outer.shape[:-2] + (400,)) @ _MONOMIAL_PRODUCTS
+
+
+def five_point(x1, x2):
+    """
+    Batched 5-point algorithm for the essential matrix (Nister, 2004), solved
+    with the action matrix of Stewenius et al. (2006).
+
+    Args:
+        x1, x2: (B, 5, 3) homogeneous points in normalized camera coordinates
+            (K^-1 x).
+
+    Returns:
+        E: (B, 10, 3, 3) essential matrices with x2^T E x1 = 0.
+        valid: (B, 10) mask of the real solutions; up to ten per sample.
+    """
+    batch = x1.shape[0]
+
+    # E = x*E1 + y*E2 + z*E3 + E4 spans the null space of the epipolar constraints
+    A = (x2[..., :, :, None] * x1[..., :, None, :]).reshape(batch, -1, 9)
+    _, _, Vt = np.linalg.svd(A, full_matrices=True)
+    basis = Vt[:, -4:, :].reshape(batch, 4, 3, 3)
+
+    # entries of E as polynomials in (x, y, z)
+    E_poly = np.zeros((batch, 3, 3, 20))
+    E_poly[..., 16] = basis[:, 0]
+    E_poly[..., 17] = basis[:, 1]
+    E_poly[..., 18] = basis[:, 2]
+    E_poly[..., 19] = basis[:, 3]
+
+    # det(E) = 0 and 2 E E^T E - trace(E E^T) E = 0: ten cubic equations
+    cofactor = (_poly_mul(E_poly[:, 1, 1], E_poly[:, 2, 2]) - _poly_mul(E_poly[:, 1, 2], E_poly[:, 2, 1]),
+                _poly_mul(E_poly[:, 1, 2], E_poly[:, 2, 0]) - _poly_mul(E_poly[:, 1, 0], E_poly[:, 2, 2]),
+                _poly_mul(E_poly[:, 1, 0], E_poly[:, 2, 1]) - _poly_mul(E_poly[:, 1, 1], E_poly[:, 2, 0]))
+    det = sum(_poly_mul(E_poly[:, 0, j], cofactor[j]) for j in range(3))
+
+    EEt = _poly_matmul(E_poly, np.swapaxes(E_poly, 1, 2))
+    trace = EEt[:, 0, 0] + EEt[:, 1, 1] + EEt[:, 2, 2]
+    constraint = 2 * _poly_matmul(EEt, E_poly) - _poly_mul(trace[:, None, None, :], E_poly)
+
+    M = np.concatenate((det[:, None, :], constraint.reshape(batch, 9, 20)), axis=1)
+
+    # Gauss-Jordan on the cubic monomials expresses them in the quotient basis
+    try:
+        B = np.linalg.solve(M[:, :, :10], M[:, :, 10:])
+    except np.linalg.LinAlgError:
+        B = np.linalg.pinv(M[:, :, :10]) @ M[:, :, 10:]
+
+    # action matrix of multiplication by x on [xx, xy, yy, xz, yz, zz, x, y, z, 1]
+    action = np.zeros((batch, 10, 10))
+    action[:, :6] = -B[:, [0, 1, 2, 4, 5, 7]]
+    action[:, 6, 0] = 1
+    action[:, 7, 1] = 1
+    action[:, 8, 3] = 1
+    action[:, 9, 6] = 1
+
+    eigenvalues, eigenvectors = np.linalg.eig(action)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xyz = (eigenvectors[:, 6:9, :] / eigenvectors[:, 9:10, :]).real
+    valid = (np.abs(eigenvalues.imag) < 1e-8) & np.all(np.isfinite(xyz), axis=1)
+    xyz = np.where(valid[:, None, :], xyz, 0)
+
+    E = np.einsum('bks,bkij->bsij', xyz, basis[:, :3]) + basis[:, 3, None]
+    E /= np.linalg.norm(E, axis=(-2, -1), keepdims=True)
+    return E, valid
+
+
+def project_to_essential(E):
+    """
+    Closest essential matrix: equal first two singular values, third one zero.
+    """
+    U, S, Vt = np.linalg.svd(E)
+    s = (S[..., 0] + S[..., 1]) / 2
+    S = np.stack((s, s, np.zeros_like(s)), axis=-1)
+    return (U * S[..., None, :]) @ Vt
+
+
+def essential_to_fundamental(E, K):
+    """
+    Fundamental matrix K^-T E K^-1 of an essential matrix, inverse of
+    `compute_essential_matrix`.
+    """
+    K_inv = np.linalg.inv(K)
+    return K_inv.T @ E @ K_inv
+
+
+@profiling.timed('ransac')
+def ransac_E(matches, key1, key2, K, num_iterations=1e3, threshold=1.0, confidence=0.99, batch_size=64,
+             error='sampson', local_optimization=True, lo_iterations=3, seed=None, return_info=False):
+    """
+    Estimate the essential matrix with LO-RANSAC over 5-point minimal samples.
+
+    Samples are solved in normalized camera coordinates, but models are scored
+    in pixels through their fundamental matrix, so threshold has the same
+    meaning as in `ransac_F`. Local optimization refits E with the normalized
+    8-point algorithm on the inliers, projected onto the essential manifold.
+
+    Args:
+        matches: List of matched keypoint indices.
+        keypoints1, keypoints2: Lists of keypoints from both images.
+        K: Camera intrinsic matrix (3x3), shared by both images.
+        Other arguments: see `ransac_F`.
+
+    Returns:
+        best_E: The best estimated essential matrix.
+        inliers: List of inlier matches.
+        info: Only if return_info is True.
+    """
+    matches_arr = np.asarray(matches, dtype=np.intp).reshape(-1, 2)
+    x1, x2 = homogeneous_matches(matches_arr, key1, key2)
+    K_inv = np.linalg.inv(K)
 
+    def solve(x1_samples, x2_samples):
+        E, valid = five_point(x1_samples @ K_inv.T, x2_samples @ K_inv.T)
+        return K_inv.T @ E @ K_inv, valid
 
-            
+    def refit(x1_inliers, x2_inliers):
+        E = project_to_essential(eight_point(x1_inliers @ K_inv.T, x2_inliers @ K_inv.T))
+        return K_inv.T @ E @ K_inv
 
+    best_F, best_mask, info = lo_ransac(x1, x2, 5, solve, refit, num_iterations, threshold, confidence, batch_size,
+                                        error, local_optimization, lo_iterations, seed)
 
+    best_E = None
+    if best_F is not None:
+        best_E = compute_essential_matrix(best_F, K)
+        best_E /= np.linalg.norm(best_E)
+    best_inliers = [tuple(match) for match in matches_arr[best_mask].tolist()]
 
+    if return_info:
+        return best_E, best_inliers, info
+    return best_E, best_inliers
@@ -6,11 +6,48 @@ def parse_arguments():
     parser.add_argument('--image_dir',type=str,required=True, help='Directory containing images for resconstruction')
     parser.add_argument('--data_name',type=str,required=True, help='Name of the dataset')
     parser.add_argument('--output_dir', type=str, default='../results/pointcloud/', help='Directory to save output results')
+    parser.add_argument('--view', action='store_true', help='Display the point cloud and trajectory in an Open3D window after saving them')
     parser.add_argument('--focal_length', type=float, default=800.0, help='Camera focal length in pixels')
     parser.add_argument('--principal_point', type=float, nargs=2, default=[512.0, 384.0], help='Camera principal point (cx, cy)')   
-    parser.add_argument('--k_harris', type=float, default=0.04, help='Harris detector free parameter')
-    parser.add_argument('--threshold_harris', type=float, default=1e6, help='Threshold for Harris corner detection')
-    parser.add_argument('--ransac_iterations', type=int, default=1000, help='Number of RANSAC iterations')
-    parser.add_argument('--ransac_threshold', type=float, default=0.01, help='RANSAC inlier threshold')
+    parser.add_argument('--k_harris', type=float, default=0.03, help='Harris detector free parameter')
+    parser.add_argument('--threshold_harris', type=float, default=5000, help='Threshold on the Harris corner response')
+    parser.add_argument('--max_keypoints', type=int, default=0, help='Maximum number of Harris keypoints per image (0 keeps all)')
+    parser.add_argument('--anms', action='store_true', help='Select keypoints with adaptive non-maximal suppression instead of the strongest responses')
+    parser.add_argument('--octaves', type=int, nargs='+', default=[0], help='Image pyramid octaves to detect keypoints on (0 is full resolution, 1 half, ...); several octaves give multi-scale Harris')
+    parser.add_argument('--pyramid', type=str, default='gaussian', choices=['gaussian', 'box'], help='Downsampling filter of the image pyramid')
+    parser.add_argument('--prefetch', type=int, default=2, help='Number of images decoded ahead in a background thread (0 decodes in the main thread)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of workers for the feature stage (default: number of CPUs, 1 runs serially)')
+    parser.add_argument('--feature_executor', type=str, default='thread', choices=['thread', 'process'], help='Pool type used by the feature stage (a process pool copies every image to its workers)')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Directory of the on-disk feature and match cache (disabled if not set)')
+    parser.add_argument('--cache_size', type=float, default=1024, help='Maximum cache size in MB, least recently used entries are evicted beyond it')
+    parser.add_argument('--descriptor', type=str, default='patch', choices=['patch', 'brief'], help='Normalized 9x9 intensity patches, or 256-bit BRIEF binary descriptors matched by Hamming distance (10x smaller)')
+    parser.add_argument('--tracker', type=str, default='descriptors', choices=['descriptors', 'klt'], help='Match Harris patch descriptors in every image, or track keypoints with pyramidal Lucas-Kanade flow (video-like sequences)')
+    parser.add_argument('--klt_min_tracks', type=int, default=300, help='Detect new keypoints when fewer tracks than this survive')
+    parser.add_argument('--klt_keypoints', type=int, default=1000, help='Maximum number of Harris keypoints per detection of the KLT tracker (0 keeps all)')
+    parser.add_argument('--klt_window', type=int, default=15, help='Side in pixels of the window tracked around each keypoint')
+    parser.add_argument('--klt_levels', type=int, default=3, help='Number of pyramid levels below full resolution used by the KLT tracker')
+    parser.add_argument('--matcher', type=str, default='brute', choices=['brute', 'lsh'], help='Descriptor matcher: exact brute force or approximate LSH index')
+    parser.add_argument('--lsh_tables', type=int, default=4, help='Number of hash tables of the LSH matcher')
+    parser.add_argument('--lsh_bits', type=int, default=12, help='Hash bits per table of the LSH matcher')
+    parser.add_argument('--lsh_probes', type=int, default=2, help='Extra buckets probed per table by the LSH matcher (higher recall, slower)')
+    parser.add_argument('--guided_matching', action='store_true', help='After RANSAC, match again along the epipolar lines of each pair to recover more inliers')
+    parser.add_argument('--guided_threshold', type=float, default=2.0, help='Maximum distance in pixels of a guided match to its epipolar line')
+    parser.add_argument('--mode', type=str, default='incremental', choices=['incremental', 'pairs'], help='Incremental reconstruction in one global frame, or independent clouds per consecutive pair')
+    parser.add_argument('--pairs', type=str, default='sequential', choices=['sequential', 'retrieval'], help='Match consecutive images, or the pairs proposed by a vocabulary tree retrieval index (unordered collections, incremental mode only)')
+    parser.add_argument('--retrieval_k', type=int, default=5, help='Number of most similar images retrieved per image with --pairs retrieval')
+    parser.add_argument('--vocabulary_branching', type=int, default=8, help='Branching factor of the retrieval vocabulary tree')
+    parser.add_argument('--vocabulary_depth', type=int, default=3, help='Depth of the retrieval vocabulary tree (branching^depth visual words)')
+    parser.add_argument('--sequential_references', type=int, default=5, help='Number of recent registered images a frame is matched against when it cannot be registered against the previous frame (sequential pairs, descriptors only)')
+    parser.add_argument('--ba_window', type=int, default=5, help='Run local bundle adjustment on the last N cameras after each new image (0 disables it)')
+    parser.add_argument('--ba_iterations', type=int, default=10, help='Maximum number of Levenberg-Marquardt iterations per bundle adjustment')
+    parser.add_argument('--global_ba', action='store_true', help='Run a final bundle adjustment over all cameras and points')
+    parser.add_argument('--voxel_size', type=float, default=0.0, help='Merge output points closer than this voxel size, in reconstruction units (0 keeps all points)')
+    parser.add_argument('--estimator', type=str, default='8point', choices=['8point', '5point'], help='Relative pose estimator: 8-point fundamental matrix or calibrated 5-point essential matrix')
+    parser.add_argument('--triangulation', type=str, default='dlt', choices=['dlt', 'midpoint'], help='Triangulation method')
+    parser.add_argument('--ransac_iterations', type=int, default=1000, help='Maximum number of RANSAC iterations')
+    parser.add_argument('--ransac_threshold', type=float, default=1.0, help='RANSAC inlier threshold on the Sampson distance in pixels')
+    parser.add_argument('--ransac_confidence', type=float, default=0.99, help='Stop RANSAC once an outlier-free sample was drawn with this probability')
+    parser.add_argument('--profile', action='store_true', help='Write per-stage timings, per-pair counters and peak memory to profile.json and profile.csv in the output directory')
+    parser.add_argument('--cprofile', action='store_true', help='Also dump cProfile statistics to profile.prof in the output directory (implies --profile)')
 
     return parser.parse_args() 
\ No newline at end of file
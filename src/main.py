@@ -1,25 +1,39 @@
 #!/usr/bin/env python3
+import cache as ch
+import camera_motion as cm
 import data_loader
-import feature_detection as fd
-import feature_description as fp
+import features as fs
 import feature_matching as fm
 import fundamental_matrix as fdm
+import reconstruction as rc
+import retrieval
+import tracking as tk
 import triangulation as tg
 import visualization as vs
 import helper as hp
+import point_cloud as pc
+import profiling
 
-import matplotlib.pyplot as plt
 import numpy as np
 import os
+from collections import deque
+from itertools import pairwise
 
 
 def main():
     # Parse arguments
     args = hp.parse_arguments()
 
+    if args.pairs == 'retrieval' and args.mode != 'incremental':
+        raise ValueError("Retrieval pair selection requires the incremental mode")
+    if args.matcher == 'lsh' and args.descriptor == 'brief':
+        raise ValueError("The LSH matcher needs float descriptors, use the brute force matcher with BRIEF")
+    if args.pairs == 'retrieval' and args.tracker == 'klt':
+        raise ValueError("Retrieval pair selection requires descriptors, it cannot be used with the KLT tracker")
+
     os.makedirs(args.output_dir, exist_ok=True)
+    profiler = profiling.enable(cprofile=args.cprofile) if args.profile or args.cprofile else None
 
-    gray, images = data_loader.load_images(args.image_dir,args.data_name)
 
     f = args.focal_length
     cx,cy = args.principal_point
@@ -30,84 +44,389 @@ def main():
     ])
 
 
-    points_3d_list = []
-    colors_list = []
-    camera_positions = []  
+    detector_kwargs = dict(window_size=5, k=args.k_harris, threshold=args.threshold_harris, max_keypoints=args.max_keypoints or None, anms=args.anms)
+
+    cloud = pc.PointCloud(voxel_size=args.voxel_size or None)
+
+    # Decode frames on demand; the color frames wait here until their pair is processed
+    frames = data_loader.iter_images(args.image_dir, args.data_name, prefetch=args.prefetch)
+    color_images = deque()
+
+    def gray_images():
+        for gray_image, color_image in frames:
+            color_images.append(color_image)
+            yield gray_image
+
+    # Detect keypoints and extract descriptors once per image (grayscale), in parallel
+    cache = ch.ArrayCache(args.cache_dir, max_bytes=int(args.cache_size * 2**20)) if args.cache_dir else None
+    if args.tracker == 'klt':
+        # Track keypoints from frame to frame, detecting again only when too few tracks are left
+        tracker_kwargs = dict(detector_kwargs, max_keypoints=args.klt_keypoints or None)
+        features = tk.iter_tracks(gray_images(), detector_kwargs=tracker_kwargs, min_tracks=args.klt_min_tracks,
+                                  levels=args.klt_levels, window_size=args.klt_window)
+    else:
+        patch_size = 9 if args.descriptor == 'patch' else 31
+        features = fs.iter_features(gray_images(), detector_kwargs, patch_size=patch_size, workers=args.workers, executor=args.feature_executor, cache=cache,
+                                     octaves=args.octaves, pyramid_method=args.pyramid, descriptor=args.descriptor)
+
+    reconstruction = rc.Reconstruction(K)
+    trajectory = cm.PoseGraph()
+    if args.pairs == 'retrieval':
+        # Unordered collection: match only the pairs proposed by image retrieval
+        features = list(features)
+        reconstruct_unordered(args, K, cache, features, list(color_images), reconstruction)
+        features = ()  # no consecutive pairs left to process
 
     # Iterate over pairs of consecutive images
-    for i in range(len(gray)-1):
-        
-        image1 = gray[i]
-        image2 = gray[i+1]
-        color_image1 = images[i]
-        
-        # Detect keypoints and extract descriptors for both images(grayscale)
-        keypoints1 = fd.harris_corner_detector(image1,window_size=5,k=0.03,threshold=5000)
-        keypoints2 = fd.harris_corner_detector(image2,window_size=5,k=0.03,threshold=5000)
-
-        descr1 = fp.extract_descriptors(image1,keypoints1,patch_size=9)
-        descr2 = fp.extract_descriptors(image2,keypoints2,patch_size=9)
-
-        # Match feature on two images
-        matches = fm.match_features(descr1,descr2)
+    previous_keypoints, previous_points, previous_scale = np.empty(0, dtype=np.int64), np.empty((0, 3)), 1.0
+    references = {}  # descriptors of the last registered images, for images that fail against the previous one
+    for i, ((keypoints1, descr1), (keypoints2, descr2)) in enumerate(pairwise(features)):
+        color_image1 = color_images.popleft()
+        profiling.new_pair(image1=i, image2=i + 1)
+        profiling.count('keypoints1', len(keypoints1))
+        profiling.count('keypoints2', len(keypoints2))
+        if args.mode == 'incremental':
+            # the next color frame was decoded together with its features
+            if i == 0:
+                reconstruction.add_image(keypoints1, color_image1)
+            reconstruction.add_image(keypoints2, color_images[0])
 
-        #Estimate the fundamental matrix using RANSAC
-        if len(matches) >= 8:
-            F, inliers = fdm.ransac_F(matches, keypoints1, keypoints2)
+        if args.tracker == 'klt':
+            # the tracker yields the matches with the previous frame in place of descriptors
+            matches, descr1, descr2 = descr2, None, None
         else:
-            print(f"Not enough matches to compute the Fundamental Matrix between images {i} and {i+1}. Skipping...")
-            continue
+            matches = match_pair(args, cache, descr1, descr2)
+        profiling.count('matches', len(matches))
 
-        # Essential matrix
-        E = fdm.compute_essential_matrix(F, K)
-        # print(f"Essential matrix: \n", E)
-
-        # Decompose essential matrix into R,t
-        R1, R2, t = fdm.decompose_essential_matrix(E)
-
-        #Setup the projection matrices for the two camera views
-        P1 = np.hstack((np.eye(3), np.zeros((3,1)))) # proj matrix for cam1 [I 0]
-        
-        P2_1 = np.hstack((R1, t.reshape(3,1))) #Proj matrix for cam2  using R1,t 
-        P2_2 = np.hstack((R1, -t.reshape(3,1)))#Proj matrix for cam2  using R1,-t 
-        P2_3 = np.hstack((R2, t.reshape(3,1))) #Proj matrix for cam2  using R2,t 
-        P2_4 = np.hstack((R2, -t.reshape(3,1)))#Proj matrix for cam2  using R2,-t 
-        
-
-        # TRiangulate the 3D points using the four combos
-        points_3d_1 = tg.triangulate_points(P1, P2_1, keypoints1, keypoints2, inliers)
-        points_3d_2 = tg.triangulate_points(P1, P2_2, keypoints1, keypoints2, inliers)
-        points_3d_3 = tg.triangulate_points(P1, P2_3, keypoints1, keypoints2, inliers)
-        points_3d_4 = tg.triangulate_points(P1, P2_4, keypoints1, keypoints2, inliers)
-
-        #check cheirality 
-        if tg.check_cheirality(P1, P2_1, points_3d_1):
-            correct_P2 = P2_1
-            correct_points_3d = points_3d_1
-            print("Using R1 and t for the correct camera pose")
-        elif tg.check_cheirality(P1, P2_2, points_3d_2):
-            correct_P2 = P2_2
-            correct_points_3d = points_3d_2
-            print("Using R1 and -t for the correct camera pose")
-        elif tg.check_cheirality(P1, P2_3, points_3d_3):
-            correct_P2 = P2_3
-            correct_points_3d = points_3d_3
-            print("Using R2 and t for the correct camera pose")
-        elif tg.check_cheirality(P1, P2_4, points_3d_4):
-            correct_P2 = P2_4
-            correct_points_3d = points_3d_4
-            print("Using R2 and -t for the correct camera pose")
-        
+        # Estimate the essential matrix, directly with the calibrated 5-point solver
+        # or through the fundamental matrix
+        min_matches = 5 if args.estimator == '5point' else 8
+        E, inliers = None, []
+        if len(matches) < min_matches:
+            print(f"Not enough matches to compute the Fundamental Matrix between images {i} and {i+1}")
         else:
-            print("No valid solution found based on chierality")
+            E, inliers = estimate_essential(args, K, keypoints1, keypoints2, matches)
+            if E is None:
+                print(f"No model with inliers between images {i} and {i+1}")
+        if E is not None and args.guided_matching and descr1 is not None:
+            inliers = guided_inliers(args, K, E, keypoints1, keypoints2, descr1, descr2, inliers)
+
+        if args.mode == 'incremental':
+            # a failed pair does not stop the sequence, the next image is tried against the other registered ones
+            register_sequential(args, K, cache, reconstruction, i + 1, i, keypoints2, descr2, E, inliers, references)
+            for image, descriptors in ((i, descr1), (i + 1, descr2)):
+                if descriptors is not None and reconstruction.is_registered(image):
+                    references[image] = descriptors
+            while len(references) > args.sequential_references:
+                del references[min(references)]
+            continue
+
+        if E is None:
+            continue
+        pose = two_view_pose(args, K, keypoints1, keypoints2, E, inliers)
+        if pose is None:
+            continue
+        R, t, points_3d, in_front = pose
+
+        # Chain the pose onto the trajectory, scaled to the points shared with the previous pair
+        if not trajectory.is_registered(i):
+            if len(trajectory):
+                print(f"Image {i} has no pose, placing it at the last known pose")
+                trajectory.set_pose(i, *trajectory.pose(trajectory.frames()[-1]))
+            else:
+                trajectory.set_pose(i, np.eye(3), np.zeros(3))
+        inliers_array = np.asarray(inliers, dtype=np.int64).reshape(-1, 2)
+        _, shared, previous_shared = np.intersect1d(inliers_array[:, 0][in_front], previous_keypoints, return_indices=True)
+        R_i, t_i = trajectory.pose(i)
+        scale = cm.relative_scale(previous_points[previous_shared] @ R_i.T + t_i, points_3d[in_front][shared])
+        if scale is None:
+            if len(previous_keypoints):
+                print("No points shared with the previous pair, keeping the previous scale")
+            scale = previous_scale
+        trajectory.chain(i + 1, i, R, t, scale)
+
+        # Keep the points in front of the camera, colored from the first image, in world coordinates
+        colors = tg.point_colors(keypoints1, inliers, color_image1)
+        world_points = trajectory.to_world(i, points_3d[in_front], scale)
+        cloud.add(world_points, colors[in_front])
+        previous_keypoints, previous_points, previous_scale = inliers_array[:, 1][in_front], world_points, scale
+
+    if args.mode == 'incremental':
+        if args.global_ba:
+            info = reconstruction.bundle_adjust(iterations=args.ba_iterations)
+            if info is not None:
+                print(f"Global bundle adjustment: cost {info['initial_cost']:.1f} -> {info['final_cost']:.1f}")
+        cloud.add(*reconstruction.point_cloud())
+        camera_positions = list(reconstruction.camera_centers())
+    else:
+        camera_positions = list(trajectory.centers())
+
+    vs.save_point_cloud_with_trajectory(cloud.points, cloud.colors, camera_positions,out_dir=args.output_dir, filename="colored_point_cloud_with_trajectory.ply", show=args.view)
+
+    if profiler is not None:
+        profiling.disable()
+        print("Profile written to", ", ".join(profiler.write(args.output_dir)))
+
+
+def match_pair(args, cache, descr1, descr2, indexes=None, image2=None):
+    """
+    Match the descriptors of two images, unless this pair was matched with the same settings before.
+
+    With the LSH matcher and an indexes dict, the index of descr2 is built
+    once per image and kept in indexes under image2 for its other pairs.
+    """
+    matcher_params = (args.matcher, args.lsh_tables, args.lsh_bits, args.lsh_probes) if args.matcher == 'lsh' else args.matcher
+    matches_key = cache.key(descr1, descr2, matcher_params) if cache is not None else None
+    cached = cache.load('matches', matches_key) if cache is not None else None
+    if cached is not None:
+        return [tuple(match) for match in cached['matches'].tolist()]
+
+    if args.matcher == 'lsh':
+        index2 = indexes.get(image2) if indexes is not None else None
+        if index2 is None:
+            index2 = fm.LSHIndex(descr2, n_tables=args.lsh_tables, n_bits=args.lsh_bits, n_probes=args.lsh_probes)
+            if indexes is not None:
+                indexes[image2] = index2
+        matches = fm.match_features(descr1,descr2,index=index2)
+    else:
+        matches = fm.match_features(descr1,descr2)
+    if cache is not None:
+        cache.store('matches', matches_key, matches=np.array(matches, dtype=np.int64).reshape(-1, 2))
+    return matches
+
+
+def two_view_pose(args, K, keypoints1, keypoints2, E, inliers):
+    """
+    Relative pose of the second camera from the essential matrix, the one of
+    the four decompositions with the inliers in front of both cameras.
+
+    Returns:
+        R, t, points_3d, in_front: Pose, inliers triangulated in the first
+            camera frame and their cheirality mask, or None if no pose is valid.
+    """
+    if E is None:
+        return None
+
+    # Decompose essential matrix into R,t
+    R1, R2, t = fdm.decompose_essential_matrix(E)
+
+    #Setup the projection matrices for the two camera views
+    P1 = K @ np.hstack((np.eye(3), np.zeros((3,1)))) # proj matrix for cam1 K[I 0]
+
+    # Proj matrices for cam2 using (R1,t), (R1,-t), (R2,t), (R2,-t)
+    Rs, ts = tg.pose_candidates(R1, R2, t)
+    P2_candidates = K @ np.concatenate((Rs, ts[:, :, None]), axis=2)
+
+    # Triangulate the 3D points for all four combos at once and check cheirality
+    with profiling.stage('pose_selection'):
+        pose_index, points_3d, in_front = tg.select_pose(P1, P2_candidates, keypoints1, keypoints2, inliers, method=args.triangulation)
+    if pose_index is None:
+        print("No valid solution found based on chierality")
+        return None
+    print(f"Using {['R1 and t', 'R1 and -t', 'R2 and t', 'R2 and -t'][pose_index]} for the correct camera pose")
+    return Rs[pose_index], ts[pose_index], points_3d, in_front
+
+
+def register_sequential(args, K, cache, reconstruction, image, previous, keypoints, descriptors, E, inliers, references):
+    """
+    Add the next image of a sequence to an incremental reconstruction.
+
+    The image is registered by PnP against the previous image, then against
+    the registered images in references that observe points, most recent
+    first. If none of them shares enough tracks, its relative pose is
+    chained to the first of those images it has a valid pose with; if the
+    previous image is not registered and no registered image matches, the
+    previous image is placed at the pose of the last registered one and the
+    pair is chained from there, so the sequence goes on. A reconstruction
+    that has not started yet is initialized from the pair.
+
+    Args:
+        image: Id of the new image, added to the reconstruction.
+        previous: Id of the image before it.
+        keypoints, descriptors: Features of the new image; descriptors are
+            None with the KLT tracker, then only the previous image is used.
+        E, inliers: Essential matrix and inlier matches of (previous, image),
+            E None if the pair failed.
+        references: dict of the descriptors of recent registered images.
+
+    Returns:
+        True if the image was added.
+    """
+    if not reconstruction.initialized:
+        pose = two_view_pose(args, K, reconstruction.keypoints[previous], keypoints, E, inliers)
+        if pose is None:
+            return False
+        R, t, points_3d, in_front = pose
+        reconstruction.initialize(previous, image, R, t, inliers, points_3d, in_front)
+        return True
+
+    def verified_references():
+        # (reference, E, inliers) of the registered images the image matches, most recent first
+        if E is not None and reconstruction.is_registered(previous):
+            yield previous, E, inliers
+        if descriptors is None:
+            return
+        min_matches = 5 if args.estimator == '5point' else 8
+        for reference in sorted(references, reverse=True):
+            if reference == previous or not np.any(reconstruction.point_of[reference] >= 0):
+                continue
+            matches = match_pair(args, cache, references[reference], descriptors)
+            if len(matches) < min_matches:
+                continue
+            E_reference, inliers_reference = estimate_essential(args, K, reconstruction.keypoints[reference], keypoints, matches)
+            if E_reference is not None:
+                yield reference, E_reference, inliers_reference
+
+    verified = []
+    for reference, E_reference, inliers_reference in verified_references():
+        with profiling.stage('registration'):
+            registered = reconstruction.register(image, reference, inliers_reference, method=args.triangulation)
+        if registered:
+            print(f"Registered image {image} by PnP against image {reference}, {reconstruction.n_points} points")
+            if args.ba_window:
+                reconstruction.bundle_adjust(window=args.ba_window, iterations=args.ba_iterations)
+            return True
+        verified.append((reference, E_reference, inliers_reference))
+
+    for reference, E_reference, inliers_reference in verified:
+        pose = two_view_pose(args, K, reconstruction.keypoints[reference], keypoints, E_reference, inliers_reference)
+        if pose is not None:
+            print(f"Could not register image {image} by PnP, chaining the relative pose to image {reference}")
+            R, t, points_3d, in_front = pose
+            reconstruction.register_relative(image, reference, R, t, inliers_reference, points_3d, in_front, method=args.triangulation)
+            return True
+
+    if not reconstruction.is_registered(previous):
+        pose = two_view_pose(args, K, reconstruction.keypoints[previous], keypoints, E, inliers)
+        if pose is not None:
+            last = reconstruction.registered_images()[-1]
+            print(f"Image {previous} is not registered, placing it at the pose of image {last}")
+            reconstruction.set_pose(previous, *reconstruction.poses.pose(last))
+            R, t, points_3d, in_front = pose
+            reconstruction.register_relative(image, previous, R, t, inliers, points_3d, in_front, method=args.triangulation)
+            return True
+
+    print(f"Could not register image {image}")
+    return False
+
+
+def reconstruct_unordered(args, K, cache, features, color_images, reconstruction):
+    """
+    Incremental reconstruction of an unordered collection. Every image is
+    paired with its most similar images in a vocabulary tree index, and only
+    those pairs are matched and verified with RANSAC, so the matching cost
+    grows with N*k instead of N^2. The reconstruction starts from the pair
+    with the most inliers and then repeatedly registers the image with the
+    most inliers to the registered ones.
+    """
+    keypoints = [keypoints for keypoints, _ in features]
+    descriptors = [descriptors for _, descriptors in features]
+    for image_keypoints, color_image in zip(keypoints, color_images):
+        reconstruction.add_image(image_keypoints, color_image)
+
+    pairs, _ = retrieval.candidate_pairs(descriptors, k=args.retrieval_k, branching=args.vocabulary_branching,
+                                         depth=args.vocabulary_depth)
+    print(f"Retrieval proposed {len(pairs)} of {len(features) * (len(features) - 1) // 2} image pairs")
+
+    # Verified pairs (i, j), i < j, with their essential matrix and inlier matches
+    edges = {}
+    indexes = {}  # LSH index of every image, built on its first pair
+    min_matches = 5 if args.estimator == '5point' else 8
+    for i, j in pairs:
+        profiling.new_pair(image1=i, image2=j)
+        matches = match_pair(args, cache, descriptors[i], descriptors[j], indexes, j)
+        profiling.count('matches', len(matches))
+        if len(matches) < min_matches:
+            continue
+        E, inliers = estimate_essential(args, K, keypoints[i], keypoints[j], matches)
+        if E is None:
             continue
-        
-        # Triangulate 3D points and assign color based on the correct projection matrix
-        points_3d_list, colors_list = tg.triangulate_and_color(P1, correct_P2, keypoints1, keypoints2, inliers, color_image1, points_3d_list, colors_list)
+        if args.guided_matching:
+            inliers = guided_inliers(args, K, E, keypoints[i], keypoints[j], descriptors[i], descriptors[j], inliers)
+        edges[i, j] = E, inliers
+
+    # Start from the pair with the most inliers that gives a valid pose
+    for i, j in sorted(edges, key=lambda pair: -len(edges[pair][1])):
+        E, inliers = edges[i, j]
+        pose = two_view_pose(args, K, keypoints[i], keypoints[j], E, inliers)
+        if pose is not None:
+            R, t, points_3d, in_front = pose
+            reconstruction.initialize(i, j, R, t, inliers, points_3d, in_front)
+            print(f"Initialized from images {i} and {j}, {reconstruction.n_points} points")
+            break
+    else:
+        print("No image pair to initialize the reconstruction from")
+        return
+
+    failed = set()
+    while True:
+        # (reference keypoint, image keypoint) inliers of every unregistered image with the registered ones
+        links = {}
+        for (i, j), (E, inliers) in edges.items():
+            if reconstruction.is_registered(i) and not reconstruction.is_registered(j) and j not in failed:
+                links.setdefault(j, []).append((i, np.asarray(inliers).reshape(-1, 2), E))
+            elif reconstruction.is_registered(j) and not reconstruction.is_registered(i) and i not in failed:
+                links.setdefault(i, []).append((j, np.asarray(inliers).reshape(-1, 2)[:, ::-1], E.T))
+        if not links:
+            break
+
+        image = max(links, key=lambda image: sum(len(matches) for _, matches, _ in links[image]))
+        neighbours = sorted(links[image], key=lambda link: -len(link[1]))
+        reference, matches, E = neighbours[0]
+
+        with profiling.stage('registration'):
+            registered = reconstruction.register(image, reference, matches, method=args.triangulation)
+        if registered:
+            print(f"Registered image {image} by PnP against image {reference}, {reconstruction.n_points} points")
+        else:
+            pose = two_view_pose(args, K, keypoints[reference], keypoints[image], E, matches)
+            if pose is None:
+                print(f"Could not register image {image}")
+                failed.add(image)
+                continue
+            print(f"Could not register image {image} by PnP, chaining the relative pose to image {reference}")
+            R, t, points_3d, in_front = pose
+            reconstruction.register_relative(image, reference, R, t, matches, points_3d, in_front, method=args.triangulation)
+
+        # Points seen by the other registered neighbours
+        for other, other_matches, _ in neighbours[1:]:
+            reconstruction.triangulate_new(other, image, other_matches, method=args.triangulation)
+        if args.ba_window:
+            reconstruction.bundle_adjust(iterations=args.ba_iterations,
+                                         images=[image] + [other for other, _, _ in neighbours[:args.ba_window - 1]])
+
+
+def estimate_essential(args, K, keypoints1, keypoints2, matches):
+    """
+    Essential matrix and RANSAC inlier matches of an image pair, or
+    (None, []) if no hypothesis had any inlier.
+    """
+    ransac_args = dict(num_iterations=args.ransac_iterations, threshold=args.ransac_threshold, confidence=args.ransac_confidence, return_info=True)
+    if args.estimator == '5point':
+        E, inliers, info = fdm.ransac_E(matches, keypoints1, keypoints2, K, **ransac_args)
+    else:
+        F, inliers, info = fdm.ransac_F(matches, keypoints1, keypoints2, **ransac_args)
+        E = fdm.compute_essential_matrix(F, K) if F is not None else None
+    # print(f"Essential matrix: \n", E)
+    profiling.count('inliers', len(inliers))
+    profiling.count('ransac_iterations', info['iterations'])
+    if E is None:
+        return None, []
+    return E, inliers
+
 
-        camera_positions.append(t)
 
-    vs.save_point_cloud_with_trajectory(points_3d_list, colors_list, camera_positions,out_dir=args.output_dir, filename="colored_point_cloud_with_trajectory.ply")
+def guided_inliers(args, K, E, keypoints1, keypoints2, descr1, descr2, inliers):
+    """
+    Densify the inliers of a pair by matching again along the epipolar lines
+    of its essential matrix; the RANSAC inliers are kept if that finds fewer.
+    """
+    F = fdm.essential_to_fundamental(E, K)
+    matches = fm.match_features_guided(descr1, descr2, keypoints1, keypoints2, F, threshold=args.guided_threshold)
+    errors = fdm.epipolar_error(F, *fdm.homogeneous_matches(matches, keypoints1, keypoints2))
+    guided = [match for match, error in zip(matches, errors) if error < args.ransac_threshold]
+    profiling.count('guided_inliers', len(guided))
+    return guided if len(guided) > len(inliers) else inliers
 
 
 if __name__ == '__main__':
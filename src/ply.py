@@ -0,0 +1,141 @@
+import os
+
+import numpy as np
+
+import profiling
+
+
+VERTEX_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                         ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+EDGE_DTYPE = np.dtype([('vertex1', '<i4'), ('vertex2', '<i4'),
+                       ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+
+# element counts are written zero-padded to this width and patched on close
+_COUNT_WIDTH = 10
+
+
+def _as_uint8(colors, n):
+    colors = np.asarray(colors)
+    if colors.dtype != np.uint8:
+        colors = np.clip(np.rint(colors * 255), 0, 255).astype(np.uint8)
+    return np.broadcast_to(colors, (n, 3))
+
+
+class PlyWriter:
+    """
+    Binary little-endian PLY writer with colored vertices and edges.
+
+    Vertices and then edges are written chunk by chunk as they are given, so
+    the whole cloud never has to be held or converted in memory at once;
+    the element counts in the header are filled in when the file is closed.
+    Use as a context manager.
+    """
+
+    def __init__(self, path, chunk_size=1 << 16):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.n_vertices = 0
+        self.n_edges = 0
+        self._file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'wb')
+        self._file.write(self._header())
+
+    def _header(self):
+        lines = ['ply', 'format binary_little_endian 1.0',
+                 f"element vertex {self.n_vertices:0{_COUNT_WIDTH}d}",
+                 'property float x', 'property float y', 'property float z',
+                 'property uchar red', 'property uchar green', 'property uchar blue',
+                 f"element edge {self.n_edges:0{_COUNT_WIDTH}d}",
+                 'property int vertex1', 'property int vertex2',
+                 'property uchar red', 'property uchar green', 'property uchar blue',
+                 'end_header']
+        return ('\n'.join(lines) + '\n').encode('ascii')
+
+    def _write(self, records, dtype, columns):
+        for start in range(0, len(records[0]), self.chunk_size):
+            chunk = np.empty(min(self.chunk_size, len(records[0]) - start), dtype=dtype)
+            for names, values in zip(columns, records):
+                values = values[start:start + len(chunk)]
+                for k, name in enumerate(names):
+                    chunk[name] = values[:, k]
+            self._file.write(chunk.tobytes())
+
+    def write_vertices(self, points, colors):
+        """
+        Append (N, 3) points with uint8 colors, or float colors in [0, 1].
+
+        Returns:
+            indices: Vertex indices of the points, for `write_edges`.
+        """
+        if self.n_edges:
+            raise ValueError("vertices must be written before edges")
+        points = np.asarray(points).reshape(-1, 3)
+        colors = _as_uint8(colors, len(points))
+        self._write((points, colors), VERTEX_DTYPE, (('x', 'y', 'z'), ('red', 'green', 'blue')))
+        start = self.n_vertices
+        self.n_vertices += len(points)
+        return np.arange(start, self.n_vertices)
+
+    def write_edges(self, edges, colors):
+        """
+        Append (M, 2) edges between vertex indices with their colors.
+        """
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if np.any((edges < 0) | (edges >= self.n_vertices)):
+            raise ValueError("edges must refer to written vertices")
+        colors = _as_uint8(colors, len(edges))
+        self._write((edges, colors), EDGE_DTYPE, (('vertex1', 'vertex2'), ('red', 'green', 'blue')))
+        self.n_edges += len(edges)
+
+    def close(self):
+        if self._file is None:
+            return
+        # the header has a fixed length, rewrite it with the final counts
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.close()
+        self._file = None
+
+
+@profiling.timed('write')
+def write_point_cloud(path, points, colors, camera_positions=None, trajectory_color=(255, 0, 0), chunk_size=1 << 16):
+    """
+    Write a colored point cloud and optionally a camera trajectory, as
+    vertices joined by edges between consecutive cameras, to a binary PLY file.
+    """
+    with PlyWriter(path, chunk_size=chunk_size) as writer:
+        writer.write_vertices(points, colors)
+        if camera_positions is not None and len(camera_positions):
+            cameras = writer.write_vertices(camera_positions, np.array(trajectory_color, dtype=np.uint8))
+            writer.write_edges(np.column_stack((cameras[:-1], cameras[1:])), np.array(trajectory_color, dtype=np.uint8))
+
+
+def read_ply(path):
+    """
+    Read vertices and edges of a PLY file written by `PlyWriter`.
+
+    Returns:
+        vertices, edges: Structured arrays with VERTEX_DTYPE and EDGE_DTYPE.
+    """
+    with open(path, 'rb') as file:
+        counts = {}
+        while True:
+            line = file.readline().decode('ascii').strip()
+            if line.startswith('element'):
+                _, name, count = line.split()
+                counts[name] = int(count)
+            elif line == 'end_header':
+                break
+        vertices = np.fromfile(file, dtype=VERTEX_DTYPE, count=counts.get('vertex', 0))
+        edges = np.fromfile(file, dtype=EDGE_DTYPE, count=counts.get('edge', 0))
+    return vertices, edges
@@ -0,0 +1,196 @@
+import numpy as np
+
+import camera_motion as cm
+import fundamental_matrix as fdm
+import profiling
+
+
+def p3p(points_3d, bearings):
+    """
+    Batched calibrated camera resection from three 2D-3D correspondences
+    (Grunert's solution, as given by Haralick et al., 1994).
+
+    The distances of the three points along their bearing vectors are the
+    roots of a quartic; for each root the camera-frame points are aligned to
+    the world points. Unlike the DLT, this also works for coplanar points.
+
+    Args:
+        points_3d: (..., 3, 3) world points.
+        bearings: (..., 3, 3) unit bearing vectors (normalized K^-1 x).
+
+    Returns:
+        R: (..., 4, 3, 3) rotations, NaN where there is no real solution.
+        t: (..., 4, 3) translations, with x ~ R X + t.
+    """
+    P1, P2, P3 = points_3d[..., 0, :], points_3d[..., 1, :], points_3d[..., 2, :]
+    f1, f2, f3 = bearings[..., 0, :], bearings[..., 1, :], bearings[..., 2, :]
+    a2 = np.sum((P2 - P3)**2, axis=-1)
+    b2 = np.sum((P1 - P3)**2, axis=-1)
+    c2 = np.sum((P1 - P2)**2, axis=-1)
+    cos_a = np.sum(f2 * f3, axis=-1)
+    cos_b = np.sum(f1 * f3, axis=-1)
+    cos_g = np.sum(f1 * f2, axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amc, apc, bmc, bma = (a2 - c2) / b2, (a2 + c2) / b2, (b2 - c2) / b2, (b2 - a2) / b2
+        A4 = (amc - 1)**2 - 4 * c2 / b2 * cos_a**2
+        A3 = 4 * (amc * (1 - amc) * cos_b - (1 - apc) * cos_a * cos_g + 2 * c2 / b2 * cos_a**2 * cos_b)
+        A2 = 2 * (amc**2 - 1 + 2 * amc**2 * cos_b**2 + 2 * bmc * cos_a**2
+                  - 4 * apc * cos_a * cos_b * cos_g + 2 * bma * cos_g**2)
+        A1 = 4 * (-amc * (1 + amc) * cos_b + 2 * a2 / b2 * cos_g**2 * cos_b - (1 - apc) * cos_a * cos_g)
+        A0 = (1 + amc)**2 - 4 * a2 / b2 * cos_g**2
+
+        # v = s3 / s1 are the real eigenvalues of the companion matrix
+        companion = np.zeros(A4.shape + (4, 4))
+        companion[..., 1:, :3] = np.eye(3)
+        companion[..., :, 3] = -np.stack((A0, A1, A2, A3), axis=-1) / A4[..., None]
+        roots = np.linalg.eigvals(np.nan_to_num(companion))
+        v = np.where(np.abs(roots.imag) < 1e-6 * (1 + np.abs(roots.real)), roots.real, np.nan)
+
+        amc, cos_a, cos_b, cos_g, c2 = (x[..., None] for x in (amc, cos_a, cos_b, cos_g, c2))
+        u = ((amc - 1) * v**2 - 2 * amc * cos_b * v + 1 + amc) / (2 * (cos_g - v * cos_a))
+        s1 = np.sqrt(c2 / (1 + u**2 - 2 * u * cos_g))
+    depths = np.stack((s1, u * s1, v * s1), axis=-1)
+
+    # align the camera-frame points to the world points (Kabsch)
+    Q = depths[..., None] * bearings[..., None, :, :]
+    P = np.broadcast_to(points_3d[..., None, :, :], Q.shape)
+    P_mean, Q_mean = P.mean(axis=-2), Q.mean(axis=-2)
+    H = np.swapaxes(P - P_mean[..., None, :], -1, -2) @ (Q - Q_mean[..., None, :])
+    U, _, Vt = np.linalg.svd(np.nan_to_num(H))
+    V, Ut = np.swapaxes(Vt, -1, -2), np.swapaxes(U, -1, -2)
+    V[..., :, 2] *= np.linalg.det(V @ Ut)[..., None]
+    R = V @ Ut
+    t = Q_mean - np.einsum('...ij,...j->...i', R, P_mean)
+
+    valid = np.all(np.isfinite(depths) & (depths > 0), axis=-1)
+    R[~valid] = np.nan
+    t[~valid] = np.nan
+    return R, t
+
+
+def reprojection_errors(K, R, t, points_3d, keypoints):
+    """
+    Pixel reprojection error of every correspondence under every pose;
+    points behind the camera get an infinite error.
+
+    Args:
+        K: Camera intrinsic matrix (3x3).
+        R, t: (..., 3, 3) rotations and (..., 3) translations.
+        points_3d: (n, 3) world points.
+        keypoints: (n, 2) observed pixels.
+
+    Returns:
+        errors: (..., n) errors.
+    """
+    cam = np.einsum('...ij,nj->...ni', R, points_3d) + t[..., None, :]
+    pixels = cam @ K.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        errors = np.linalg.norm(pixels[..., :2] / pixels[..., 2:] - keypoints, axis=-1)
+    return np.where(cam[..., 2] > 0, errors, np.inf)
+
+
+def refine_pose(K, R, t, points_3d, keypoints, iterations=10):
+    """
+    Gauss-Newton refinement of a camera pose on the reprojection error.
+
+    Rotation updates are applied as R <- exp([dw]x) R.
+
+    Returns:
+        R, t: Refined pose.
+    """
+    fx, fy = K[0, 0], K[1, 1]
+    for _ in range(iterations):
+        RX = points_3d @ R.T
+        cam = RX + t
+        z = cam[:, 2]
+        pixels = cam @ K.T
+        residuals = (pixels[:, :2] / pixels[:, 2:] - keypoints).ravel()
+
+        # d pixel / d cam
+        J_proj = np.zeros((len(cam), 2, 3))
+        J_proj[:, 0, 0] = fx / z
+        J_proj[:, 0, 2] = -fx * cam[:, 0] / z**2
+        J_proj[:, 1, 1] = fy / z
+        J_proj[:, 1, 2] = -fy * cam[:, 1] / z**2
+
+        # d cam / d (dw, dt) = [-[RX]x | I]
+        J_pose = np.concatenate((-cm.skew(RX), np.broadcast_to(np.eye(3), (len(cam), 3, 3))), axis=2)
+        J = (J_proj @ J_pose).reshape(-1, 6)
+
+        step = np.linalg.lstsq(J, -residuals, rcond=None)[0]
+        R = cm.rotation_from_vector(step[:3]) @ R
+        t = t + step[3:]
+        if np.linalg.norm(step) < 1e-10:
+            break
+    return R, t
+
+
+@profiling.timed('pnp')
+def ransac_pnp(points_3d, keypoints, K, num_iterations=1000, threshold=2.0, confidence=0.999, batch_size=64,
+               refine=True, seed=None, return_info=False):
+    """
+    Camera pose from 2D-3D correspondences with batched RANSAC over minimal
+    3-point samples (`p3p`, up to four poses each), followed by Gauss-Newton
+    refinement on the inliers.
+
+    Args:
+        points_3d: (n, 3) world points.
+        keypoints: (n, 2) pixels where they are observed.
+        K: Camera intrinsic matrix (3x3).
+        num_iterations: Maximum number of hypotheses.
+        threshold: Reprojection error threshold in pixels for inliers.
+        confidence: Probability of having drawn at least one outlier-free sample.
+        batch_size: Number of samples solved and scored together.
+        refine: Refine the best pose on its inliers.
+        seed: Seed of the random sampler.
+        return_info: Also return a dict with the number of iterations run.
+
+    Returns:
+        R, t: Camera pose (x ~ K (R X + t)), None if no pose was found.
+        inliers: (n,) boolean inlier mask.
+        info: Only if return_info is True.
+    """
+    points_3d = np.asarray(points_3d, dtype=float)
+    keypoints = np.asarray(keypoints, dtype=float)
+    n = len(points_3d)
+    if n < 6:
+        raise ValueError(f"PnP needs at least 6 correspondences, got {n}")
+
+    bearings = np.column_stack((keypoints, np.ones(n))) @ np.linalg.inv(K).T
+    bearings /= np.linalg.norm(bearings, axis=1, keepdims=True)
+    rng = np.random.default_rng(seed)
+
+    best_R, best_t = None, None
+    best_mask = np.zeros(n, dtype=bool)
+    max_inliers = 0
+    max_iterations = int(num_iterations)
+    iterations_needed = max_iterations
+    iterations = 0
+
+    while iterations < min(max_iterations, iterations_needed):
+        batch = int(min(batch_size, max_iterations - iterations))
+        samples = np.argpartition(rng.random((batch, n)), 2, axis=1)[:, :3]
+
+        R, t = p3p(points_3d[samples], bearings[samples])
+        R, t = R.reshape(-1, 3, 3), t.reshape(-1, 3)
+        inlier_masks = reprojection_errors(K, R, t, points_3d, keypoints) < threshold
+        counts = inlier_masks.sum(axis=1)
+
+        best = np.argmax(counts)
+        if counts[best] > max_inliers:
+            max_inliers = counts[best]
+            best_R, best_t, best_mask = R[best], t[best], inlier_masks[best]
+            iterations_needed = fdm.ransac_iterations_needed(max_inliers / n, 3, confidence)
+
+        iterations += batch
+
+    if refine and best_mask.sum() >= 6:
+        R, t = refine_pose(K, best_R, best_t, points_3d[best_mask], keypoints[best_mask])
+        mask = reprojection_errors(K, R, t, points_3d, keypoints) < threshold
+        if mask.sum() >= best_mask.sum():
+            best_R, best_t, best_mask = R, t, mask
+
+    if return_info:
+        return best_R, best_t, best_mask, {'iterations': iterations, 'inliers': int(best_mask.sum())}
+    return best_R, best_t, best_mask
@@ -0,0 +1,140 @@
+import numpy as np
+
+
+# voxel indices are packed into one int64 key, 21 bits per axis
+_KEY_BITS = 21
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+
+
+def voxel_keys(points, voxel_size):
+    """
+    One int64 key per point for the voxel it falls in. Voxel indices are
+    wrapped to 21 bits per axis, so keys are unique within about a million
+    voxels along each axis.
+    """
+    voxels = np.floor(points / voxel_size).astype(np.int64) + _KEY_OFFSET
+    voxels &= (1 << _KEY_BITS) - 1
+    return (voxels[:, 0] << (2*_KEY_BITS)) | (voxels[:, 1] << _KEY_BITS) | voxels[:, 2]
+
+
+class PointCloud:
+    """
+    Growable colored point cloud stored as contiguous (N, 3) float32 points
+    and (N, 3) uint8 colors.
+
+    Points are appended in chunks and the arrays double when full, so adding
+    is amortized O(chunk) and `points` / `colors` are ready to write without
+    conversion. With a voxel size, points falling in an occupied voxel are
+    merged into it (running mean of positions and colors), so the memory
+    grows with the volume of the scene rather than with the number of points
+    added.
+    """
+
+    def __init__(self, voxel_size=None, capacity=1 << 16):
+        self.voxel_size = voxel_size
+        self.n_points = 0
+        self._points = np.empty((capacity, 3), dtype=np.float32)
+        self._colors = np.empty((capacity, 3), dtype=np.uint8)
+        if voxel_size:
+            # sorted runs of (voxel keys, rows), each at least twice the size of
+            # the next one, and the points merged per row
+            self._runs = []
+            self._counts = np.empty(capacity, dtype=np.uint32)
+
+    def __len__(self):
+        return self.n_points
+
+    @property
+    def points(self):
+        return self._points[:self.n_points]
+
+    @property
+    def colors(self):
+        return self._colors[:self.n_points]
+
+    def _reserve(self, size):
+        if size <= len(self._points):
+            return
+        capacity = max(size, 2*len(self._points))
+        for name in ('_points', '_colors') + (('_counts',) if self.voxel_size else ()):
+            array = getattr(self, name)
+            grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self.n_points] = array[:self.n_points]
+            setattr(self, name, grown)
+
+    def add(self, points, colors):
+        """
+        Add a chunk of points.
+
+        Args:
+            points: (N, 3) points, non-finite ones are dropped.
+            colors: (N, 3) uint8 colors, or float colors in [0, 1].
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        colors = np.asarray(colors).reshape(-1, 3)
+        if colors.dtype != np.uint8:
+            colors = np.clip(np.rint(colors * 255), 0, 255).astype(np.uint8)
+
+        finite = np.all(np.isfinite(points), axis=1)
+        points, colors = points[finite], colors[finite]
+        if len(points) == 0:
+            return
+
+        if self.voxel_size:
+            self._merge(points, colors)
+            return
+
+        self._reserve(self.n_points + len(points))
+        self._points[self.n_points:self.n_points + len(points)] = points
+        self._colors[self.n_points:self.n_points + len(points)] = colors
+        self.n_points += len(points)
+
+    def _merge(self, points, colors):
+        keys, inverse, counts = np.unique(voxel_keys(points, self.voxel_size), return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+
+        # sums of the chunk per voxel
+        point_sums = np.zeros((len(keys), 3))
+        color_sums = np.zeros((len(keys), 3))
+        np.add.at(point_sums, inverse, points)
+        np.add.at(color_sums, inverse, colors)
+
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        for run_keys, run_rows in self._runs:
+            positions = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+            hit = run_keys[positions] == keys
+            rows[hit] = run_rows[positions[hit]]
+        found = rows >= 0
+
+        # merge into occupied voxels with a running mean
+        rows = rows[found]
+        old = self._counts[rows].astype(np.float64)[:, None]
+        total = old + counts[found, None]
+        self._points[rows] = (self._points[rows] * old + point_sums[found]) / total
+        self._colors[rows] = np.rint((self._colors[rows] * old + color_sums[found]) / total)
+        self._counts[rows] = total[:, 0]
+
+        # new voxels get new rows
+        new = ~found
+        n_new = int(new.sum())
+        self._reserve(self.n_points + n_new)
+        new_rows = np.arange(self.n_points, self.n_points + n_new)
+        self._points[new_rows] = point_sums[new] / counts[new, None]
+        self._colors[new_rows] = np.rint(color_sums[new] / counts[new, None])
+        self._counts[new_rows] = counts[new]
+        self.n_points += n_new
+
+        self._index(keys[new], new_rows)
+
+    def _index(self, keys, rows):
+        # Add sorted keys as a new run and merge runs of similar size, so every
+        # key is re-sorted O(log V) times instead of shifting the whole index
+        # on every chunk.
+        if len(keys) == 0:
+            return
+        self._runs.append((keys, rows))
+        while len(self._runs) > 1 and len(self._runs[-2][0]) <= 2*len(self._runs[-1][0]):
+            (keys_1, rows_1), (keys_2, rows_2) = self._runs.pop(-2), self._runs.pop()
+            keys, rows = np.concatenate((keys_1, keys_2)), np.concatenate((rows_1, rows_2))
+            order = np.argsort(keys, kind='stable')
+            self._runs.append((keys[order], rows[order]))
@@ -0,0 +1,242 @@
+import contextlib
+import cProfile
+import csv
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# the profiler of this process, None when profiling is disabled
+_active = None
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def peak_memory():
+    """
+    Peak resident memory in bytes of this process and of its finished
+    children (e.g. feature workers), or None where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    }
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """
+    Wall-clock time per named stage, counters, and one row of counters per
+    image pair. Stage times are summed over all calls, threads and workers,
+    so stages running in parallel can add up to more than the run time.
+    """
+
+    def __init__(self, cprofile=False):
+        self.stages = {}
+        self.counters = {}
+        self.pairs = []
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._cprofile = cProfile.Profile() if cprofile else None
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            stats = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def count(self, name, value=1):
+        """
+        Add value to a run counter and set it in the current pair row.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if self.pairs:
+                self.pairs[-1][name] = self.pairs[-1].get(name, 0) + value
+
+    def new_pair(self, **keys):
+        """
+        Start the counter row of a new image pair, identified by keys.
+        """
+        with self._lock:
+            self.pairs.append(dict(keys))
+
+    def stats(self):
+        return {'stages': {name: list(stats) for name, stats in self.stages.items()}, 'counters': dict(self.counters)}
+
+    def merge(self, stats):
+        """
+        Add the stage times and counters of another profiler, see `stats`.
+        """
+        for name, (calls, total, longest) in stats['stages'].items():
+            with self._lock:
+                current = self.stages.setdefault(name, [0, 0.0, 0.0])
+                current[0] += calls
+                current[1] += total
+                current[2] = max(current[2], longest)
+        for name, value in stats['counters'].items():
+            self.count(name, value)
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    def report(self):
+        """
+        Run report as a JSON-serializable dict.
+        """
+        return {
+            'wall_time': time.perf_counter() - self.start,
+            'stages': {name: {'calls': calls, 'total': total, 'mean': total / calls, 'max': longest}
+                       for name, (calls, total, longest) in sorted(self.stages.items(), key=lambda item: -item[1][1])},
+            'counters': self.counters,
+            'peak_memory': peak_memory(),
+            'pairs': self.pairs,
+        }
+
+    def write(self, directory, name='profile'):
+        """
+        Write the report to directory/name.json, the per-pair counters to
+        directory/name.csv and, if enabled, the cProfile stats to directory/name.prof.
+
+        Returns:
+            paths: Paths of the written files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = [os.path.join(directory, name + '.json'), os.path.join(directory, name + '.csv')]
+        with open(paths[0], 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+        columns = list(dict.fromkeys(key for row in self.pairs for key in row))
+        with open(paths[1], 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.pairs)
+
+        if self._cprofile is not None:
+            paths.append(os.path.join(directory, name + '.prof'))
+            self._cprofile.dump_stats(paths[-1])
+        return paths
+
+
+def enable(cprofile=False):
+    """
+    Start profiling this process.
+
+    Returns:
+        profiler: The active `Profiler`.
+    """
+    global _active
+    _active = Profiler(cprofile=cprofile)
+    return _active
+
+
+def disable():
+    """
+    Stop profiling.
+
+    Returns:
+        profiler: The profiler that was active, None if there was none.
+    """
+    global _active
+    profiler, _active = _active, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def enabled():
+    return _active is not None
+
+
+def stage(name):
+    """
+    Context manager timing a stage; does nothing when profiling is disabled.
+    """
+    return _active.stage(name) if _active is not None else _NULL_STAGE
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as a stage.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    if _active is not None:
+        _active.count(name, value)
+
+
+def merge(stats):
+    if _active is not None and stats is not None:
+        _active.merge(stats)
+
+
+def new_pair(**keys):
+    if _active is not None:
+        _active.new_pair(**keys)
+
+
+def profiled_call(func, *args, **kwargs):
+    """
+    Call func in a worker. In a fresh worker process, profile the call and
+    return its stats so that the parent can `merge` them.
+
+    Returns:
+        result: Return value of func.
+        stats: Stage times and counters of the call, None when the call was
+            recorded by an already active profiler (thread workers).
+    """
+    if _active is not None and _active.pid == os.getpid():
+        return func(*args, **kwargs), None
+
+    # a forked worker inherits a copy of the parent profiler, replace it
+    if _active is not None:
+        _active.stop()
+    profiler = enable()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        disable()
+    return result, profiler.stats()
@@ -0,0 +1,297 @@
+import numpy as np
+
+import bundle_adjustment as ba
+import camera_motion as cm
+import pnp
+import triangulation as tg
+
+
+def _grow(array, size):
+    # amortized doubling of the first axis
+    if size <= len(array):
+        return array
+    grown = np.empty((max(size, 2*len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class Reconstruction:
+    """
+    Incremental multi-view reconstruction in one global frame.
+
+    Every image stores its keypoints, their colors and, per keypoint, the id
+    of the 3D point it observes (-1 if none). Points and their observations
+    live in compact growable arrays, so a track is the set of observation
+    rows of one point. New images are registered by PnP against the points
+    they see through matches with an already registered image, and only
+    matches without a point are triangulated.
+    """
+
+    def __init__(self, K, min_pnp_points=12, reprojection_threshold=2.0, pnp_iterations=1000):
+        self.K = np.asarray(K, dtype=float)
+        self.min_pnp_points = min_pnp_points
+        self.reprojection_threshold = reprojection_threshold
+        self.pnp_iterations = pnp_iterations
+
+        self.keypoints = []
+        self.keypoint_colors = []
+        self.point_of = []
+        self.poses = cm.PoseGraph()
+
+        self.n_points = 0
+        self._points = np.empty((1024, 3))
+        self._colors = np.empty((1024, 3), dtype=np.uint8)
+
+        # observation rows: (point, image, keypoint)
+        self.n_observations = 0
+        self._observations = np.empty((2048, 3), dtype=np.int64)
+
+    @property
+    def points(self):
+        return self._points[:self.n_points]
+
+    @property
+    def colors(self):
+        return self._colors[:self.n_points]
+
+    @property
+    def observations(self):
+        return self._observations[:self.n_observations]
+
+    @property
+    def initialized(self):
+        return len(self.poses) > 0
+
+    def add_image(self, keypoints, color_image=None):
+        """
+        Add an image with its (x, y) keypoints; colors of new points are read
+        from color_image at the keypoints.
+
+        Returns:
+            image: Id of the image.
+        """
+        keypoints = np.asarray(keypoints, dtype=float).reshape(-1, 2)
+        if color_image is not None:
+            height, width = color_image.shape[:2]
+            x = np.clip(np.rint(keypoints[:, 0]).astype(int), 0, width - 1)
+            y = np.clip(np.rint(keypoints[:, 1]).astype(int), 0, height - 1)
+            colors = color_image[y, x].reshape(len(keypoints), -1)[:, :3].astype(np.uint8)
+        else:
+            colors = np.full((len(keypoints), 3), 255, dtype=np.uint8)
+
+        self.keypoints.append(keypoints)
+        self.keypoint_colors.append(colors)
+        self.point_of.append(np.full(len(keypoints), -1, dtype=np.int64))
+        return len(self.keypoints) - 1
+
+    def is_registered(self, image):
+        return self.poses.is_registered(image)
+
+    def set_pose(self, image, R, t):
+        self.poses.set_pose(image, R, t)
+
+    def projection(self, image):
+        return cm.projection_matrix(self.K, *self.poses.pose(image))
+
+    def _add_points(self, points_3d, colors):
+        start = self.n_points
+        self.n_points += len(points_3d)
+        self._points = _grow(self._points, self.n_points)
+        self._colors = _grow(self._colors, self.n_points)
+        self._points[start:self.n_points] = points_3d
+        self._colors[start:self.n_points] = colors
+        return np.arange(start, self.n_points)
+
+    def _observe(self, point_ids, image, keypoint_ids):
+        start = self.n_observations
+        self.n_observations += len(point_ids)
+        self._observations = _grow(self._observations, self.n_observations)
+        self._observations[start:self.n_observations] = np.column_stack(
+            (point_ids, np.full(len(point_ids), image), keypoint_ids))
+        self.point_of[image][keypoint_ids] = point_ids
+
+    def initialize(self, image1, image2, R, t, matches, points_3d, valid=None):
+        """
+        Start the reconstruction from a two-view pose: image1 at [I | 0],
+        image2 at [R | t], with the matches already triangulated.
+        """
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        if valid is None:
+            valid = np.ones(len(matches), dtype=bool)
+
+        self.set_pose(image1, np.eye(3), np.zeros(3))
+        self.set_pose(image2, R, t)
+        self._add_tracks(image1, image2, matches[valid], points_3d[valid])
+
+    def _add_tracks(self, image1, image2, matches, points_3d):
+        point_ids = self._add_points(points_3d, self.keypoint_colors[image1][matches[:, 0]])
+        self._observe(point_ids, image1, matches[:, 0])
+        self._observe(point_ids, image2, matches[:, 1])
+
+    def triangulate_new(self, image1, image2, matches, method='dlt'):
+        """
+        Triangulate the matches between two registered images whose keypoints
+        do not observe a point yet, keeping points in front of both cameras
+        that reproject within the threshold.
+
+        Returns:
+            count: Number of new points.
+        """
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        free = (self.point_of[image1][matches[:, 0]] < 0) & (self.point_of[image2][matches[:, 1]] < 0)
+        matches = matches[free]
+        # a keypoint can only start one track
+        matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+        if len(matches) == 0:
+            return 0
+
+        x1 = self.keypoints[image1][matches[:, 0]]
+        x2 = self.keypoints[image2][matches[:, 1]]
+        points_3d = tg.TRIANGULATION_METHODS[method](self.projection(image1), self.projection(image2), x1, x2)
+
+        valid = np.all(np.isfinite(points_3d), axis=1)
+        for image, x in ((image1, x1), (image2, x2)):
+            errors = pnp.reprojection_errors(self.K, *self.poses.pose(image), points_3d, x)
+            valid &= errors < self.reprojection_threshold
+
+        self._add_tracks(image1, image2, matches[valid], points_3d[valid])
+        return int(valid.sum())
+
+    def register(self, image, reference, matches, method='dlt', seed=None):
+        """
+        Register a new image by PnP on the points its keypoints see through
+        matches with a registered reference image, extend those tracks and
+        triangulate the remaining matches.
+
+        Args:
+            image: Id of the new image.
+            reference: Id of a registered image.
+            matches: (reference keypoint, image keypoint) index pairs.
+
+        Returns:
+            True if the image was registered.
+        """
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        point_ids = self.point_of[reference][matches[:, 0]]
+        known = point_ids >= 0
+        if known.sum() < self.min_pnp_points:
+            return False
+
+        R, t, inliers = pnp.ransac_pnp(self.points[point_ids[known]], self.keypoints[image][matches[known, 1]], self.K,
+                                       num_iterations=self.pnp_iterations, threshold=self.reprojection_threshold,
+                                       seed=seed)
+        if R is None or inliers.sum() < self.min_pnp_points:
+            return False
+        self.set_pose(image, R, t)
+
+        # extend the tracks seen by PnP inliers, each keypoint joins one track
+        extend = matches[known][inliers]
+        extend_points = point_ids[known][inliers]
+        _, first = np.unique(extend[:, 1], return_index=True)
+        self._observe(extend_points[first], image, extend[first, 1])
+
+        self.triangulate_new(reference, image, matches, method)
+        return True
+
+    def register_relative(self, image, reference, R_rel, t_rel, matches, points_3d, valid=None, method='dlt'):
+        """
+        Place an image by chaining its relative pose to a registered reference
+        image, when it cannot be registered by PnP, and triangulate its
+        matches with the reference.
+
+        The unit translation is scaled with `camera_motion.relative_scale`
+        between the pair's points and the existing points they observe;
+        without shared points the last nonzero baseline length is kept.
+
+        Args:
+            R_rel, t_rel: Relative pose, x_image = R_rel x_reference + t_rel.
+            matches: (reference keypoint, image keypoint) index pairs.
+            points_3d: (N, 3) matches triangulated in the reference camera frame
+                with this relative pose.
+            valid: (N,) mask of the points to use for the scale.
+
+        Returns:
+            scale: Scale applied to t_rel.
+        """
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        point_ids = self.point_of[reference][matches[:, 0]]
+        shared = point_ids >= 0
+        if valid is not None:
+            shared &= valid
+
+        R, t = self.poses.pose(reference)
+        scale = cm.relative_scale(self.points[point_ids[shared]] @ R.T + t, points_3d[shared])
+        if scale is None:
+            # cameras placed at the pose of another one have no baseline
+            frames = self.registered_images()
+            baselines = np.linalg.norm(np.diff(self.poses.centers(frames[frames <= reference]), axis=0), axis=1)
+            baselines = baselines[baselines > 0]
+            scale = float(baselines[-1]) if len(baselines) else 1.0
+
+        self.poses.chain(image, reference, R_rel, t_rel, scale)
+        self.triangulate_new(reference, image, matches, method)
+        return scale
+
+    def bundle_adjust(self, window=None, iterations=10, images=None):
+        """
+        Refine poses and points with bundle adjustment.
+
+        With a window only the last `window` registered cameras, or with
+        images the given registered cameras, and the points they observe are
+        optimized (local BA); the other cameras observing those points are
+        kept fixed. Otherwise all cameras and points are optimized with the
+        first camera fixed.
+
+        Returns:
+            info: Costs and iterations, see `bundle_adjustment.bundle_adjust`.
+        """
+        variable, images = images, self.registered_images()
+        if len(images) < 2:
+            return None
+        if variable is not None:
+            variable = np.intersect1d(images, variable)
+        else:
+            variable = images if window is None else images[-window:]
+
+        observations = self.observations
+        registered = np.isin(observations[:, 1], images)
+        observed = np.unique(observations[np.isin(observations[:, 1], variable), 0])
+        observations = observations[registered & np.isin(observations[:, 0], observed)]
+        if len(observations) == 0:
+            return None
+
+        point_ids, points = np.unique(observations[:, 0], return_inverse=True)
+        cameras = np.searchsorted(images, observations[:, 1])
+        keypoints = np.empty((len(observations), 2))
+        for image in images:
+            mask = observations[:, 1] == image
+            keypoints[mask] = self.keypoints[image][observations[mask, 2]]
+
+        fixed = np.flatnonzero(~np.isin(images, variable))
+        if len(fixed) == 0:
+            fixed = [0]
+
+        rotations, translations, points_3d, info = ba.bundle_adjust(
+            self.K, self.poses.rotations[images], self.poses.translations[images], self.points[point_ids], cameras, points, keypoints,
+            fixed_cameras=fixed, iterations=iterations, return_info=True)
+
+        for image, R, t in zip(images, rotations, translations):
+            self.set_pose(image, R, t)
+        self._points[point_ids] = points_3d
+        return info
+
+    def registered_images(self):
+        return self.poses.frames()
+
+    def camera_centers(self):
+        """
+        (M, 3) centers of the registered cameras, in image order.
+        """
+        return self.poses.centers()
+
+    def point_cloud(self):
+        """
+        Points and their uint8 colors.
+        """
+        return self.points.copy(), self.colors.copy()
@@ -0,0 +1,217 @@
+import numpy as np
+
+import profiling
+
+
+def _kmeans(points, k, iterations, rng):
+    """
+    Lloyd's k-means with centers initialized on random points; with fewer
+    than k points the centers repeat.
+
+    Returns:
+        centers: (k, d) centers.
+    """
+    centers = points[rng.choice(len(points), k, replace=len(points) < k)].astype(np.float64)
+    for _ in range(iterations):
+        labels = np.argmin(np.sum(centers**2, axis=1) - 2 * points @ centers.T, axis=1)
+        # empty clusters keep their center
+        for cluster in range(k):
+            members = points[labels == cluster]
+            if len(members):
+                centers[cluster] = members.mean(axis=0)
+    return centers
+
+
+def _as_vectors(descriptors):
+    # binary descriptors are clustered as vectors of their bits
+    descriptors = np.asarray(descriptors)
+    if descriptors.dtype == np.uint8:
+        descriptors = np.unpackbits(descriptors, axis=1)
+    return descriptors.astype(np.float64)
+
+
+class VocabularyTree:
+    """
+    Hierarchical k-means vocabulary over descriptors (Nister & Stewenius).
+
+    Nodes are numbered level by level like a heap: the children of node n
+    are n*branching + 1 ... n*branching + branching, and the leaves are the
+    visual words. A descriptor is quantized by descending the tree, so
+    quantizing costs depth*branching distance computations instead of one
+    per word.
+    """
+
+    def __init__(self, branching=8, depth=3, iterations=10, seed=0):
+        self.branching = branching
+        self.depth = depth
+        self.iterations = iterations
+        self.seed = seed
+        self.n_internal = (branching**depth - 1) // (branching - 1)
+        self.n_words = branching**depth
+        self.centers = None
+        self.idf = None
+
+    @profiling.timed('vocabulary')
+    def fit(self, descriptor_sets, max_descriptors=100000):
+        """
+        Train the tree on a sample of the descriptors of a collection and
+        weight the words by their inverse document frequency in it.
+
+        Args:
+            descriptor_sets: List of (N_i, D) descriptor arrays, one per image.
+            max_descriptors: Number of descriptors sampled for k-means.
+        """
+        rng = np.random.default_rng(self.seed)
+        descriptors = _as_vectors(np.concatenate(descriptor_sets))
+        if len(descriptors) > max_descriptors:
+            descriptors = descriptors[rng.choice(len(descriptors), max_descriptors, replace=False)]
+
+        self.centers = np.zeros((self.n_internal, self.branching, descriptors.shape[1]))
+        node_of = np.zeros(len(descriptors), dtype=np.int64)
+        first = 0
+        for level in range(self.depth):
+            nodes = np.arange(first, first + self.branching**level)
+            for node in nodes:
+                members = descriptors[node_of == node]
+                if len(members) == 0:
+                    continue
+                self.centers[node] = _kmeans(members, self.branching, self.iterations, rng)
+            node_of = self._descend(descriptors, node_of)
+            first = first * self.branching + 1
+
+        # inverse document frequency, words seen in no image count as seen once
+        document_frequency = np.zeros(self.n_words)
+        for descriptors in descriptor_sets:
+            document_frequency[np.unique(self.quantize(descriptors))] += 1
+        self.idf = np.log(len(descriptor_sets) / np.maximum(document_frequency, 1))
+        return self
+
+    def _descend(self, descriptors, nodes):
+        centers = self.centers[nodes]
+        distances = np.sum(centers**2, axis=2) - 2 * np.einsum('nbd,nd->nb', centers, descriptors)
+        return nodes * self.branching + 1 + np.argmin(distances, axis=1)
+
+    def quantize(self, descriptors, chunk_size=4096):
+        """
+        Visual word of every descriptor.
+
+        Returns:
+            words: (N,) word indices in [0, n_words).
+        """
+        descriptors = _as_vectors(descriptors)
+        words = np.empty(len(descriptors), dtype=np.int64)
+        for start in range(0, len(descriptors), chunk_size):
+            chunk = descriptors[start:start + chunk_size]
+            nodes = np.zeros(len(chunk), dtype=np.int64)
+            for _ in range(self.depth):
+                nodes = self._descend(chunk, nodes)
+            words[start:start + chunk_size] = nodes - self.n_internal
+        return words
+
+    def bag_of_words(self, descriptors):
+        """
+        L2-normalized tf-idf vector of an image as a sparse (words, weights) pair.
+        """
+        words, counts = np.unique(self.quantize(descriptors), return_counts=True)
+        weights = counts / max(counts.sum(), 1) * self.idf[words]
+        norm = np.linalg.norm(weights)
+        return words, weights / norm if norm > 0 else weights
+
+
+class RetrievalIndex:
+    """
+    Inverted file over the bag-of-words vectors of a collection of images.
+
+    Each word keeps the images it appears in with their weights, so scoring
+    a query only touches the postings of its own words. Scores are cosine
+    similarities of the tf-idf vectors.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self._staged = []
+        self._indptr = np.zeros(tree.n_words + 1, dtype=np.int64)
+        self._images = np.empty(0, dtype=np.int64)
+        self._weights = np.empty(0)
+        self.n_images = 0
+
+    def add(self, image, descriptors):
+        """
+        Add an image, identified by a non-negative integer, to the index.
+        """
+        words, weights = self.tree.bag_of_words(descriptors)
+        self._staged.append((np.full(len(words), image), words, weights))
+        self.n_images = max(self.n_images, image + 1)
+
+    def _build(self):
+        # merge the staged images into the compressed postings, sorted by word
+        if not self._staged:
+            return
+        words_old = np.repeat(np.arange(self.tree.n_words), np.diff(self._indptr))
+        images = np.concatenate([self._images] + [images for images, _, _ in self._staged])
+        words = np.concatenate([words_old] + [words for _, words, _ in self._staged])
+        weights = np.concatenate([self._weights] + [weights for _, _, weights in self._staged])
+        order = np.argsort(words, kind='stable')
+        self._images, self._weights = images[order], weights[order]
+        self._indptr = np.concatenate(([0], np.cumsum(np.bincount(words, minlength=self.tree.n_words))))
+        self._staged = []
+
+    @profiling.timed('retrieval')
+    def query(self, descriptors, k=5, exclude=None):
+        """
+        The k images most similar to a query image.
+
+        Args:
+            descriptors: Descriptors of the query image.
+            k: Number of results.
+            exclude: Image to leave out of the results, e.g. the query itself.
+
+        Returns:
+            images: (<=k,) image ids, most similar first.
+            scores: (<=k,) their similarities.
+        """
+        self._build()
+        words, weights = self.tree.bag_of_words(descriptors)
+
+        # gather the postings of the query words
+        starts, ends = self._indptr[words], self._indptr[words + 1]
+        lengths = ends - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        scores = np.bincount(self._images[positions], weights=self._weights[positions] * np.repeat(weights, lengths),
+                             minlength=self.n_images)
+        if exclude is not None and exclude < len(scores):
+            scores[exclude] = -np.inf
+
+        candidates = np.flatnonzero(scores > 0)
+        best = candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+        return best, scores[best]
+
+
+def candidate_pairs(descriptor_sets, k=5, tree=None, **tree_kwargs):
+    """
+    Image pairs worth matching in an unordered collection: every image is
+    paired with its k most similar images in a vocabulary tree index, so the
+    number of pairs grows as N*k instead of N^2/2.
+
+    Args:
+        descriptor_sets: List of descriptor arrays, one per image.
+        k: Number of retrieved images per image.
+        tree: A fitted `VocabularyTree`, trained on descriptor_sets if None.
+        tree_kwargs: Arguments of `VocabularyTree` when it is trained here.
+
+    Returns:
+        pairs: Sorted list of (i, j) pairs with i < j.
+        scores: dict of the similarity of every pair.
+    """
+    if tree is None:
+        tree = VocabularyTree(**tree_kwargs).fit(descriptor_sets)
+    index = RetrievalIndex(tree)
+    for image, descriptors in enumerate(descriptor_sets):
+        index.add(image, descriptors)
+
+    scores = {}
+    for image, descriptors in enumerate(descriptor_sets):
+        for other, score in zip(*index.query(descriptors, k, exclude=image)):
+            pair = (min(image, int(other)), max(image, int(other)))
+            scores[pair] = max(scores.get(pair, 0.0), float(score))
+    return sorted(scores), scores
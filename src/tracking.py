@@ -0,0 +1,197 @@
+import numpy as np
+
+import feature_detection as fd
+import profiling
+
+
+def _sample_windows(padded, pad, centers, half):
+    '''
+    Bilinear samples of the (2*half + 1)^2 pixel window around every (x, y)
+    center of an image padded by pad >= half + 1 pixels. The window offsets
+    are whole pixels, so all samples of a window share the same weights.
+
+    Returns:
+        samples: (N, (2*half + 1)^2) samples, row by row.
+    '''
+    height, width = padded.shape
+    centers = np.clip(centers + pad, half, (width - half - 1.001, height - half - 1.001))
+    x0, y0 = centers[:, 0].astype(np.intp), centers[:, 1].astype(np.intp)
+    fx = (centers[:, 0] - x0)[:, None].astype(padded.dtype)
+    fy = (centers[:, 1] - y0)[:, None].astype(padded.dtype)
+
+    steps = np.arange(-half, half + 1)
+    index = (y0 * width + x0)[:, None] + (steps[:, None] * width + steps).ravel()
+    flat = padded.ravel()
+    top = flat[index] * (1 - fx) + flat[index + 1] * fx
+    bottom = flat[index + width] * (1 - fx) + flat[index + width + 1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def image_pyramid(image, levels=3):
+    '''
+    Gaussian pyramid of a grayscale image with the gradients of every level.
+
+    Returns:
+        pyramid: List of levels + 1 float32 images, full resolution first.
+        gradients: List of (Ix, Iy) per level, in intensity per pixel.
+    '''
+    pyramid = fd.build_pyramid(np.asarray(image, dtype=np.float32), levels)
+    # the Sobel kernel weighs the central difference by 2 * (1 + 2 + 1)
+    gradients = [tuple(G / 8 for G in fd.compute_image_gradients(level)) for level in pyramid]
+    return pyramid, gradients
+
+
+def lucas_kanade(previous, current, points, window_size=15, iterations=10, epsilon=0.01, min_eigenvalue=1.0):
+    '''
+    Pyramidal Lucas-Kanade optical flow of points from one image to the next.
+
+    Starting on the coarsest level, the displacement of the window around
+    every point is refined by Gauss-Newton steps on the intensity difference,
+    with the gradients of the previous image, and doubled into the guess of
+    the next finer level. All points are updated together.
+
+    Args:
+        previous, current: `image_pyramid` outputs of both images, same number of levels.
+        points: (N, 2) (x, y) points in the previous image.
+        window_size: Side of the tracked window in pixels, on every level.
+        iterations: Maximum number of steps per level.
+        epsilon: Stop refining a point once its step is below this many pixels.
+        min_eigenvalue: Minimum of the smallest eigenvalue of the window's
+            gradient matrix, per pixel; points in flat or edge-like windows
+            are lost.
+
+    Returns:
+        tracked: (N, 2) points in the current image.
+        status: (N,) True for the points that were tracked.
+    '''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    half = window_size // 2
+    pad = half + 2
+    n_pixels = (2 * half + 1)**2
+
+    guess = np.zeros_like(points)
+    status = np.ones(len(points), dtype=bool)
+    for level in range(len(previous[0]) - 1, -1, -1):
+        image, gradients = previous[0][level], previous[1][level]
+        next_image = np.pad(current[0][level], pad, mode='edge')
+        scaled = points / 2**level
+
+        template, gx, gy = (_sample_windows(np.pad(array, pad, mode='edge'), pad, scaled, half)
+                            for array in (image,) + tuple(gradients))
+        Gxx, Gxy, Gyy = np.sum(gx * gx, axis=1), np.sum(gx * gy, axis=1), np.sum(gy * gy, axis=1)
+        det = Gxx * Gyy - Gxy**2
+        invertible = det > 1e-9
+        det = np.where(invertible, det, 1.0)
+
+        flow = np.zeros_like(points)
+        active = invertible.copy()
+        for _ in range(iterations):
+            if not active.any():
+                break
+            rows = np.flatnonzero(active)
+            shift = guess[rows] + flow[rows]
+            error = template[rows] - _sample_windows(next_image, pad, scaled[rows] + shift, half)
+            bx, by = np.sum(error * gx[rows], axis=1), np.sum(error * gy[rows], axis=1)
+            step = np.column_stack((Gyy[rows] * bx - Gxy[rows] * by, Gxx[rows] * by - Gxy[rows] * bx)) / det[rows, None]
+            flow[rows] += step
+            active[rows] = np.sum(step**2, axis=1) > epsilon**2
+
+        guess = guess + flow
+        if level > 0:
+            guess *= 2
+        else:
+            # smallest eigenvalue of the gradient matrix at full resolution
+            trace, root = (Gxx + Gyy) / 2, np.sqrt(((Gxx - Gyy) / 2)**2 + Gxy**2)
+            status &= invertible & ((trace - root) / n_pixels >= min_eigenvalue)
+
+    tracked = points + guess
+    height, width = current[0][0].shape
+    status &= np.all(np.isfinite(tracked), axis=1)
+    status &= (tracked[:, 0] >= 0) & (tracked[:, 0] <= width - 1) & (tracked[:, 1] >= 0) & (tracked[:, 1] <= height - 1)
+    return tracked, status
+
+
+class KLTTracker:
+    '''
+    Keypoint tracker for video-like sequences.
+
+    Keypoints are carried from frame to frame with pyramidal Lucas-Kanade
+    flow, kept only if tracking back lands within fb_threshold pixels of
+    where they started, and Harris keypoints are detected again only when
+    fewer than min_tracks survive. New keypoints are kept away from the
+    tracked ones by min_distance pixels. Each frame then costs one pyramid
+    and the flow of the tracked points instead of a detection, descriptors
+    and matching.
+    '''
+
+    def __init__(self, detector_kwargs=None, min_tracks=300, levels=3, window_size=15, iterations=10,
+                 fb_threshold=1.0, min_distance=5):
+        self.detector_kwargs = dict(detector_kwargs or {})
+        self.min_tracks = min_tracks
+        self.levels = levels
+        self.window_size = window_size
+        self.iterations = iterations
+        self.fb_threshold = fb_threshold
+        self.min_distance = min_distance
+
+        self.keypoints = np.empty((0, 2))
+        self.track_ids = np.empty(0, dtype=np.int64)
+        self.n_tracks = 0
+        self._pyramid = None
+
+    def _detect(self, image, keypoints):
+        # Harris keypoints at least min_distance away from the given ones
+        detected = fd.harris_corner_detector(image, **self.detector_kwargs).reshape(-1, 2)
+        if len(keypoints) == 0 or len(detected) == 0:
+            return detected.astype(np.float64)
+        occupied = np.zeros(image.shape, dtype=np.int64)
+        pixels = np.rint(keypoints).astype(np.intp)
+        occupied[pixels[:, 1], pixels[:, 0]] = 1
+        occupied = fd.box_sum(occupied, 2 * self.min_distance + 1) > 0
+        return detected[~occupied[detected[:, 1], detected[:, 0]]].astype(np.float64)
+
+    @profiling.timed('tracking')
+    def track(self, image):
+        '''
+        Track the keypoints of the previous frame into a new grayscale frame.
+
+        Returns:
+            keypoints: (N, 2) float (x, y) keypoints of the frame, the tracked
+                ones first, then the newly detected ones.
+            matches: (M, 2) (previous keypoint, keypoint) index pairs of the
+                tracked keypoints.
+        '''
+        pyramid = image_pyramid(image, self.levels)
+        previous = np.empty(0, dtype=np.int64)
+        keypoints, track_ids = np.empty((0, 2)), np.empty(0, dtype=np.int64)
+        if self._pyramid is not None and len(self.keypoints):
+            args = dict(window_size=self.window_size, iterations=self.iterations)
+            tracked, status = lucas_kanade(self._pyramid, pyramid, self.keypoints, **args)
+            if self.fb_threshold is not None:
+                back, back_status = lucas_kanade(pyramid, self._pyramid, tracked, **args)
+                status &= back_status & (np.linalg.norm(back - self.keypoints, axis=1) < self.fb_threshold)
+            previous = np.flatnonzero(status)
+            keypoints, track_ids = tracked[previous], self.track_ids[previous]
+        profiling.count('tracks', len(previous))
+
+        if len(keypoints) < self.min_tracks:
+            detected = self._detect(image, keypoints)
+            keypoints = np.concatenate((keypoints, detected))
+            track_ids = np.concatenate((track_ids, self.n_tracks + np.arange(len(detected))))
+            self.n_tracks += len(detected)
+            profiling.count('detections', len(detected))
+
+        self.keypoints, self.track_ids, self._pyramid = keypoints, track_ids, pyramid
+        return keypoints, np.column_stack((previous, np.arange(len(previous))))
+
+
+def iter_tracks(images, **tracker_kwargs):
+    '''
+    Track keypoints through a sequence of grayscale images with a `KLTTracker`.
+
+    Yields:
+        (keypoints, matches) of every image, see `KLTTracker.track`.
+    '''
+    tracker = KLTTracker(**tracker_kwargs)
+    for image in images:
+        yield tracker.track(image)
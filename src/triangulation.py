@@ -1,5 +1,7 @@
 import numpy as np 
 
+import profiling
+
 def triangulate_point(p1,p2,x1,x2):
     """
     Triangulate a single 3D point from two views.
@@ -29,53 +31,198 @@ def triangulate_point(p1,p2,x1,x2):
     return x[:3]
 
 
-def triangulate_points(p1,p2,keypoints1,keypoints2,matches):
+def _image_points(keypoints, indices):
+    return np.asarray(keypoints, dtype=float).reshape(-1, 2)[indices]
+
+
+@profiling.timed('triangulation')
+def triangulate_dlt(P1, P2, x1, x2):
+    """
+    Triangulate many points at once with the linear (DLT) method.
+
+    All 4x4 systems are stacked and solved with one batched SVD.
+
+    Args:
+        P1: Projection matrix for the first camera (3x4).
+        P2: Projection matrix, or (C, 3, 4) candidate projection matrices, for the second camera.
+        x1: (N, 2) points in the first image.
+        x2: (N, 2) points in the second image.
+
+    Returns:
+        points_3d: (N, 3) points, or (C, N, 3) for C candidate matrices.
+    """
+    x1 = np.asarray(x1, dtype=float)[:, :2]
+    x2 = np.asarray(x2, dtype=float)[:, :2]
+    P2 = np.asarray(P2, dtype=float)
+
+    A = np.empty(P2.shape[:-2] + (len(x1), 4, 4))
+
+    #Build the linear sys of equations
+    A[..., 0, :] = x1[:, 0, None] * P1[2] - P1[0]
+    A[..., 1, :] = x1[:, 1, None] * P1[2] - P1[1]
+    A[..., 2, :] = x2[:, 0, None] * P2[..., None, 2, :] - P2[..., None, 0, :]
+    A[..., 3, :] = x2[:, 1, None] * P2[..., None, 2, :] - P2[..., None, 1, :]
+
+    #solve for x
+    _, _, Vt = np.linalg.svd(A)
+    X = Vt[..., -1, :]
+    return X[..., :3] / X[..., 3:] # convert to non-homogeneous coordinates
+
+
+@profiling.timed('triangulation')
+def triangulate_midpoint(P1, P2, x1, x2):
+    """
+    Triangulate many points at once as the midpoint of the shortest segment
+    between the two viewing rays (closed form, no SVD).
+
+    Args:
+        Same as `triangulate_dlt`.
+
+    Returns:
+        points_3d: (N, 3) points, or (C, N, 3) for C candidate matrices.
+    """
+    def rays(P, x):
+        # camera center and (unnormalized) ray direction of every point
+        M_inv = np.linalg.inv(P[..., :3])
+        center = -(M_inv @ P[..., 3:])[..., 0]
+        x_h = np.column_stack((np.asarray(x, dtype=float)[:, :2], np.ones(len(x))))
+        return center[..., None, :], x_h @ np.swapaxes(M_inv, -1, -2)
+
+    c1, d1 = rays(np.asarray(P1, dtype=float), x1)
+    c2, d2 = rays(np.asarray(P2, dtype=float), x2)
+
+    # minimize |c1 + s d1 - c2 - u d2| over the ray parameters s, u
+    w = c1 - c2
+    a = np.sum(d1 * d1, axis=-1)
+    b = np.sum(d1 * d2, axis=-1)
+    c = np.sum(d2 * d2, axis=-1)
+    d = np.sum(d1 * w, axis=-1)
+    e = np.sum(d2 * w, axis=-1)
+    denom = a * c - b**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (b * e - c * d) / denom
+        u = (a * e - b * d) / denom
+
+    return (c1 + s[..., None] * d1 + c2 + u[..., None] * d2) / 2
+
+
+TRIANGULATION_METHODS = {
+    'dlt': triangulate_dlt,
+    'midpoint': triangulate_midpoint,
+}
+
+
+def triangulate_points(p1,p2,keypoints1,keypoints2,matches, method='dlt'):
     """
     Triangulate 3D points from two views.
     
     Args:
         P1: Projection matrix for the first camera (3x4).
-        P2: Projection matrix for the second camera (3x4).
+        P2: Projection matrix for the second camera (3x4), or (C, 3, 4)
+            candidate matrices to triangulate all of them in one call.
         keypoints1: List of keypoints in the first image.
         keypoints2: List of keypoints in the second image.
         matches: List of matched keypoint indices.
+        method: 'dlt' or 'midpoint'.
     
     Returns:
-        points_3d: List of triangulated 3D points.
+        points_3d: (N, 3) array of triangulated 3D points, or (C, N, 3).
+    """
+    matches = np.asarray(matches, dtype=np.intp).reshape(-1, 2)
+    x1 = _image_points(keypoints1, matches[:, 0])
+    x2 = _image_points(keypoints2, matches[:, 1])
+
+    return TRIANGULATION_METHODS[method](p1, p2, x1, x2)
+
+
+def pose_candidates(R1, R2, t):
+    """
+    The four (R, t) combinations from `decompose_essential_matrix`, in the
+    order (R1, t), (R1, -t), (R2, t), (R2, -t).
+
+    Returns:
+        Rs: (4, 3, 3) rotations.
+        ts: (4, 3) translations.
+    """
+    t = np.asarray(t, dtype=float).reshape(3)
+    return np.stack((R1, R1, R2, R2)), np.stack((t, -t, t, -t))
+
+
+def select_pose(P1, P2_candidates, keypoints1, keypoints2, matches, method='dlt'):
     """
+    Triangulate the matches for all candidate second cameras in one call and
+    pick the first candidate that passes `check_cheirality`.
 
-    points_3d = []
+    Args:
+        P1: Projection matrix for the first camera (3x4).
+        P2_candidates: (C, 3, 4) candidate projection matrices for the second camera.
+        keypoints1, keypoints2: Keypoints of both images.
+        matches: List of matched keypoint indices.
+        method: 'dlt' or 'midpoint'.
 
-    for (i,j) in matches:
-        x1 = np.array([keypoints1[i][0], keypoints1[i][1],1]) #homogeneous coordinates
-        x2 = np.array([keypoints2[j][0], keypoints2[j][1],1])
+    Returns:
+        index: Index of the selected candidate, None if none passes.
+        points_3d: (N, 3) points triangulated with the selected candidate.
+        in_front: (N,) mask of the points in front of both cameras.
+    """
+    points_3d = triangulate_points(P1, P2_candidates, keypoints1, keypoints2, matches, method)
+    depth1, depth2 = point_depths(P1, P2_candidates, points_3d)
+    in_front = (depth1 > 0) & (depth2 > 0)
 
-        # TRiangulate the 3D point
-        x = triangulate_point(p1,p2,x1,x2)
-        points_3d.append(x)
+    n = points_3d.shape[1]
+    passes = (np.sum(depth1 > 0, axis=-1) > 0.5*n) & (np.sum(depth2 > 0, axis=-1) > 0.5*n)
+    if not np.any(passes):
+        return None, None, None
 
-    return np.array(points_3d)
+    index = int(np.argmax(passes))
+    return index, points_3d[index], in_front[index]
 
 
-def triangulate_and_color(P1, P2, keypoints1, keypoints2, matches, color_image, points_3d_list, colors_list):
-    for (i, j) in matches:
-        x1 = np.array([keypoints1[i][0], keypoints1[i][1], 1])
-        x2 = np.array([keypoints2[j][0], keypoints2[j][1], 1])
+def point_colors(keypoints1, matches, color_image):
+    """
+    Color of every match, read from the first image at its keypoint.
 
+    Returns:
+        colors: (N, 3) colors normalized to [0, 1].
+    """
+    matches = np.asarray(matches, dtype=np.intp).reshape(-1, 2)
+    x1 = _image_points(keypoints1, matches[:, 0]).astype(int)
+    return color_image[x1[:, 1], x1[:, 0]] / 255.0
+
+
+def triangulate_and_color(P1, P2, keypoints1, keypoints2, matches, color_image, points_3d_list, colors_list, points_3d=None):
+    """
+    Append the triangulated points with positive depth, and their colors from
+    the first image, to points_3d_list and colors_list. Pass points_3d when
+    the matches are already triangulated with P1, P2 to skip that step.
+    """
+    if points_3d is None:
         # Triangulate the 3D point
-        X = triangulate_point(P1, P2, x1, x2)
-        
-        # Only keep valid points (positive depth)
-        if X[2] > 0:
-            points_3d_list.append(X)
+        points_3d = triangulate_points(P1, P2, keypoints1, keypoints2, matches)
+
+    # Only keep valid points (positive depth)
+    valid = points_3d[:, 2] > 0
+    colors = point_colors(keypoints1, matches, color_image)
 
-            # Assign color to the 3D point using the first image's color data
-            color = color_image[int(keypoints1[i][1]), int(keypoints1[i][0])]
-            colors_list.append(color / 255.0)  # Normalize color values to [0, 1]
+    points_3d_list.extend(points_3d[valid])
+    colors_list.extend(colors[valid])
 
     return points_3d_list, colors_list
 
 
+def point_depths(P1, P2, points_3d):
+    """
+    Depth of the points in both cameras; P2 and points_3d may carry a
+    leading candidate axis.
+
+    Returns:
+        depth1, depth2: Arrays of the shape of points_3d without its last axis.
+    """
+    depth1 = points_3d @ P1[2, :3] + P1[2, 3]
+    depth2 = np.einsum('...nk,...k->...n', points_3d, np.asarray(P2)[..., 2, :3]) + np.asarray(P2)[..., None, 2, 3]
+    return depth1, depth2
+
+
 def check_cheirality(P1, P2, points_3d):
     """
     Check the cheirality condition for triangulated 3D points.
@@ -1,8 +1,11 @@
 
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-from open3d import geometry, io, visualization, utility
+
+import ply
+
+# matplotlib and Open3D are only imported when something is displayed
+
 
 def plot_3d_points(points_3d):
     """
@@ -11,6 +14,8 @@ def plot_3d_points(points_3d):
     Args:
         points_3d: Array of 3D points (Nx3).
     """
+    import matplotlib.pyplot as plt
+
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
     
@@ -22,25 +27,36 @@ def plot_3d_points(points_3d):
     plt.show()
 
 def save_point_cloud(points_3d, colors,out_dir, filename="output_cloud.ply"):
-    points = np.array(points_3d)
-    colors = np.array(colors)
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    out_dir = os.path.join(base_dir, '../results/pointcloud/')
+    ply.write_point_cloud(os.path.join(out_dir, filename), points_3d, colors)
 
-    # Create Open3D point cloud object
-    point_cloud = geometry.PointCloud()
-    point_cloud.points = utility.Vector3dVector(points)
-    point_cloud.colors = utility.Vector3dVector(colors)
 
-    io.write_point_cloud(str(out_dir+filename), point_cloud)
+def save_point_cloud_with_trajectory(points_3d, colors, camera_positions,out_dir, filename="output_with_trajectory.ply", show=False):
+    """
+    Write the point cloud and the camera trajectory to out_dir/filename as a
+    binary PLY file, and optionally display them.
+
+    Args:
+        points_3d: Points (Nx3).
+        colors: Colors (Nx3), uint8 or floats in [0, 1].
+        camera_positions: Camera centers (Mx3), joined in order by red edges.
+        out_dir: Output directory, created if needed.
+        filename: Name of the PLY file.
+        show: Open an Open3D window with the result (blocks until closed).
+    """
+    ply.write_point_cloud(os.path.join(out_dir, filename), points_3d, colors, camera_positions)
 
+    if show:
+        view_point_cloud_with_trajectory(points_3d, colors, camera_positions)
+
+
+def view_point_cloud_with_trajectory(points_3d, colors, camera_positions):
+    from open3d import geometry, visualization, utility
+
+    points = np.asarray(points_3d, dtype=np.float64)
+    colors = np.asarray(colors)
+    if colors.dtype == np.uint8:
+        colors = colors / 255.0
 
-def save_point_cloud_with_trajectory(points_3d, colors, camera_positions,out_dir, filename="output_with_trajectory.ply"):
-    points = np.array(points_3d)
-    colors = np.array(colors)
-    
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    out_dir = os.path.join(base_dir, '../results/pointcloud/')
     # Create an Open3D point cloud object
     point_cloud = geometry.PointCloud()
 
@@ -58,14 +74,13 @@ def save_point_cloud_with_trajectory(points_3d, colors, camera_positions,out_dir
     line_set.lines = utility.Vector2iVector(trajectory_lines)
     line_set.colors = utility.Vector3dVector(trajectory_color)
 
-    # Save the point cloud and camera trajectory
-    io.write_point_cloud(str(out_dir+filename), point_cloud)
-
     # Visualize point cloud and camera trajectory
     visualization.draw_geometries([point_cloud, line_set])
 
 
 def visualize_point_cloud(points_3d, colors):
+    from open3d import geometry, visualization, utility
+
     points = np.array(points_3d)
     colors = np.array(colors)
 
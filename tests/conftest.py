@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules in src import each other by their flat names
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+
+import cache as ch
+
+
+def entries(cache_dir, kind):
+    return sorted(name for name in os.listdir(os.path.join(cache_dir, kind)))
+
+
+def test_key_depends_on_content_dtype_shape_and_parameters():
+    image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    key = ch.ArrayCache.key(image, {'k': 0.04, 'window_size': 5}, 9)
+
+    assert key == ch.ArrayCache.key(image.copy(), {'window_size': 5, 'k': 0.04}, 9)
+    assert key == ch.ArrayCache.key(np.asfortranarray(image), {'k': 0.04, 'window_size': 5}, 9)
+    assert key != ch.ArrayCache.key(image.astype(np.int16), {'k': 0.04, 'window_size': 5}, 9)
+    assert key != ch.ArrayCache.key(image.reshape(4, 3), {'k': 0.04, 'window_size': 5}, 9)
+    assert key != ch.ArrayCache.key(image + 1, {'k': 0.04, 'window_size': 5}, 9)
+    assert key != ch.ArrayCache.key(image, {'k': 0.05, 'window_size': 5}, 9)
+
+
+def test_store_and_reload(tmp_path):
+    cache = ch.ArrayCache(str(tmp_path))
+    keypoints = np.arange(10).reshape(5, 2)
+    descriptors = np.random.default_rng(0).random((5, 81)).astype(np.float32)
+    cache.store('features', 'a', keypoints=keypoints, descriptors=descriptors)
+
+    assert cache.load('features', 'b') is None
+    # also from a new cache opened on the same directory
+    for reader in (cache, ch.ArrayCache(str(tmp_path))):
+        loaded = reader.load('features', 'a')
+        np.testing.assert_array_equal(loaded['keypoints'], keypoints)
+        np.testing.assert_array_equal(loaded['descriptors'], descriptors)
+        assert loaded['descriptors'].dtype == np.float32
+
+
+def test_failed_write_leaves_no_partial_entry(tmp_path, monkeypatch):
+    cache = ch.ArrayCache(str(tmp_path))
+    cache.store('features', 'a', values=np.zeros(10))
+
+    def failing_savez(file, **arrays):
+        file.write(b'partial')
+        raise OSError("disk full")
+    monkeypatch.setattr(np, 'savez', failing_savez)
+    with pytest.raises(OSError):
+        cache.store('features', 'a', values=np.ones(10))
+    monkeypatch.undo()
+
+    # the old entry is intact and no temporary file is left behind
+    assert entries(str(tmp_path), 'features') == ['a.npz']
+    np.testing.assert_array_equal(cache.load('features', 'a')['values'], np.zeros(10))
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = ch.ArrayCache(str(tmp_path))
+    os.makedirs(tmp_path / 'features')
+    (tmp_path / 'features' / 'a.npz').write_bytes(b'PK not a zip file')
+    assert cache.load('features', 'a') is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry = np.zeros(1000)  # about 8 KB per entry
+    cache = ch.ArrayCache(str(tmp_path), max_bytes=int(3.5 * entry.nbytes))
+    for key in 'abc':
+        cache.store('features', key, values=entry)
+    assert entries(str(tmp_path), 'features') == ['a.npz', 'b.npz', 'c.npz']
+
+    # using 'a' makes 'b' the least recently used entry
+    assert cache.load('features', 'a') is not None
+    cache.store('features', 'd', values=entry)
+    assert entries(str(tmp_path), 'features') == ['a.npz', 'c.npz', 'd.npz']
+
+    # a reopened cache takes the use order from the modification times
+    for key, mtime in (('d', 100), ('a', 200), ('c', 300)):
+        os.utime(tmp_path / 'features' / f'{key}.npz', (mtime, mtime))
+    reopened = ch.ArrayCache(str(tmp_path), max_bytes=int(3.5 * entry.nbytes))
+    reopened.store('features', 'e', values=entry)
+    assert entries(str(tmp_path), 'features') == ['a.npz', 'c.npz', 'e.npz']
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import feature_detection as fd
+
+
+KERNELS = {
+    'sobel': np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]]),
+    'gaussian5': np.outer([1, 4, 6, 4, 1], [1, 4, 6, 4, 1]) / 256,
+    'rectangular': np.arange(15, dtype=float).reshape(3, 5) / 7 - 1,
+    'row': np.array([[0.25, 0.5, 0.25]]),
+}
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.int16, np.float32, np.float64])
+@pytest.mark.parametrize('kernel', KERNELS, ids=str)
+def test_convolve_matches_loop(dtype, kernel):
+    rng = np.random.default_rng(0)
+    if np.issubdtype(dtype, np.integer):
+        image = rng.integers(0, 100, size=(23, 31)).astype(dtype)
+    else:
+        image = (rng.random((23, 31)) * 255).astype(dtype)
+
+    with np.errstate(over='ignore'):
+        expected = fd.convolve_loop(image, KERNELS[kernel])
+    result = fd.convolve(image, KERNELS[kernel])
+
+    assert result.dtype == expected.dtype
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('window_size', [3, 5])
+def test_extract_keypoints_matches_loop(window_size):
+    rng = np.random.default_rng(1)
+    # quantized responses so that plateaus (ties) occur
+    R = np.round(rng.random((40, 50)) * 20)
+    threshold = 10
+
+    expected = [(x, y) for y in range(R.shape[0]) for x in range(R.shape[1])
+                if R[y, x] > threshold and fd.is_local_maxima(R, (x, y), window_size)]
+    keypoints = fd.extract_keypoints(R, threshold, window_size)
+    np.testing.assert_array_equal(keypoints, np.array(expected).reshape(-1, 2))
+
+
+def test_adaptive_non_maximal_suppression_matches_brute_force():
+    rng = np.random.default_rng(2)
+    keypoints = rng.integers(0, 200, size=(500, 2))
+    responses = rng.pareto(1.0, size=500) + 1
+    c_robust = 0.9
+
+    # radius: distance to the nearest keypoint that still dominates after scaling
+    dist = np.linalg.norm(keypoints[:, None].astype(float) - keypoints[None], axis=2)
+    dominated = responses[:, None] < c_robust * responses[None, :]
+    radii = np.where(dominated, dist, np.inf).min(axis=1)
+
+    # small chunks and budget so that several chunks are needed
+    selected = fd.adaptive_non_maximal_suppression(keypoints, responses, 100, c_robust, chunk_size=64, max_elements=4096)
+    np.testing.assert_array_equal(np.sort(radii[selected])[::-1], np.sort(radii)[::-1][:100])
+    assert np.all(np.diff(radii[selected]) <= 0)
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+import feature_matching as fm
+
+
+def descriptors(n_1, n_2, dim=81, n_shared=None, noise=0.3, seed=0):
+    # normalized patches where the first n_shared of desc_2 are noisy copies of desc_1
+    rng = np.random.default_rng(seed)
+    n_shared = min(n_1, n_2) // 2 if n_shared is None else n_shared
+    desc_1 = rng.standard_normal((n_1, dim))
+    desc_2 = rng.standard_normal((n_2, dim))
+    desc_2[:n_shared] = desc_1[:n_shared] + noise * rng.standard_normal((n_shared, dim))
+    return desc_1.astype(np.float32), desc_2.astype(np.float32)
+
+
+@pytest.mark.parametrize('ratio_threshold', [0.6, 0.8, 0.95])
+def test_match_features_matches_loop(ratio_threshold):
+    desc_1, desc_2 = descriptors(300, 400)
+    expected = fm.match_features_loop(desc_1, desc_2, ratio_threshold)
+    matches = fm.match_features(desc_1, desc_2, ratio_threshold, chunk_size=64)
+    assert [(int(i), int(j)) for i, j in expected] == matches
+    assert 0 < len(matches) < len(desc_1)
+
+
+def test_match_features_bidirectional_matches_loop():
+    desc_1, desc_2 = descriptors(300, 250, seed=1)
+    expected = fm.match_features_bidirectional_loop(desc_1, desc_2, 0.75)
+    matches = fm.match_features_bidirectional(desc_1, desc_2, 0.75, chunk_size=64)
+    assert [(int(i), int(j)) for i, j in expected] == matches
+
+
+def test_lsh_recall_against_brute_force():
+    desc_1, desc_2 = descriptors(1000, 1500, n_shared=600, seed=2)
+    expected = set(fm.match_features(desc_1, desc_2))
+    index = fm.LSHIndex(desc_2, n_tables=4, n_bits=8, n_probes=2)
+    matches = set(fm.match_features(desc_1, desc_2, index=index))
+
+    recall = len(matches & expected) / len(expected)
+    precision = len(matches & expected) / len(matches)
+    assert recall > 0.9
+    assert precision > 0.9
+
+
+def epipolar_setup(n_1=400, n_2=500, seed=0):
+    # F = [t]x: the epipolar lines of both images go through (320, 240)
+    rng = np.random.default_rng(seed)
+    desc_1, desc_2 = descriptors(n_1, n_2, n_shared=0, seed=seed)
+    keypoints1 = rng.uniform((0, 0), (640, 480), (n_1, 2))
+    keypoints2 = rng.uniform((0, 0), (640, 480), (n_2, 2))
+    t = np.array([320.0, 240.0, 1.0])
+    F = np.array([[0, -t[2], t[1]], [t[2], 0, -t[0]], [-t[1], t[0], 0]])
+    return desc_1, desc_2, keypoints1, keypoints2, F
+
+
+def line_distances(F, keypoints1, keypoints2):
+    # (N, M) distances of the second-image keypoints to the epipolar lines of the first ones
+    lines = np.column_stack((keypoints1, np.ones(len(keypoints1)))) @ F.T
+    return np.abs(lines[:, :2] @ keypoints2.T + lines[:, 2:]) / np.linalg.norm(lines[:, :2], axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('threshold', [2.0, 10.0])
+def test_guided_matching_matches_band_brute_force(threshold):
+    desc_1, desc_2, keypoints1, keypoints2, F = epipolar_setup()
+    matches = fm.match_features_guided(desc_1, desc_2, keypoints1, keypoints2, F, ratio_threshold=0.95,
+                                       threshold=threshold, chunk_size=64)
+
+    # brute force ratio test among the keypoints within threshold of each line
+    distances = line_distances(F, keypoints1, keypoints2)
+    expected = []
+    for i in range(len(desc_1)):
+        band = np.flatnonzero(distances[i] < threshold)
+        if len(band) < 2:
+            continue
+        descriptor_distances = np.linalg.norm(desc_2[band] - desc_1[i], axis=1)
+        first, second = np.argsort(descriptor_distances)[:2]
+        if descriptor_distances[first] < 0.95 * descriptor_distances[second]:
+            expected.append((i, int(band[first])))
+    assert matches == expected
+    assert len(matches) > 0
+    assert all(distances[i, j] < threshold for i, j in matches)
+
+
+def test_guided_matching_skips_keypoints_at_the_epipole():
+    desc_1, desc_2, keypoints1, keypoints2, F = epipolar_setup(seed=1)
+    keypoints1[:10] = (320, 240)
+    with np.errstate(all='raise'):
+        matches = fm.match_features_guided(desc_1, desc_2, keypoints1, keypoints2, F, ratio_threshold=0.95,
+                                           threshold=10.0)
+    assert len(matches) > 0
+    assert all(i >= 10 for i, _ in matches)
+
+
+def unpacked_hamming(desc_1, desc_2):
+    # (N, M) Hamming distances counted on the unpacked bits
+    bits_1, bits_2 = np.unpackbits(desc_1, axis=1), np.unpackbits(desc_2, axis=1)
+    return (bits_1[:, None] != bits_2[None]).sum(axis=2)
+
+
+# 32 bytes are XORed as 64-bit words, 33 bytes fall back to the byte table
+@pytest.mark.parametrize('n_bytes', [32, 33])
+@pytest.mark.parametrize('bitwise_count', [True, False])
+def test_hamming_matches_unpacked_bits(monkeypatch, n_bytes, bitwise_count):
+    if not bitwise_count:
+        monkeypatch.delattr(np, 'bitwise_count', raising=False)
+    rng = np.random.default_rng(n_bytes)
+    desc_1 = rng.integers(0, 256, (300, n_bytes), dtype=np.uint8)
+    desc_2 = rng.integers(0, 256, (200, n_bytes), dtype=np.uint8)
+    # some exact copies and near copies for ties and small distances
+    desc_2[:20] = desc_1[:20]
+    desc_2[20:40] = desc_1[20:40] ^ (1 << rng.integers(0, 8, (20, n_bytes))).astype(np.uint8) * (rng.random((20, n_bytes)) < 0.05)
+    expected = unpacked_hamming(desc_1, desc_2)
+
+    np.testing.assert_array_equal(fm.hamming_distance(desc_1[:, None], desc_2[None]), expected)
+    np.testing.assert_array_equal(fm.hamming_distance(desc_1[:200], desc_2), np.diagonal(expected[:200]))
+
+    best_idx, best_distance, second_distance, back_idx = fm._hamming_nearest_neighbours(desc_1, desc_2, chunk_size=64,
+                                                                                        reverse=True)
+    np.testing.assert_array_equal(best_idx, np.argmin(expected, axis=1))
+    np.testing.assert_array_equal(best_distance, expected.min(axis=1))
+    np.testing.assert_array_equal(second_distance, np.sort(expected, axis=1)[:, 1])
+    np.testing.assert_array_equal(back_idx, np.argmin(expected, axis=0))
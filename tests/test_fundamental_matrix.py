@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import evaluation as ev
+import fundamental_matrix as fdm
+
+
+K = np.array([[300.0, 0, 160], [0, 300.0, 120], [0, 0, 1]])
+
+
+def test_ransac_F_degenerate_matches_give_no_model():
+    # every keypoint at the same pixel: no 8-point sample has a solution
+    keypoints = np.tile([[100.0, 50.0]], (40, 1))
+    matches = [(i, i) for i in range(40)]
+    with np.errstate(all='ignore'):
+        F, inliers = fdm.ransac_F(matches, keypoints, keypoints, seed=0)
+    assert F is None
+    assert inliers == []
+
+
+def test_ransac_E_without_valid_solutions_gives_no_model(monkeypatch):
+    def five_point(x1, x2):
+        batch = len(x1)
+        return np.zeros((batch, 10, 3, 3)), np.zeros((batch, 10), dtype=bool)
+    monkeypatch.setattr(fdm, 'five_point', five_point)
+
+    rng = np.random.default_rng(0)
+    matches = [(i, i) for i in range(40)]
+    E, inliers = fdm.ransac_E(matches, rng.uniform(0, 300, (40, 2)), rng.uniform(0, 300, (40, 2)), K, seed=0)
+    assert E is None
+    assert inliers == []
+
+
+def true_fundamental(scene):
+    t = scene['t']
+    t_cross = np.array([[0, -t[2], t[1]], [t[2], 0, -t[0]], [-t[1], t[0], 0]])
+    K_inv = np.linalg.inv(scene['K'])
+    F = K_inv.T @ t_cross @ scene['R'] @ K_inv
+    return F / np.linalg.norm(F)
+
+
+def same_up_to_sign(F1, F2):
+    return min(np.linalg.norm(F1 - F2), np.linalg.norm(F1 + F2))
+
+
+def test_normalized_eight_point_recovers_F():
+    scene = ev.synthetic_two_view(n_points=200, outlier_ratio=0.0, noise=0.0, seed=0)
+    x1, x2 = fdm.homogeneous_matches(scene['matches'], scene['keypoints1'], scene['keypoints2'])
+    F = fdm.eight_point(x1, x2, normalize=True)
+    assert same_up_to_sign(F, true_fundamental(scene)) < 1e-6
+    assert np.linalg.matrix_rank(F, tol=1e-10) == 2
+
+
+def test_ransac_F_finds_inliers_and_stops_early():
+    scene = ev.synthetic_two_view(n_points=500, outlier_ratio=0.3, noise=0.5, seed=1)
+    F, inliers, info = fdm.ransac_F(scene['matches'], scene['keypoints1'], scene['keypoints2'],
+                                    num_iterations=5000, threshold=2.0, seed=0, return_info=True)
+
+    found = np.zeros(len(scene['matches']), dtype=bool)
+    found[[i for i, _ in inliers]] = True
+    assert np.mean(found == scene['inliers']) > 0.97
+    assert same_up_to_sign(F, true_fundamental(scene)) < 0.05
+
+    # adaptive termination: far fewer hypotheses than the cap
+    needed = fdm.ransac_iterations_needed(info['inliers'] / len(found), 8, 0.99)
+    assert info['iterations'] < 5000
+    assert info['iterations'] < needed + 64
+
+
+def test_ransac_iterations_needed():
+    assert fdm.ransac_iterations_needed(0.0, 8, 0.99) == np.inf
+    assert fdm.ransac_iterations_needed(1.0, 8, 0.99) == 0
+    assert np.isclose(fdm.ransac_iterations_needed(0.5, 8, 0.99), np.log(0.01) / np.log(1 - 0.5**8))
+
+
+def test_epipolar_errors_hand_computed():
+    # pure translation along x: epipolar lines are the image rows
+    F = np.array([[0.0, 0, 0], [0, 0, -1], [0, 1, 0]])
+    x1 = np.array([[0.0, 0, 1], [5, 3, 1]])
+    x2 = np.array([[0.0, 2, 1], [9, 3, 1]])
+
+    # x2^T F x1 = y1 - y2; both points are 2 pixels from their epipolar line, the second one is on it
+    np.testing.assert_allclose(fdm.epipolar_error(F, x1, x2, 'algebraic'), [2, 0])
+    np.testing.assert_allclose(fdm.algebraic_error(F, x1, x2), [2, 0])
+    np.testing.assert_allclose(fdm.epipolar_error(F, x1, x2, 'sampson'), [np.sqrt(2), 0])
+    np.testing.assert_allclose(fdm.epipolar_error(F, x1, x2, 'symmetric'), [2 * np.sqrt(2), 0])
+    with pytest.raises(ValueError):
+        fdm.epipolar_error(F, x1, x2, 'geometric')
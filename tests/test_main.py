@@ -0,0 +1,131 @@
+import sys
+
+import numpy as np
+import pytest
+
+import evaluation as ev
+import feature_matching as fm
+import fundamental_matrix as fdm
+import helper as hp
+import main
+import reconstruction as rc
+
+
+K = np.array([[300.0, 0, 160], [0, 300.0, 120], [0, 0, 1]])
+
+
+def parse(monkeypatch, *options):
+    monkeypatch.setattr(sys, 'argv', ['main.py', '--image_dir', '.', '--data_name', 'colmap', *options])
+    return hp.parse_arguments()
+
+
+@pytest.mark.parametrize('estimator', ['8point', '5point'])
+def test_degenerate_pairs_are_skipped(monkeypatch, estimator):
+    args = parse(monkeypatch, '--estimator', estimator, '--ba_window', '0')
+    if estimator == '5point':
+        monkeypatch.setattr(fdm, 'five_point', lambda x1, x2: (np.zeros((len(x1), 10, 3, 3)),
+                                                               np.zeros((len(x1), 10), dtype=bool)))
+
+    # identical descriptors match perfectly, but all keypoints are at one pixel
+    keypoints = np.tile([[100.0, 50.0]], (200, 1))
+    matches = [(i, i) for i in range(200)]
+    with np.errstate(all='ignore'):
+        assert main.estimate_essential(args, K, keypoints, keypoints, matches) == (None, [])
+        assert main.two_view_pose(args, K, keypoints, keypoints, None, matches) is None
+
+        # shared descriptors match, distinct ones make the images retrievable
+        rng = np.random.default_rng(0)
+        shared = rng.standard_normal((150, 81))
+        features = [(keypoints, np.concatenate((shared, rng.standard_normal((50, 81)))).astype(np.float32))
+                    for _ in range(3)]
+        reconstruction = rc.Reconstruction(K)
+        main.reconstruct_unordered(args, K, None, features, [None] * 3, reconstruction)
+    assert not reconstruction.initialized
+
+
+def test_lsh_index_is_built_once_per_image(monkeypatch):
+    args = parse(monkeypatch, '--matcher', 'lsh')
+    built = []
+
+    class CountingIndex(fm.LSHIndex):
+        def __init__(self, descriptors, **kwargs):
+            built.append(len(descriptors))
+            super().__init__(descriptors, **kwargs)
+    monkeypatch.setattr(fm, 'LSHIndex', CountingIndex)
+
+    rng = np.random.default_rng(0)
+    descriptors = [rng.standard_normal((200, 81)).astype(np.float32) for _ in range(3)]
+    indexes = {}
+    for i, j in [(0, 2), (1, 2), (0, 1)]:
+        main.match_pair(args, None, descriptors[i], descriptors[j], indexes, j)
+    assert len(built) == 2
+    assert sorted(indexes) == [1, 2]
+
+
+def sequence(n_cameras=5, seed=1):
+    # descriptors of the same point agree up to noise, so brute force matching finds the tracks
+    scene = ev.synthetic_multi_view(n_cameras=n_cameras, n_points=1500, noise=0.5, seed=seed)
+    rng = np.random.default_rng(seed)
+    point_descriptors = rng.standard_normal((len(scene['points_3d']), 81))
+    features = []
+    for c in range(n_cameras):
+        observed = scene['cameras'] == c
+        descriptors = point_descriptors[scene['points'][observed]] + 0.05 * rng.standard_normal((observed.sum(), 81))
+        features.append((scene['keypoints'][observed], descriptors.astype(np.float32)))
+    return scene, features
+
+
+def run_sequence(args, scene, features, failed=(), unusable=(), klt=False):
+    # the incremental branch of the sequential loop of main, with some pairs failing
+    reconstruction = rc.Reconstruction(scene['K'])
+    for keypoints, _ in features:
+        reconstruction.add_image(keypoints)
+    references = {}
+    for i in range(len(features) - 1):
+        (keypoints1, descr1), (keypoints2, descr2) = features[i], features[i + 1]
+        E, inliers = None, []
+        if i not in failed and i + 1 not in unusable:
+            matches = main.match_pair(args, None, descr1, descr2)
+            E, inliers = main.estimate_essential(args, scene['K'], keypoints1, keypoints2, matches)
+        if klt or i + 1 in unusable:
+            descr2 = None
+        main.register_sequential(args, scene['K'], None, reconstruction, i + 1, i, keypoints2, descr2, E, inliers, references)
+        for image, descriptors in ((i, descr1), (i + 1, descr2)):
+            if not klt and image not in unusable and reconstruction.is_registered(image):
+                references[image] = descriptors
+    return reconstruction
+
+
+def scaled_centers(scene, reconstruction, images):
+    # the reconstruction has the scale of its first baseline
+    true_centers = -np.einsum('cji,cj->ci', scene['rotations'], scene['translations'])
+    centers = reconstruction.poses.centers(images)
+    scale = np.linalg.norm(true_centers[1] - true_centers[0]) / np.linalg.norm(centers[1] - centers[0])
+    return scale * centers, true_centers[images]
+
+
+def test_failed_pair_registers_against_other_images(monkeypatch):
+    args = parse(monkeypatch, '--ba_window', '0')
+    scene, features = sequence()
+
+    # the pair (2, 3) fails, image 3 is registered against image 1 instead
+    reconstruction = run_sequence(args, scene, features, failed={2})
+    assert list(reconstruction.registered_images()) == [0, 1, 2, 3, 4]
+    np.testing.assert_allclose(*scaled_centers(scene, reconstruction, [0, 1, 2, 3, 4]), atol=0.02)
+
+    # image 3 has no usable features, image 4 is registered against image 2 instead of being dropped
+    reconstruction = run_sequence(args, scene, features, unusable={3})
+    assert list(reconstruction.registered_images()) == [0, 1, 2, 4]
+    np.testing.assert_allclose(*scaled_centers(scene, reconstruction, [0, 1, 2, 4]), atol=0.02)
+
+
+def test_failed_pair_without_descriptors_chains_last_pose(monkeypatch):
+    args = parse(monkeypatch, '--ba_window', '0')
+    scene, features = sequence()
+
+    # only consecutive matches, as with the KLT tracker: image 3 is placed at the pose of image 2
+    reconstruction = run_sequence(args, scene, features, failed={2}, klt=True)
+    assert list(reconstruction.registered_images()) == [0, 1, 2, 3, 4]
+    centers = reconstruction.poses.centers([2, 3, 4])
+    np.testing.assert_allclose(centers[1], centers[0])
+    assert np.linalg.norm(centers[2] - centers[1]) > 0
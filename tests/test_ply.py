@@ -0,0 +1,47 @@
+import numpy as np
+
+import ply
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    points = rng.standard_normal((1000, 3))
+    colors = rng.integers(0, 256, (1000, 3), dtype=np.uint8)
+    cameras = rng.standard_normal((5, 3))
+    path = str(tmp_path / 'cloud.ply')
+
+    # small chunks, float colors and a broadcast color
+    with ply.PlyWriter(path, chunk_size=64) as writer:
+        writer.write_vertices(points[:600], colors[:600])
+        writer.write_vertices(points[600:], colors[600:] / 255.0)
+        camera_ids = writer.write_vertices(cameras, np.array([255, 0, 0], dtype=np.uint8))
+        writer.write_edges(np.column_stack((camera_ids[:-1], camera_ids[1:])), np.array([0, 255, 0], dtype=np.uint8))
+
+    with open(path, 'rb') as file:
+        header = file.read(200).split(b'end_header')[0].decode('ascii')
+    assert f"element vertex {1005:010d}" in header
+    assert f"element edge {4:010d}" in header
+
+    vertices, edges = ply.read_ply(path)
+    assert len(vertices) == 1005 and len(edges) == 4
+    xyz = np.column_stack([vertices[name] for name in ('x', 'y', 'z')])
+    rgb = np.column_stack([vertices[name] for name in ('red', 'green', 'blue')])
+    np.testing.assert_allclose(xyz, np.concatenate((points, cameras)).astype(np.float32))
+    np.testing.assert_array_equal(rgb[:1000], colors)
+    np.testing.assert_array_equal(rgb[1000:], np.tile([255, 0, 0], (5, 1)))
+    np.testing.assert_array_equal(edges['vertex1'], np.arange(1000, 1004))
+    np.testing.assert_array_equal(edges['vertex2'], np.arange(1001, 1005))
+    np.testing.assert_array_equal(np.column_stack([edges[name] for name in ('red', 'green', 'blue')]),
+                                  np.tile([0, 255, 0], (4, 1)))
+
+
+def test_write_point_cloud(tmp_path):
+    rng = np.random.default_rng(1)
+    points = rng.standard_normal((50, 3))
+    path = str(tmp_path / 'out' / 'cloud.ply')
+    ply.write_point_cloud(path, points, np.full((50, 3), 0.5), camera_positions=np.zeros((3, 3)))
+
+    vertices, edges = ply.read_ply(path)
+    assert len(vertices) == 53 and len(edges) == 2
+    np.testing.assert_array_equal(vertices['red'][:50], 128)
+    np.testing.assert_array_equal(edges['vertex1'], [50, 51])
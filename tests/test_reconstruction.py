@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import camera_motion as cm
+import evaluation as ev
+import pnp
+import reconstruction as rc
+import triangulation as tg
+
+
+def test_p3p_recovers_pose():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        R = ev.rotation_matrix(rng.standard_normal(3), rng.uniform(-1, 1))
+        t = rng.standard_normal(3)
+        cam = rng.standard_normal((3, 3)) + (0, 0, 6)
+        points_3d = (cam - t) @ R
+        bearings = cam / np.linalg.norm(cam, axis=1, keepdims=True)
+
+        Rs, ts = pnp.p3p(points_3d, bearings)
+        errors = np.linalg.norm(Rs - R, axis=(1, 2)) + np.linalg.norm(ts - t, axis=1)
+        assert np.nanmin(errors) < 1e-5
+
+
+# a deep point cloud, and a thin slab where the points are nearly coplanar
+@pytest.mark.parametrize('depth_range', [(4.0, 12.0), (8.0, 8.2)])
+def test_register_multi_view_sequence(depth_range):
+    scene = ev.synthetic_multi_view(n_cameras=8, n_points=1500, noise=0.5, depth_range=depth_range, seed=1)
+    K, rotations, translations = scene['K'], scene['rotations'], scene['translations']
+    n_cameras = len(rotations)
+
+    reconstruction = rc.Reconstruction(K)
+    point_ids = []
+    for c in range(n_cameras):
+        observed = scene['cameras'] == c
+        reconstruction.add_image(scene['keypoints'][observed])
+        point_ids.append(scene['points'][observed])
+
+    def matches(c1, c2):
+        _, keypoints1, keypoints2 = np.intersect1d(point_ids[c1], point_ids[c2], return_indices=True)
+        return np.column_stack((keypoints1, keypoints2))
+
+    # start from the true two-view pose so that the scale is known
+    first = matches(0, 1)
+    P1 = cm.projection_matrix(K, rotations[0], translations[0])
+    P2 = cm.projection_matrix(K, rotations[1], translations[1])
+    points_3d = tg.triangulate_dlt(P1, P2, reconstruction.keypoints[0][first[:, 0]], reconstruction.keypoints[1][first[:, 1]])
+    reconstruction.initialize(0, 1, rotations[1], translations[1], first, points_3d)
+
+    for c in range(2, n_cameras):
+        assert reconstruction.register(c, c - 1, matches(c - 1, c), seed=0)
+
+    true_centers = -np.einsum('cji,cj->ci', rotations, translations)
+    np.testing.assert_allclose(reconstruction.camera_centers(), true_centers, atol=0.01)
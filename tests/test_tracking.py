@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import tracking as tk
+
+
+def texture(shape, shift=(0.0, 0.0), seed=0):
+    # smooth random texture sampled at (x - dx, y - dy), so a shift moves it by (dx, dy)
+    rng = np.random.default_rng(seed)
+    frequencies = rng.uniform(0.05, 0.3, (12, 2)) * rng.choice([-1, 1], (12, 2))
+    phases = rng.uniform(0, 2 * np.pi, 12)
+    y, x = np.mgrid[:shape[0], :shape[1]].astype(np.float64)
+    x, y = x - shift[0], y - shift[1]
+    waves = np.sin(frequencies[:, 0, None, None] * x + frequencies[:, 1, None, None] * y + phases[:, None, None])
+    return 128 + 10 * waves.sum(axis=0)
+
+
+@pytest.mark.parametrize('shift', [(0.3, -0.6), (2.7, 1.4), (-6.2, 4.5)])
+def test_lucas_kanade_recovers_subpixel_translation(shift):
+    previous = tk.image_pyramid(texture((120, 160)), levels=2)
+    current = tk.image_pyramid(texture((120, 160), shift), levels=2)
+    rng = np.random.default_rng(1)
+    points = rng.uniform((20, 20), (140, 100), (200, 2))
+
+    tracked, status = tk.lucas_kanade(previous, current, points)
+    # a few windows are too flat to track
+    assert status.mean() > 0.9
+    np.testing.assert_allclose(tracked[status] - points[status], np.broadcast_to(shift, (status.sum(), 2)), atol=0.05)
+
+
+def test_klt_tracker_rejects_occluded_tracks():
+    # the second frame is shifted, and a square is replaced by another texture
+    first = texture((120, 160))
+    second = texture((120, 160), (1.5, 0.5))
+    second[40:80, 60:100] = texture((120, 160), seed=1)[40:80, 60:100]
+    points = np.stack(np.meshgrid(np.arange(10.0, 150, 7), np.arange(10.0, 110, 7)), axis=-1).reshape(-1, 2)
+
+    kept = {}
+    for fb_threshold in (None, 1.0):
+        tracker = tk.KLTTracker(min_tracks=0, levels=2, fb_threshold=fb_threshold)
+        tracker.track(first)
+        tracker.keypoints = points
+        tracker.track_ids = np.arange(len(points))
+        keypoints, matches = tracker.track(second)
+        errors = np.linalg.norm(keypoints[matches[:, 1]] - points[matches[:, 0]] - (1.5, 0.5), axis=1)
+        kept[fb_threshold] = matches[:, 0], errors
+
+    # the forward-backward check drops most of the occluded points tracked to wrong places,
+    # only those tracked consistently both ways can survive it
+    wrong = {fb_threshold: np.sum(errors > 1.0) for fb_threshold, (_, errors) in kept.items()}
+    assert wrong[None] > 20
+    assert wrong[1.0] < wrong[None] / 4
+
+    # the points whose windows stay clear of the square are right, and nearly all are kept
+    previous, errors = kept[1.0]
+    clear = np.any((points < (60 - 8, 40 - 8)) | (points >= (100 + 8, 80 + 8)), axis=1)
+    assert np.mean(np.isin(np.flatnonzero(clear), previous)) > 0.9
+    assert np.all(errors[clear[previous]] < 0.2)